@@ -62,6 +62,8 @@ ae = dict(
     latent_channels=16,
     use_spatial_tiling=True,
     use_temporal_tiling=False,
+    tile_batch_size=None,  # same-shaped tiles are decoded together, as many as tile_memory_budget allows
+    tile_memory_budget=16,  # GB
 )
 t5 = dict(
     type="text_embedder",
@@ -0,0 +1,17 @@
+_base_ = [  # inherit grammer from mmengine
+    "256px.py",
+]
+
+sampling_option = dict(
+    num_frames=257,  # longer clips than the dense default
+)
+
+# structured sparse attention in the single stream blocks, text tokens stay global
+model = dict(
+    sparse_attention=dict(
+        blocks=(0, 38),  # [start, end) of the single stream blocks
+        block_size=(4, 0, 0),  # (t, h, w) tokens per block, 0 covers the whole axis
+        window=(1, 0, 0),  # neighbor blocks attended along (t, h, w)
+        global_frames=(0,),  # latent frames attended by every token
+    ),
+)
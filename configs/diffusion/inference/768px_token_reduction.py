@@ -0,0 +1,26 @@
+_base_ = [  # inherit grammer from mmengine
+    "256px.py",
+]
+
+sampling_option = dict(
+    resolution="768px",
+)
+
+# inference-time token reduction on the middle single stream blocks
+# not applied together with sequence parallelism, whose processors replace the single stream ones
+model = dict(
+    token_reduction=dict(
+        mode="merge",  # merge: merge similar image tokens, kv_downsample: attend to pooled image keys/values
+        blocks=(8, 30),  # [start, end) of the single stream blocks
+        ratio=0.5,  # merge: fraction of image tokens merged away
+        window=(1, 2, 2),  # merge: (t, h, w) window sharing one destination token
+    ),
+)
+
+# variants compared by scripts/diffusion/benchmark_token_reduction.py
+token_reduction_variants = [
+    dict(mode="merge", blocks=(8, 30), ratio=0.25, window=(1, 2, 2)),
+    dict(mode="merge", blocks=(8, 30), ratio=0.5, window=(1, 2, 2)),
+    dict(mode="kv_downsample", blocks=(8, 30), kv_stride=(1, 2, 2)),
+]
+num_samples = 4
@@ -3,7 +3,8 @@ _base_ = ["t2i2v_768px.py"]
 # no need for parallelism
 plugin = None
 plugin_config = None
-plugin_ae = None
+# DC-AE has no tensor parallel policy, its decode tiles are sharded over the ranks instead, prompts stay data parallel
+plugin_ae = "tile_parallel"
 plugin_config_ae = None
 
 # model settings
@@ -27,6 +28,8 @@ ae = dict(
     spatial_tile_size=256,
     temporal_tile_size=32,
     tile_overlap_factor=0.25,
+    tile_batch_size=None,  # same-shaped tiles are decoded together, as many as tile_memory_budget allows
+    tile_memory_budget=16,  # GB
 )
 ae_spatial_compression = 32
 
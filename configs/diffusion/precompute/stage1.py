@@ -0,0 +1,9 @@
+_base_ = ["../train/stage1.py"]
+
+# latents are computed for the buckets of the training config, use the same seed and bucket_config to train
+save_dir = "cache/latents"
+part_size = 1024  # samples per resumable part
+shard_size = 1024  # MB per store shard
+batch_size = None  # encode batch size, None for the batch sizes of bucket_config
+num_workers = 8
+prefetch_factor = 2
@@ -0,0 +1,40 @@
+# Randomly initialized small models to run the precompute pipeline on CPU, e.g. to test it without a GPU.
+dataset = dict(
+    type="video_text",
+    transform_name="resize_crop",
+    fps_max=24,
+)
+bucket_config = {
+    "64px": {1: (1.0, 8), 17: (1.0, 4)},
+}
+
+ae = dict(
+    type="hunyuan_vae",
+    from_pretrained=None,
+    in_channels=3,
+    out_channels=3,
+    layers_per_block=1,
+    latent_channels=16,
+    block_out_channels=(32, 32, 32, 32),
+    norm_num_groups=8,
+)
+t5 = dict(
+    type="text_embedder",
+    from_pretrained="hf-internal-testing/tiny-random-t5",
+    max_length=32,
+)
+clip = dict(
+    type="text_embedder",
+    from_pretrained="hf-internal-testing/tiny-random-clip",
+    max_length=16,
+    is_clip=True,
+)
+
+dtype = "fp32"
+seed = 1024
+save_dir = "cache/latents_tiny"
+part_size = 16
+shard_size = 64
+batch_size = None
+num_workers = 0
+prefetch_factor = None
@@ -85,6 +85,7 @@ ema_decay = None
 prefetch_factor = 2
 num_workers = 12
 num_bucket_build_workers = 64
+bucket_cache_dir = "cache/buckets"  # the latest 4 epochs of every dataset are kept
 dtype = "bf16"
 plugin = "zero2"
 grad_checkpoint = True
@@ -95,6 +96,7 @@ plugin_config = dict(
 pin_memory_cache_pre_alloc_numels = [(260 + 20) * 1024 * 1024] * 24 + [
     (34 + 20) * 1024 * 1024
 ] * 4
+pin_memory_cache_max_gb = None  # cap of the pinned batch buffers, least recently used free ones are evicted
 async_io = False
 
 # Other settings
@@ -63,6 +63,58 @@ def all_to_all(
     return _AllToAll.apply(input_, process_group, scatter_dim, gather_dim)
 
 
+class _AsyncAllToAllSingle(torch.autograd.Function):
+    """Flat all-to-all with per-rank split sizes, launched asynchronously.
+
+    The communication handle is appended to `handles`; the caller must wait on it before reading the output.
+    The backward pass runs the reverse exchange synchronously.
+
+    Args:
+        input_: 1D input tensor
+        process_group: communication group
+        input_splits: number of elements sent to each rank
+        output_splits: number of elements received from each rank
+        handles: list collecting the async work handle
+    """
+
+    @staticmethod
+    def forward(ctx, input_, process_group, input_splits, output_splits, handles):
+        ctx.process_group = process_group
+        ctx.input_splits = input_splits
+        ctx.output_splits = output_splits
+        output = input_.new_empty(sum(output_splits))
+        work = dist.all_to_all_single(
+            output, input_.contiguous(), output_splits, input_splits, group=process_group, async_op=True
+        )
+        handles.append(work)
+        return output
+
+    @staticmethod
+    def backward(ctx, grad_output):
+        grad_input = grad_output.new_empty(sum(ctx.input_splits))
+        dist.all_to_all_single(
+            grad_input, grad_output.contiguous(), ctx.input_splits, ctx.output_splits, group=ctx.process_group
+        )
+        return grad_input, None, None, None, None
+
+
+def all_to_all_single_async(
+    input_: torch.Tensor,
+    process_group: dist.ProcessGroup,
+    input_splits: list[int],
+    output_splits: list[int],
+):
+    """
+    Launch an uneven all-to-all on a flattened tensor without blocking.
+
+    Returns:
+        tuple[torch.Tensor, dist.Work]: The receive buffer and the handle to wait on before using it.
+    """
+    handles = []
+    output = _AsyncAllToAllSingle.apply(input_.reshape(-1), process_group, input_splits, output_splits, handles)
+    return output, handles[0]
+
+
 def _gather(
     input_: torch.Tensor,
     world_size: int,
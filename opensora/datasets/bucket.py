@@ -1,12 +1,141 @@
+import hashlib
 from collections import OrderedDict
 
 import numpy as np
 
 from opensora.utils.logger import log_message
 
-from .aspect import get_closest_ratio, get_resolution_with_aspect_ratio
+from .aspect import get_closest_ratio, get_ratio, get_resolution_with_aspect_ratio
 from .utils import map_target_fps
 
+# constants of numpy's SeedSequence and PCG64, see numpy/random/bit_generator.pyx and _pcg64.pyx
+MASK32 = 0xFFFFFFFF
+INIT_A, MULT_A = 0x43B0D7E5, 0x931E8875
+INIT_B, MULT_B = 0x8B51F9DD, 0x58F38DED
+MIX_MULT_L, MIX_MULT_R = 0xCA01F9DD, 0x4973F715
+PCG64_MULT = (0x2360ED051FC65DA4, 0x4385DF649FCCF645)
+
+
+def _hashmix(value: np.ndarray, hash_const: int) -> tuple[np.ndarray, int]:
+    value = value ^ hash_const
+    hash_const = hash_const * MULT_A & MASK32
+    value = value * hash_const & MASK32
+    return value ^ (value >> 16), hash_const
+
+
+def _mix(x: np.ndarray, y: np.ndarray) -> np.ndarray:
+    result = (MIX_MULT_L * x - MIX_MULT_R * y) & MASK32
+    return result ^ (result >> 16)
+
+
+def _mul_64(a: np.ndarray, b: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """Full 128-bit product of uint64 arrays, as (high, low) words."""
+    a0, a1, b0, b1 = a & MASK32, a >> 32, b & MASK32, b >> 32
+    p00, p01, p10, p11 = a0 * b0, a0 * b1, a1 * b0, a1 * b1
+    mid = (p00 >> 32) + (p01 & MASK32) + (p10 & MASK32)
+    return p11 + (p01 >> 32) + (p10 >> 32) + (mid >> 32), (p00 & MASK32) | ((mid & MASK32) << 32)
+
+
+class BatchedPCG64:
+    """
+    The `np.random.default_rng(seed).random()` streams of an array of seeds, advanced together.
+
+    Seeding (SeedSequence with a 4 words pool) and stepping (128-bit LCG with XSL-RR output) follow
+    numpy on uint64 arrays, so the k-th draw of row i is the k-th `default_rng(seeds[i]).random()`.
+    Only the rows passed to `random` are advanced.
+
+    Args:
+        seeds (np.ndarray): non-negative seeds below 2**64.
+    """
+
+    def __init__(self, seeds: np.ndarray):
+        seeds = np.asarray(seeds, dtype=np.uint64)
+        with np.errstate(over="ignore"):
+            # SeedSequence(seed).pool, the entropy is the seed in 32-bit words padded with zeros
+            hash_const = INIT_A
+            pool = []
+            for word in (seeds & MASK32, seeds >> 32, np.zeros_like(seeds), np.zeros_like(seeds)):
+                value, hash_const = _hashmix(word, hash_const)
+                pool.append(value)
+            for i_src in range(4):
+                for i_dst in range(4):
+                    if i_src != i_dst:
+                        value, hash_const = _hashmix(pool[i_src], hash_const)
+                        pool[i_dst] = _mix(pool[i_dst], value)
+
+            # SeedSequence.generate_state(4, np.uint64)
+            hash_const = INIT_B
+            words = []
+            for i in range(8):
+                value = pool[i % 4] ^ hash_const
+                hash_const = hash_const * MULT_B & MASK32
+                value = value * hash_const & MASK32
+                words.append(value ^ (value >> 16))
+            seed_hi, seed_lo, seq_hi, seq_lo = (words[2 * k] | (words[2 * k + 1] << 32) for k in range(4))
+
+            # pcg_setseq_128_srandom_r
+            self.inc_hi = (seq_hi << 1) | (seq_lo >> 63)
+            self.inc_lo = (seq_lo << 1) | 1
+            state_hi, state_lo = self._step(np.zeros_like(seeds), np.zeros_like(seeds), self.inc_hi, self.inc_lo)
+            state_hi, state_lo = self._add(state_hi, state_lo, seed_hi, seed_lo)
+            self.state_hi, self.state_lo = self._step(state_hi, state_lo, self.inc_hi, self.inc_lo)
+
+    @staticmethod
+    def _add(a_hi, a_lo, b_hi, b_lo):
+        lo = a_lo + b_lo
+        return a_hi + b_hi + (lo < a_lo).astype(np.uint64), lo
+
+    @classmethod
+    def _step(cls, state_hi, state_lo, inc_hi, inc_lo):
+        mult_hi, mult_lo = (np.uint64(x) for x in PCG64_MULT)
+        hi, lo = _mul_64(state_lo, np.full_like(state_lo, mult_lo))
+        hi = hi + state_lo * mult_hi + state_hi * mult_lo
+        return cls._add(hi, lo, inc_hi, inc_lo)
+
+    def random(self, rows: np.ndarray) -> np.ndarray:
+        """Next double in [0, 1) of the given rows."""
+        with np.errstate(over="ignore"):
+            state_hi, state_lo = self._step(
+                self.state_hi[rows], self.state_lo[rows], self.inc_hi[rows], self.inc_lo[rows]
+            )
+            self.state_hi[rows], self.state_lo[rows] = state_hi, state_lo
+            value = state_hi ^ state_lo
+            rot = state_hi >> 58
+            out = (value >> rot) | (value << ((np.uint64(64) - rot) & np.uint64(63)))
+        return (out >> 11).astype(np.float64) * (1.0 / 9007199254740992.0)
+
+
+class RowwiseRNG:
+    """Reference `BatchedPCG64` using one `np.random.default_rng` per row."""
+
+    def __init__(self, seeds: np.ndarray):
+        self.seeds = seeds
+        self.generators = dict()
+
+    def random(self, rows: np.ndarray) -> np.ndarray:
+        out = np.empty(len(rows), dtype=np.float64)
+        for k, i in enumerate(rows.tolist()):
+            if i not in self.generators:
+                self.generators[i] = np.random.default_rng(int(self.seeds[i]))
+            out[k] = self.generators[i].random()
+        return out
+
+
+def batched_default_rng(seeds: np.ndarray, num_checks: int = 16, num_draws: int = 4) -> BatchedPCG64 | RowwiseRNG:
+    """
+    `BatchedPCG64` over the seeds, checked against `np.random.default_rng` on a few of them;
+    falls back to `RowwiseRNG` if the installed numpy draws differently.
+    """
+    seeds = np.asarray(seeds, dtype=np.uint64)
+    rows = np.unique(np.linspace(0, len(seeds) - 1, num_checks).astype(np.int64)) if len(seeds) > 0 else []
+    batched, reference = BatchedPCG64(seeds[rows]), RowwiseRNG(seeds[rows])
+    index = np.arange(len(rows))
+    for _ in range(num_draws):
+        if not np.array_equal(batched.random(index), reference.random(index)):
+            log_message("Batched PCG64 does not match np.random.default_rng, drawing row by row")
+            return RowwiseRNG(seeds)
+    return BatchedPCG64(seeds)
+
 
 class Bucket:
     def __init__(self, bucket_config: dict[str, dict[int, tuple[float, int] | tuple[tuple[float, float], int]]]):
@@ -68,6 +197,14 @@ class Bucket:
         self.bucket_id = bucket_id
         self.num_bucket = num_bucket
 
+        # flat index of the (hw_id, t_id, ar_id) buckets, used by get_bucket_ids
+        self.bucket_keys = []
+        self.bucket_offsets = dict()
+        for k1, v1 in bucket_probs.items():
+            for k2 in v1.keys():
+                self.bucket_offsets[(k1, k2)] = len(self.bucket_keys)
+                self.bucket_keys.extend((k1, k2, k3) for k3 in self.ar_criteria[k1][k2])
+
         log_message("Number of buckets: %s", num_bucket)
 
     def get_bucket_id(
@@ -123,6 +260,82 @@ class Bucket:
 
         return None
 
+    def get_bucket_ids(
+        self,
+        T: np.ndarray,
+        H: np.ndarray,
+        W: np.ndarray,
+        fps: np.ndarray,
+        seeds: np.ndarray,
+        fps_max: int = 16,
+    ) -> np.ndarray:
+        """
+        `get_bucket_id` over arrays of samples, with `seeds[i]` the seed of sample i.
+
+        The buckets are visited in the same order for all samples at once, and every sample draws from its
+        own `np.random.default_rng(seeds[i])` stream exactly when `get_bucket_id` would, so the assignment
+        is identical to calling it row by row.
+
+        Returns:
+            np.ndarray: int32 index into `self.bucket_keys` of every sample, -1 if it fits no bucket.
+        """
+        approx = 0.8
+        T, H, W, fps = (np.asarray(x, dtype=np.float64) for x in (T, H, W, fps))
+        with np.errstate(invalid="ignore", divide="ignore"):
+            sampling_interval = np.where(np.isnan(fps) | (fps < fps_max), 1, np.ceil(fps / fps_max))
+            T = np.floor_divide(T, sampling_interval)
+            aspect_ratio = H / W
+        resolution = H * W
+        is_image = T == 1
+        rng = batched_default_rng(seeds)
+
+        bucket_ids = np.full(len(T), -1, dtype=np.int32)
+        undecided = np.ones(len(T), dtype=bool)
+        for hw_id, t_criteria in self.bucket_probs.items():
+            # if resolution is too low, skip
+            in_hw = undecided & ~(resolution < self.hw_criteria[hw_id] * approx)
+
+            # images
+            if 1 in t_criteria:
+                rows = np.flatnonzero(in_hw & is_image)
+                rows = rows[rng.random(rows) < t_criteria[1]]
+                self._assign(bucket_ids, rows, hw_id, 1, aspect_ratio)
+                undecided[rows] = False
+            in_hw &= ~is_image
+
+            # videos
+            for t_id, prob in t_criteria.items():
+                if t_id == 1:
+                    continue
+                rows = np.flatnonzero(in_hw & (T >= t_id))
+                if isinstance(prob, tuple):
+                    next_hw_prob, next_t_prob = prob
+                    if next_t_prob >= 1:
+                        continue
+                    rows = rows[~(rng.random(rows) <= next_t_prob)]
+                else:
+                    next_hw_prob = prob
+                if next_hw_prob < 1:
+                    # samples that miss move on to the next hw_id
+                    keep = rng.random(rows) <= next_hw_prob
+                    in_hw[rows] = False
+                    rows = rows[keep]
+                self._assign(bucket_ids, rows, hw_id, t_id, aspect_ratio)
+                undecided[rows] = False
+                in_hw[rows] = False
+        return bucket_ids
+
+    def _assign(self, bucket_ids: np.ndarray, rows: np.ndarray, hw_id: str, t_id: int, aspect_ratio: np.ndarray):
+        # argmin keeps the first of equally close ratios, as min in get_closest_ratio
+        ratios = np.array([get_ratio(ratio) for ratio in self.ar_criteria[hw_id][t_id]])
+        ar_ids = np.abs(aspect_ratio[rows, None] - ratios[None]).argmin(axis=1)
+        bucket_ids[rows] = self.bucket_offsets[(hw_id, t_id)] + ar_ids
+
+    def digest(self) -> str:
+        """Hash of the resolved bucket tables, changes whenever the assignment of a sample could."""
+        tables = (self.bucket_probs, self.hw_criteria, self.ar_criteria)
+        return hashlib.md5(repr(tables).encode()).hexdigest()
+
     def get_thw(self, bucket_idx: tuple[str, int, int]) -> tuple[int, int, int]:
         assert len(bucket_idx) == 3
         T = self.t_criteria[bucket_idx[0]][bucket_idx[1]]
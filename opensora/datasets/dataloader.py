@@ -31,6 +31,7 @@ from opensora.utils.train import setup_device
 from .datasets import TextDataset, VideoTextDataset
 from .pin_memory_cache import PinMemoryCache
 from .sampler import DistributedSampler, VariableVideoBatchSampler
+from .video_transforms import resized_crop_on_device
 
 
 def _pin_memory_loop(
@@ -217,6 +218,87 @@ class DataloaderForVideo(DataLoader):
             return _MultiProcessingDataLoaderIterForVideo(self)
 
 
+class DevicePrefetcher:
+    """
+    Iterator over the (step, batch) of a dataloader iterator, moving the video of the next batch to device on a side
+    stream while the current step runs.
+
+    The current stream waits for the copy (and `resized_crop_on_device` for uint8 frames) before a batch is returned.
+    The pinned video of a batch is passed to `release` (e.g. `remove_cache` of `DataloaderForVideo` iterators) when
+    the next batch is requested and its copy is done. On cpu the video is moved when the batch is fetched.
+
+    Args:
+        iterator: iterator over (step, batch)
+        device (torch.device): device of the videos
+        dtype (torch.dtype): dtype of the videos
+        num_batches (int): number of batches to fetch, None to exhaust the iterator
+        release (callable): called with the pinned video of the batches once copied
+    """
+
+    def __init__(self, iterator, device, dtype, num_batches=None, release=None):
+        self.iterator = iterator
+        self.device = torch.device(device)
+        self.dtype = dtype
+        self.num_batches = num_batches
+        self.release = release
+        self.stream = torch.cuda.Stream(device=self.device) if self.device.type == "cuda" else None
+        self.num_fetched = 0
+        self.current = None  # (pinned video, copy event) of the last returned batch
+        self.next = None  # (step, batch, pinned video, copy event) of the batch being copied
+        self._preload()
+
+    def _to_device(self, batch: dict) -> torch.Tensor:
+        pinned_video = batch["video"]
+        if "video_transform" in batch:
+            # uint8 frames of transform_on_device, resized, cropped and normalized on device
+            video = pinned_video.to(self.device, non_blocking=True)
+            batch["video"] = resized_crop_on_device(video, batch.pop("video_transform")).to(self.dtype)
+        else:
+            batch["video"] = pinned_video.to(self.device, self.dtype, non_blocking=True)
+        return pinned_video
+
+    def _preload(self):
+        self.next = None
+        if self.num_batches is not None and self.num_fetched >= self.num_batches:
+            return
+        try:
+            step, batch = next(self.iterator)
+        except StopIteration:
+            return
+        self.num_fetched += 1
+        if self.stream is None:
+            self.next = (step, batch, self._to_device(batch), None)
+            return
+        with torch.cuda.stream(self.stream):
+            pinned_video = self._to_device(batch)
+            event = torch.cuda.Event()
+            event.record(self.stream)
+        self.next = (step, batch, pinned_video, event)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self) -> tuple[int, dict]:
+        if self.current is not None:
+            pinned_video, event = self.current
+            self.current = None
+            if event is not None:
+                event.synchronize()
+            if self.release is not None:
+                self.release(pinned_video)
+        if self.next is None:
+            raise StopIteration
+        step, batch, pinned_video, event = self.next
+        if self.stream is not None:
+            stream = torch.cuda.current_stream(self.device)
+            stream.wait_stream(self.stream)
+            # allocated on the side stream, used on the current one
+            batch["video"].record_stream(stream)
+        self.current = (pinned_video, event)
+        self._preload()
+        return step, batch
+
+
 # Deterministic dataloader
 def get_seed_worker(seed):
     def seed_worker(worker_id):
@@ -240,6 +322,7 @@ def prepare_dataloader(
     process_group: ProcessGroup | None = None,
     bucket_config=None,
     num_bucket_build_workers=1,
+    bucket_cache_dir=None,
     prefetch_factor=None,
     cache_pin_memory=False,
     num_groups=1,
@@ -258,6 +341,7 @@ def prepare_dataloader(
             verbose=True,
             num_bucket_build_workers=num_bucket_build_workers,
             num_groups=num_groups,
+            bucket_cache_dir=bucket_cache_dir,
         )
         dl_cls = DataloaderForVideo if cache_pin_memory else DataLoader
         return (
@@ -329,6 +413,19 @@ def collate_fn_default(batch):
         texts = torch.cat(texts, dim=1)
         use_mask = True
 
+    # uint8 windows of VideoTextDataset(transform_on_device=True)
+    windows = [x for x in batch if "video_transform" in x]
+    if 0 < len(windows) < len(batch):
+        # batched with images transformed by the workers
+        for x in windows:
+            x["video"] = resized_crop_on_device(x["video"][None], x.pop("video_transform")[None])[0]
+    elif len(windows) > 0:
+        max_h = max(x["video"].size(-2) for x in batch)
+        max_w = max(x["video"].size(-1) for x in batch)
+        for x in batch:
+            h, w = x["video"].shape[-2:]
+            x["video"] = torch.nn.functional.pad(x["video"], (0, max_w - w, 0, max_h - h))
+
     ret = torch.utils.data.default_collate(batch)
 
     if use_mask:
@@ -389,6 +486,7 @@ if __name__ == "__main__":
     dataloader, sampler = prepare_dataloader(
         bucket_config=cfg.get("bucket_config", None),
         num_bucket_build_workers=cfg.get("num_bucket_build_workers", 1),
+        bucket_cache_dir=cfg.get("bucket_cache_dir", None),
         **dataloader_args,
     )
     num_steps_per_epoch = len(dataloader)
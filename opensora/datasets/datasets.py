@@ -1,99 +1,147 @@
 import os
 import random
+import threading
+from collections import OrderedDict, defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
 
 import numpy as np
 import pandas as pd
+import pyarrow.parquet as pq
 import torch
 from PIL import ImageFile
 from torchvision.datasets.folder import pil_loader
 
 from opensora.registry import DATASETS
 
-from .read_video import read_video
-from .utils import get_transforms_image, get_transforms_video, is_img, map_target_fps, read_file, temporal_random_crop
+from . import video_transforms
+from .latent_store import LatentStore
+from .read_video import read_video_av_sampled
+from .utils import (
+    get_transforms_image,
+    get_transforms_video,
+    is_img,
+    map_target_fps,
+    read_file,
+    temporal_random_crop_indices,
+)
 
 ImageFile.LOAD_TRUNCATED_IMAGES = True
 
 VALID_KEYS = ("neg", "path")
-K = 10000
 
 
 class Iloc:
-    def __init__(self, data, sharded_folder, sharded_folders, rows_per_shard):
-        self.data = data
-        self.sharded_folder = sharded_folder
-        self.sharded_folders = sharded_folders
-        self.rows_per_shard = rows_per_shard
+    def __init__(self, parquet: "EfficientParquet"):
+        self.parquet = parquet
 
     def __getitem__(self, index):
-        return Item(
-            index,
-            self.data,
-            self.sharded_folder,
-            self.sharded_folders,
-            self.rows_per_shard,
-        )
+        return Item(index, self.parquet)
 
 
 class Item:
-    def __init__(self, index, data, sharded_folder, sharded_folders, rows_per_shard):
+    def __init__(self, index, parquet: "EfficientParquet"):
         self.index = index
-        self.data = data
-        self.sharded_folder = sharded_folder
-        self.sharded_folders = sharded_folders
-        self.rows_per_shard = rows_per_shard
+        self.parquet = parquet
+        self.data = parquet.data
+
+    def _shard_row(self) -> pd.Series:
+        shard_parquet, text_parquet, idx = self.parquet.locate(self.index)
+        try:
+            row = text_parquet.iloc[idx]
+            assert row["path"] == self.data["path"].iloc[self.index]
+        except Exception as e:
+            print(f"Error reading {shard_parquet}: {e}")
+            raise
+        return row
 
     def __getitem__(self, key):
-        index = self.index
         if key in self.data.columns:
-            return self.data[key].iloc[index]
-        else:
-            shard_idx = index // self.rows_per_shard
-            idx = index % self.rows_per_shard
-            shard_parquet = os.path.join(self.sharded_folder, self.sharded_folders[shard_idx])
-            try:
-                text_parquet = pd.read_parquet(shard_parquet, engine="fastparquet")
-                path = text_parquet["path"].iloc[idx]
-                assert path == self.data["path"].iloc[index]
-            except Exception as e:
-                print(f"Error reading {shard_parquet}: {e}")
-                raise
-            return text_parquet[key].iloc[idx]
+            return self.data[key].iloc[self.index]
+        return self._shard_row()[key]
 
     def to_dict(self):
-        index = self.index
         ret = {}
-        ret.update(self.data.iloc[index].to_dict())
-        shard_idx = index // self.rows_per_shard
-        idx = index % self.rows_per_shard
-        shard_parquet = os.path.join(self.sharded_folder, self.sharded_folders[shard_idx])
+        ret.update(self.data.iloc[self.index].to_dict())
         try:
-            text_parquet = pd.read_parquet(shard_parquet, engine="fastparquet")
-            path = text_parquet["path"].iloc[idx]
-            assert path == self.data["path"].iloc[index]
-            ret.update(text_parquet.iloc[idx].to_dict())
-        except Exception as e:
-            print(f"Error reading {shard_parquet}: {e}")
+            ret.update(self._shard_row().to_dict())
+        except Exception:
             ret.update({"text": ""})
         return ret
 
 
 class EfficientParquet:
-    def __init__(self, df, sharded_folder):
+    """
+    Metadata kept in memory, with the text columns read on demand from the parquet shards written by
+    `scripts/cnv/shard.py`.
+
+    A global row index is mapped to its (shard, row) in O(1) through an index built once from the parquet
+    footers, so shards of any size are supported. Every process (e.g. dataloader worker) keeps the last
+    `cache_size` shards it read in an LRU cache instead of reading the shard again on every access.
+    """
+
+    def __init__(self, df, sharded_folder, cache_size: int = 16, num_workers: int = 16):
         self.data = df
         self.total_rows = len(df)
-        self.rows_per_shard = (self.total_rows + K - 1) // K
         self.sharded_folder = sharded_folder
         assert os.path.exists(sharded_folder), f"Sharded folder {sharded_folder} does not exist."
-        self.sharded_folders = os.listdir(sharded_folder)
-        self.sharded_folders = sorted(self.sharded_folders)
+        self.sharded_folders = sorted(f for f in os.listdir(sharded_folder) if f.endswith(".parquet"))
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+        # row offsets of the shards and the shard of every row
+        with ThreadPoolExecutor(max_workers=num_workers) as executor:
+            rows = list(
+                executor.map(
+                    lambda f: pq.ParquetFile(os.path.join(sharded_folder, f)).metadata.num_rows,
+                    self.sharded_folders,
+                )
+            )
+        self.shard_offsets = np.concatenate(([0], np.cumsum(rows)))
+        assert self.shard_offsets[-1] == self.total_rows, (
+            f"Shards in {sharded_folder} hold {self.shard_offsets[-1]} rows, expected {self.total_rows}."
+        )
+        index_dtype = np.uint16 if len(rows) <= np.iinfo(np.uint16).max + 1 else np.int32
+        self.row_shards = np.repeat(np.arange(len(rows), dtype=index_dtype), rows)
 
     def __len__(self):
         return self.total_rows
 
+    def __getstate__(self):
+        # workers start with an empty cache
+        state = self.__dict__.copy()
+        state["_cache"] = OrderedDict()
+        state.pop("_lock")
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def read_shard(self, shard_idx: int) -> pd.DataFrame:
+        with self._lock:
+            if shard_idx in self._cache:
+                self._cache.move_to_end(shard_idx)
+                return self._cache[shard_idx]
+        shard = pd.read_parquet(
+            os.path.join(self.sharded_folder, self.sharded_folders[shard_idx]), engine="fastparquet"
+        )
+        with self._lock:
+            self._cache[shard_idx] = shard
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return shard
+
+    def locate(self, index: int) -> tuple[str, pd.DataFrame, int]:
+        """The shard path, the shard and the row within the shard of a global row index."""
+        shard_idx = int(self.row_shards[index])
+        shard = self.read_shard(shard_idx)
+        shard_path = os.path.join(self.sharded_folder, self.sharded_folders[shard_idx])
+        return shard_path, shard, index - int(self.shard_offsets[shard_idx])
+
     @property
     def iloc(self):
-        return Iloc(self.data, self.sharded_folder, self.sharded_folders, self.rows_per_shard)
+        return Iloc(self)
 
 
 @DATASETS.register_module("text")
@@ -173,12 +221,25 @@ class VideoTextDataset(TextDataset):
         transform_name: str = None,
         bucket_class: str = "Bucket",
         rand_sample_interval: int = None,  # random sample_interval value from [1, min(rand_sample_interval, video_allowed_max)]
+        num_decode_threads: int = 0,  # threads of each worker decoding the next videos of its batch
+        transform_on_device: bool = False,  # return uint8 frames, see resized_crop_on_device
         **kwargs,
     ):
         super().__init__(**kwargs)
         self.transform_name = transform_name
         self.bucket_class = bucket_class
         self.rand_sample_interval = rand_sample_interval
+        self.num_decode_threads = num_decode_threads
+        self.transform_on_device = transform_on_device
+        self._decode_pool = None
+        self._prefetched = defaultdict(deque)  # (index, num_frames) -> futures of the decoded videos
+
+    def __getstate__(self):
+        # every worker starts its own decode threads
+        state = self.__dict__.copy()
+        state["_decode_pool"] = None
+        state["_prefetched"] = defaultdict(deque)
+        return state
 
     def get_image(self, index: int, height: int, width: int) -> dict:
         sample = self.data.iloc[index]
@@ -195,23 +256,42 @@ class VideoTextDataset(TextDataset):
 
         return {"video": video}
 
-    def get_video(self, index: int, num_frames: int, height: int, width: int, sampling_interval: int) -> dict:
+    def read_video(
+        self, index: int, num_frames: int, sampling_interval: int, rng: random.Random = random
+    ) -> tuple[torch.Tensor, dict]:
+        """Decode the frames of a random temporal crop of a video, drawn from rng."""
         sample = self.data.iloc[index]
         path = sample["path"]
 
-        # loading
-        vframes, vinfo = read_video(path, backend="av")
+        def sample_indices(total_frames: int) -> np.ndarray:
+            interval = sampling_interval
+            if self.rand_sample_interval is not None:
+                # randomly sample from 1 - self.rand_sample_interval
+                video_allowed_max = min(total_frames // num_frames, self.rand_sample_interval)
+                interval = rng.randint(1, video_allowed_max)
+            return temporal_random_crop_indices(total_frames, num_frames, interval, rng)
 
-        if self.rand_sample_interval is not None:
-            # randomly sample from 1 - self.rand_sample_interval
-            video_allowed_max = min(len(vframes) // num_frames, self.rand_sample_interval)
-            sampling_interval = random.randint(1, video_allowed_max)
+        # only the sampled frames are decoded
+        return read_video_av_sampled(path, sample_indices)
 
-        # Sampling video frames
-        video = temporal_random_crop(vframes, num_frames, sampling_interval)
+    def prefetch_video(self, index: int, num_frames: int, rng: random.Random) -> tuple[torch.Tensor, dict]:
+        sample = self.data.iloc[index].to_dict()
+        _, sampling_interval = map_target_fps(sample.get("fps", np.nan), self.fps_max)
+        return self.read_video(index, num_frames, sampling_interval, rng)
+
+    def get_video(self, index: int, num_frames: int, height: int, width: int, sampling_interval: int) -> dict:
+        # loading
+        prefetched = self._prefetched.get((index, num_frames))
+        if prefetched:
+            video, vinfo = prefetched.popleft().result()
+        else:
+            video, vinfo = self.read_video(index, num_frames, sampling_interval)
 
-        video = video.clone()
-        del vframes
+        if self.transform_on_device:
+            # only crop the uint8 frames, they are resized and normalized on device
+            params = video_transforms.get_resized_crop_params(self.transform_name, video, (height, width))
+            video, video_transform = video_transforms.resized_crop_window(video, params)
+            return {"video": video.permute(1, 0, 2, 3), "video_transform": video_transform}
 
         # transform
         transform = get_transforms_video(self.transform_name, (height, width))
@@ -246,6 +326,39 @@ class VideoTextDataset(TextDataset):
     def __getitem__(self, index):
         return self.getitem(index)
 
+    def __getitems__(self, indices: list[str]) -> list:
+        """
+        Items of a batch of the batch sampler, in order.
+
+        With num_decode_threads, the videos of the next 2 * num_decode_threads items are decoded by a thread pool
+        while the current item is transformed. Each prefetched video draws its temporal crop from a generator seeded
+        from `random` in batch order, so batches do not depend on the timing of the threads.
+        """
+        if self.num_decode_threads <= 0:
+            return [self.getitem(index) for index in indices]
+        if self._decode_pool is None:
+            self._decode_pool = ThreadPoolExecutor(self.num_decode_threads, thread_name_prefix="video_decode")
+
+        def prefetch(position: int):
+            index, num_frames, _, _ = [int(val) for val in indices[position].split("-")]
+            if is_img(self.data.iloc[index]["path"]):
+                return
+            rng = random.Random(random.getrandbits(64))
+            future = self._decode_pool.submit(self.prefetch_video, index, num_frames, rng)
+            self._prefetched[(index, num_frames)].append(future)
+
+        ahead = 2 * self.num_decode_threads
+        for position in range(min(ahead, len(indices))):
+            prefetch(position)
+        items = []
+        for position, index in enumerate(indices):
+            items.append(self.getitem(index))
+            if position + ahead < len(indices):
+                prefetch(position + ahead)
+        # videos of the items which failed before loading them
+        self._prefetched.clear()
+        return items
+
 
 @DATASETS.register_module("cached_video_text")
 class CachedVideoTextDataset(VideoTextDataset):
@@ -258,6 +371,7 @@ class CachedVideoTextDataset(VideoTextDataset):
         cached_text: bool = False,
         return_latents_path: bool = False,
         load_original_video: bool = True,
+        latent_store: str = None,  # directory of a LatentStore keyed by the latents/text paths
         **kwargs,
     ):
         super().__init__(**kwargs)
@@ -268,9 +382,14 @@ class CachedVideoTextDataset(VideoTextDataset):
         self.cached_text = cached_text
         self.return_latents_path = return_latents_path
         self.load_original_video = load_original_video
+        if not load_original_video:
+            self.num_decode_threads = 0
+        self.latent_store = LatentStore(latent_store) if latent_store is not None else None
 
     def get_latents(self, path):
         try:
+            if self.latent_store is not None:
+                return self.latent_store[path]
             latents = torch.load(path, map_location=torch.device("cpu"))
         except Exception as e:
             print(f"Error loading latents from {path}: {e}")
@@ -279,16 +398,17 @@ class CachedVideoTextDataset(VideoTextDataset):
 
     def get_conditioning_latents(self, index: int) -> dict:
         sample = self.data.iloc[index]
-        latents_path = sample["latents_path"]
-        text_t5_path = sample["text_t5_path"]
-        text_clip_path = sample["text_clip_path"]
+        # precomputed datasets only have the key columns of the encoders that ran
+        latents_path = sample.get("latents_path")
+        text_t5_path = sample.get("text_t5_path")
+        text_clip_path = sample.get("text_clip_path")
         res = dict()
         if self.cached_video:
-            latents = self.get_latents(latents_path)
+            latents = self.get_latents(sample["latents_path"])
             res["video_latents"] = latents
         if self.cached_text:
-            text_t5 = self.get_latents(text_t5_path)
-            text_clip = self.get_latents(text_clip_path)
+            text_t5 = self.get_latents(sample["text_t5_path"])
+            text_clip = self.get_latents(sample["text_clip_path"])
             res["text_t5"] = text_t5
             res["text_clip"] = text_clip
         if self.return_latents_path:
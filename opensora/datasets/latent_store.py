@@ -0,0 +1,166 @@
+import json
+import mmap
+import os
+import re
+import threading
+from glob import escape, glob
+
+import torch
+
+INDEX_SUFFIX = ".index.json"
+DATA_SUFFIX = ".bin"
+ALIGNMENT = 64
+
+
+def _dtype_name(dtype: torch.dtype) -> str:
+    return str(dtype).removeprefix("torch.")
+
+
+class LatentStoreWriter:
+    """
+    Write tensors (video latents, text features) into a sharded store readable by `LatentStore`.
+
+    Every shard is a `.bin` blob of raw tensor bytes, each tensor aligned to 64 bytes, and an `.index.json`
+    with the key, byte offset, dtype and shape of every tensor. The index is written when the shard is
+    closed, so a shard without index is incomplete and ignored by readers.
+
+    Args:
+        root (str): directory of the store, shared by every writer.
+        prefix (str): prefix of the shard names of this writer, e.g. "rank00003-" when writing from several ranks.
+            Restarting a writer with the same prefix continues after its finished shards.
+        shard_size (int): bytes after which a new shard is started.
+    """
+
+    def __init__(self, root: str, prefix: str = "", shard_size: int = 1 << 30):
+        self.root = root
+        self.prefix = prefix
+        self.shard_size = shard_size
+        os.makedirs(root, exist_ok=True)
+        # resume after the finished shards of this writer
+        self.num_shards = 0
+        self.keys = set()
+        for index_path in glob(os.path.join(escape(root), f"{escape(prefix)}*{INDEX_SUFFIX}")):
+            match = re.fullmatch(re.escape(prefix) + r"(\d+)", os.path.basename(index_path)[: -len(INDEX_SUFFIX)])
+            if match is not None:
+                self.num_shards = max(self.num_shards, int(match.group(1)) + 1)
+                with open(index_path) as f:
+                    self.keys.update(json.load(f)["keys"])
+        self.file = None
+        self.entries = None
+
+    @property
+    def shard_name(self) -> str:
+        return f"{self.prefix}{self.num_shards:05d}"
+
+    def _open(self):
+        self.file = open(os.path.join(self.root, self.shard_name + DATA_SUFFIX), "wb")
+        self.entries = dict(keys=[], offsets=[], dtypes=[], shapes=[])
+
+    def write(self, key: str, tensor: torch.Tensor, exist_handling: str = "overwrite"):
+        if key in self.keys:
+            if exist_handling == "ignore":
+                return
+            elif exist_handling == "raise":
+                raise UserWarning(f"Key {key} already exists, rewriting!")
+        if self.file is None:
+            self._open()
+        tensor = tensor.detach().cpu().contiguous()
+        offset = self.file.tell()
+        self.file.write(tensor.reshape(-1).view(torch.uint8).numpy())
+        self.file.write(b"\0" * (-self.file.tell() % ALIGNMENT))
+        self.entries["keys"].append(key)
+        self.entries["offsets"].append(offset)
+        self.entries["dtypes"].append(_dtype_name(tensor.dtype))
+        self.entries["shapes"].append(list(tensor.shape))
+        self.keys.add(key)
+        if self.file.tell() >= self.shard_size:
+            self.flush()
+
+    def flush(self):
+        """Close the current shard and write its index."""
+        if self.file is None:
+            return
+        self.file.close()
+        index_path = os.path.join(self.root, self.shard_name + INDEX_SUFFIX)
+        with open(index_path + ".tmp", "w") as f:
+            json.dump(self.entries, f)
+        os.replace(index_path + ".tmp", index_path)
+        self.num_shards += 1
+        self.file = self.entries = None
+
+    def close(self):
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class LatentStore:
+    """
+    Read-only view of a store written by `LatentStoreWriter`.
+
+    Shards are memory-mapped copy-on-write on first access and tensors are returned as views of the mapping,
+    so reading a sample costs no system call besides page faults and no copy until the tensor is written to.
+    Mappings are per process: they are dropped when the store is pickled into dataloader workers.
+
+    Args:
+        root (str): directory of the store.
+    """
+
+    def __init__(self, root: str):
+        self.root = root
+        self.shards = []
+        self.index = dict()
+        for index_path in sorted(glob(os.path.join(escape(root), f"*{INDEX_SUFFIX}"))):
+            with open(index_path) as f:
+                entries = json.load(f)
+            shard_id = len(self.shards)
+            self.shards.append(os.path.basename(index_path).removesuffix(INDEX_SUFFIX))
+            for key, offset, dtype, shape in zip(
+                entries["keys"], entries["offsets"], entries["dtypes"], entries["shapes"]
+            ):
+                self.index[key] = (shard_id, offset, dtype, tuple(shape))
+        self._mmaps = dict()
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_mmaps"] = dict()
+        state["_lock"] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def _mmap(self, shard_id: int) -> mmap.mmap:
+        if shard_id not in self._mmaps:
+            with self._lock:
+                if shard_id not in self._mmaps:
+                    path = os.path.join(self.root, self.shards[shard_id] + DATA_SUFFIX)
+                    with open(path, "rb") as f:
+                        self._mmaps[shard_id] = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+        return self._mmaps[shard_id]
+
+    def __getitem__(self, key: str) -> torch.Tensor:
+        shard_id, offset, dtype, shape = self.index[key]
+        numel = 1
+        for size in shape:
+            numel *= size
+        dtype = getattr(torch, dtype)
+        if numel == 0:
+            return torch.empty(shape, dtype=dtype)
+        buffer = self._mmap(shard_id)
+        return torch.frombuffer(buffer, dtype=dtype, count=numel, offset=offset).view(shape)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self.index
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+    def keys(self):
+        return self.index.keys()
@@ -1,27 +1,94 @@
 import threading
-from typing import Dict, List, Optional
+from collections import OrderedDict, defaultdict
+from typing import Dict, List, Optional, Tuple
 
 import torch
 
 
+def _size_class(numel: int) -> int:
+    """Power-of-two size class of a buffer, floor(log2(numel))."""
+    return max(numel, 1).bit_length() - 1
+
+
 class PinMemoryCache:
-    force_dtype: Optional[torch.dtype] = None
+    """
+    Pool of pinned cpu buffers reused by the pin memory thread of `DataloaderForVideo`.
+
+    Free buffers sit in LIFO free lists per dtype and power-of-two size class, so a request pops a buffer from its
+    own class or one of the next `max_class_gap` classes instead of scanning every buffer: any buffer of a higher
+    class is large enough, only the ones of the request's own class are compared. Bounding the gap keeps small
+    requests from taking buffers sized for the largest buckets. Before pinning a new buffer, a request still takes
+    the smallest free buffer of a higher class if it was pre-allocated, or any one without `max_pinned_bytes`,
+    since no new buffer would free it.
+
+    With `max_pinned_bytes`, the least recently released free buffers are dropped to make room for a new one, and
+    a request that still does not fit gets an unpinned tensor. Evicted buffers go back to the host allocator of torch.
+    """
+
+    force_dtype: Optional[torch.dtype] = None  # dtype of the floating point batches, uint8 frames are kept
     min_cache_numel: int = 0
     pre_alloc_numels: List[int] = []
+    max_pinned_bytes: Optional[int] = None
+    max_class_gap: int = 2
 
     def __init__(self):
         self.cache: Dict[int, torch.Tensor] = {}
-        self.output_to_cache: Dict[int, int] = {}
+        self.free: Dict[Tuple[torch.dtype, int], List[int]] = defaultdict(list)
+        self.free_lru: "OrderedDict[int, None]" = OrderedDict()  # free cache ids, least recently released first
+        self.output_to_cache: Dict[int, Optional[int]] = {}
         self.cache_to_output: Dict[int, int] = {}
         self.lock = threading.Lock()
         self.total_cnt = 0
         self.hit_cnt = 0
+        self.miss_cnt = 0
+        self.evict_cnt = 0
+        self.unpinned_cnt = 0
+        self.pinned_bytes = 0
+        self.pre_alloc_ids = set()
 
         if len(self.pre_alloc_numels) > 0 and self.force_dtype is not None:
             for n in self.pre_alloc_numels:
                 cache_tensor = torch.empty(n, dtype=self.force_dtype, device="cpu", pin_memory=True)
                 with self.lock:
-                    self.cache[id(cache_tensor)] = cache_tensor
+                    self._register(cache_tensor)
+                    self._release(id(cache_tensor))
+                    self.pre_alloc_ids.add(id(cache_tensor))
+
+    def _register(self, cache_tensor: torch.Tensor):
+        self.cache[id(cache_tensor)] = cache_tensor
+        self.pinned_bytes += cache_tensor.numel() * cache_tensor.element_size()
+
+    def _release(self, cache_id: int):
+        cache_tensor = self.cache[cache_id]
+        self.free[(cache_tensor.dtype, _size_class(cache_tensor.numel()))].append(cache_id)
+        self.free_lru[cache_id] = None
+
+    def _pop_free(self, dtype: torch.dtype, numel: int) -> Optional[int]:
+        size_class = _size_class(numel)
+        max_class = size_class + self.max_class_gap
+        classes = sorted(c for (d, c), free in self.free.items() if d == dtype and c >= size_class and len(free) > 0)
+        for c in classes:
+            free = self.free[(dtype, c)]
+            for k in range(len(free) - 1, -1, -1):
+                if c == size_class and self.cache[free[k]].numel() < numel:
+                    continue
+                if c > max_class and self.max_pinned_bytes is not None and free[k] not in self.pre_alloc_ids:
+                    continue
+                cache_id = free.pop(k)
+                del self.free_lru[cache_id]
+                return cache_id
+        return None
+
+    def _evict(self, nbytes: int) -> bool:
+        """Drop free buffers until nbytes more fit under max_pinned_bytes, return whether they do."""
+        while self.pinned_bytes + nbytes > self.max_pinned_bytes and len(self.free_lru) > 0:
+            cache_id, _ = self.free_lru.popitem(last=False)
+            cache_tensor = self.cache.pop(cache_id)
+            self.free[(cache_tensor.dtype, _size_class(cache_tensor.numel()))].remove(cache_id)
+            self.pre_alloc_ids.discard(cache_id)
+            self.pinned_bytes -= cache_tensor.numel() * cache_tensor.element_size()
+            self.evict_cnt += 1
+        return self.pinned_bytes + nbytes <= self.max_pinned_bytes
 
     def get(self, tensor: torch.Tensor) -> torch.Tensor:
         """Receive a cpu tensor and return the corresponding pinned tensor. Note that this only manage memory allocation, doesn't copy content.
@@ -32,25 +99,37 @@ class PinMemoryCache:
         Returns:
             torch.Tensor: The pinned tensor.
         """
-        self.total_cnt += 1
+        dtype = self.force_dtype if self.force_dtype is not None and tensor.is_floating_point() else tensor.dtype
+        numel = tensor.numel()
         with self.lock:
-            # find free cache
-            for cache_id, cache_tensor in self.cache.items():
-                if cache_id not in self.cache_to_output and cache_tensor.numel() >= tensor.numel():
-                    target_cache_tensor = cache_tensor[: tensor.numel()].view(tensor.shape)
-                    out_id = id(target_cache_tensor)
-                    self.output_to_cache[out_id] = cache_id
-                    self.cache_to_output[cache_id] = out_id
-                    self.hit_cnt += 1
-                    return target_cache_tensor
+            self.total_cnt += 1
+            cache_id = self._pop_free(dtype, numel)
+            if cache_id is not None:
+                self.hit_cnt += 1
+                target_cache_tensor = self.cache[cache_id][:numel].view(tensor.shape)
+                self.output_to_cache[id(target_cache_tensor)] = cache_id
+                self.cache_to_output[cache_id] = id(target_cache_tensor)
+                return target_cache_tensor
+
+            self.miss_cnt += 1
+            cache_numel = max(numel, self.min_cache_numel)
+            nbytes = cache_numel * dtype.itemsize
+            if self.max_pinned_bytes is not None and not self._evict(nbytes):
+                # over the cap with every buffer in use
+                self.unpinned_cnt += 1
+                target_cache_tensor = torch.empty(tensor.shape, dtype=dtype, device="cpu")
+                self.output_to_cache[id(target_cache_tensor)] = None
+                return target_cache_tensor
+            # reserve the bytes, pinning is slow and done outside the lock
+            self.pinned_bytes += nbytes
+
         # no free cache, create a new one
-        dtype = self.force_dtype if self.force_dtype is not None else tensor.dtype
-        cache_numel = max(tensor.numel(), self.min_cache_numel)
         cache_tensor = torch.empty(cache_numel, dtype=dtype, device="cpu", pin_memory=True)
-        target_cache_tensor = cache_tensor[: tensor.numel()].view(tensor.shape)
+        target_cache_tensor = cache_tensor[:numel].view(tensor.shape)
         out_id = id(target_cache_tensor)
         with self.lock:
-            self.cache[id(cache_tensor)] = cache_tensor
+            self.pinned_bytes -= nbytes
+            self._register(cache_tensor)
             self.output_to_cache[out_id] = id(cache_tensor)
             self.cache_to_output[id(cache_tensor)] = out_id
         return target_cache_tensor
@@ -66,11 +145,28 @@ class PinMemoryCache:
             if out_id not in self.output_to_cache:
                 raise ValueError("Tensor not found in cache.")
             cache_id = self.output_to_cache.pop(out_id)
+            if cache_id is None:  # unpinned tensor, not cached
+                return
             del self.cache_to_output[cache_id]
+            self._release(cache_id)
 
-    def __str__(self):
+    def stats(self) -> Dict[str, int]:
         with self.lock:
-            num_cached = len(self.cache)
-            num_used = len(self.output_to_cache)
-            total_cache_size = sum([v.numel() * v.element_size() for v in self.cache.values()])
-        return f"PinMemoryCache(num_cached={num_cached}, num_used={num_used}, total_cache_size={total_cache_size / 1024**3:.2f} GB, hit rate={self.hit_cnt / self.total_cnt:.2f})"
+            return dict(
+                num_cached=len(self.cache),
+                num_used=len(self.cache_to_output),
+                hits=self.hit_cnt,
+                misses=self.miss_cnt,
+                evictions=self.evict_cnt,
+                unpinned=self.unpinned_cnt,
+                pinned_bytes=self.pinned_bytes,
+            )
+
+    def __str__(self):
+        stats = self.stats()
+        hit_rate = stats["hits"] / max(self.total_cnt, 1)
+        return (
+            f"PinMemoryCache(num_cached={stats['num_cached']}, num_used={stats['num_used']}, "
+            f"total_cache_size={stats['pinned_bytes'] / 1024**3:.2f} GB, hit rate={hit_rate:.2f}, "
+            f"misses={stats['misses']}, evictions={stats['evictions']}, unpinned={stats['unpinned']})"
+        )
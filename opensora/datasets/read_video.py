@@ -3,7 +3,9 @@ import math
 import os
 import re
 import warnings
+from collections import defaultdict
 from fractions import Fraction
+from typing import Callable
 
 import av
 import cv2
@@ -115,6 +117,89 @@ def read_video_av(
     return vframes, aframes, info
 
 
+def read_video_av_sampled(
+    filename: str,
+    sample_indices: Callable[[int], np.ndarray],
+    output_format: str = "TCHW",
+) -> tuple[torch.Tensor, dict]:
+    """
+    Reads only the sampled frames of a video, in one pass over the container.
+
+    The packets are demuxed without decoding to count the frames and map frame indices to pts.
+    `sample_indices(total_frames)` then returns the frame indices to read, which are decoded from the
+    last keyframe before the first of them into a preallocated array, stopping after the last of them.
+    The frames are those of `read_video_av(filename, pts_unit="sec")[0][indices]`, which is used as a
+    fallback when the packets do not match the decoded frames.
+
+    Args:
+        filename (str): path to the video file
+        sample_indices (Callable[[int], np.ndarray]): maps the number of frames to the indices to read
+        output_format (str, optional): The format of the output video tensors, "THWC" or "TCHW" (default).
+
+    Returns:
+        vframes (Tensor[T, H, W, C] or Tensor[T, C, H, W]): the sampled video frames
+        info (dict): metadata for the video, can contain video_fps (float)
+    """
+    output_format = output_format.upper()
+    if output_format not in ("THWC", "TCHW"):
+        raise ValueError(f"output_format should be either 'THWC' or 'TCHW', got {output_format}.")
+    if not os.path.exists(filename):
+        raise RuntimeError(f"File not found: {filename}")
+
+    info = {}
+    video_frames = None
+    with av.open(filename, metadata_errors="ignore") as container:
+        stream = container.streams.video[0]
+        if stream.average_rate is not None:
+            info["video_fps"] = float(stream.average_rate)
+
+        # == index the frames from the packets ==
+        frames_pts, keyframes_pts = [], []
+        for packet in container.demux(stream):
+            if packet.pts is None or packet.size == 0:
+                continue
+            frames_pts.append(packet.pts)
+            if packet.is_keyframe:
+                keyframes_pts.append(packet.pts)
+        frames_pts = np.sort(np.array(frames_pts, dtype=np.int64))
+        # read_video_av drops the frames before pts 0 and reads at most the frames in the header
+        frames_pts = frames_pts[frames_pts >= 0][: stream.frames or MAX_NUM_FRAMES]
+        if len(frames_pts) == 0:
+            raise RuntimeError(f"No video frames found in {filename}")
+        indices = np.asarray(sample_indices(len(frames_pts)))
+
+        # == decode the sampled frames ==
+        targets = defaultdict(list)  # pts -> positions in the output
+        for i, index in enumerate(indices.tolist()):
+            targets[int(frames_pts[index])].append(i)
+        first_pts, last_pts = min(targets), max(targets)
+        seek_pts = max((pts for pts in keyframes_pts if pts <= first_pts), default=int(frames_pts[0]))
+        try:
+            container.seek(seek_pts, any_frame=False, backward=True, stream=stream)
+            for frame in container.decode(stream):
+                positions = targets.pop(frame.pts, None)
+                if positions is not None:
+                    if video_frames is None:
+                        video_frames = np.empty((len(indices), frame.height, frame.width, 3), dtype=np.uint8)
+                    video_frames[positions] = frame.to_rgb().to_ndarray()
+                if len(targets) == 0 or frame.pts is not None and frame.pts > last_pts:
+                    break
+        except av.AVError as e:
+            print(f"[Warning] Error while reading video {filename}: {e}")
+
+    if len(targets) > 0:
+        vframes, _, info = read_video_av(filename=filename, pts_unit="sec", output_format=output_format)
+        if len(indices) > 0 and indices.max() >= len(vframes):
+            raise RuntimeError(f"Could not decode frames {indices.tolist()} of {filename}")
+        return vframes[indices], info
+
+    vframes = torch.from_numpy(video_frames)
+    if output_format == "TCHW":
+        # [T,H,W,C] --> [T,C,H,W]
+        vframes = vframes.permute(0, 3, 1, 2)
+    return vframes, info
+
+
 def _read_from_stream(
     video_frames,
     container: "av.container.Container",
@@ -1,3 +1,6 @@
+import hashlib
+import os
+import re
 from collections import OrderedDict, defaultdict
 from typing import Iterator
 
@@ -11,23 +14,84 @@ from opensora.utils.misc import format_numel_str
 
 from .aspect import get_num_pexels_from_name
 from .bucket import Bucket
-from .datasets import VideoTextDataset
-from .parallel import pandarallel
+from .datasets import EfficientParquet, VideoTextDataset
 from .utils import sync_object_across_devices
 
 
-# use pandarallel to accelerate bucket processing
-# NOTE: pandarallel should only access local variables
-def apply(data, method=None, seed=None, num_bucket=None, fps_max=16):
-    return method(
-        data["num_frames"],
-        data["height"],
-        data["width"],
-        data["fps"],
-        data["path"],
-        seed + data["id"] * num_bucket,
-        fps_max,
-    )
+def build_bucket_ids(
+    dataset: VideoTextDataset,
+    bucket: Bucket,
+    seed: int,
+    bucket_cache_dir: str | None = None,
+    max_cache_files: int = 4,
+) -> np.ndarray:
+    """
+    Assign every sample of the dataset to a bucket, as `VariableVideoBatchSampler` does for `seed + epoch`.
+
+    The assignment is saved under `bucket_cache_dir` and reused by later launches, keyed by the dataset file,
+    a hash of the bucket tables, the seed and the columns it depends on. Every epoch has its own seed and thus
+    its own file of 4 bytes per sample, so only the `max_cache_files` most recently used files of a dataset are
+    kept, enough for a resumed run to find the assignment of its current epoch.
+
+    Returns:
+        np.ndarray: index into `bucket.bucket_keys` of every sample, -1 for dropped samples.
+    """
+    data = dataset.data
+    if isinstance(data, EfficientParquet):
+        data = dataset._data
+    columns = [data[k].to_numpy(dtype=np.float64) for k in ("num_frames", "height", "width", "fps")]
+    seeds = seed + data.index.to_numpy(dtype=np.uint64) * np.uint64(bucket.num_bucket)
+
+    cache_path = None
+    if bucket_cache_dir is not None:
+        key = hashlib.md5(f"{bucket.digest()}-{seed}-{dataset.fps_max}".encode())
+        for column in (*columns, seeds):
+            key.update(column.tobytes())
+        name = os.path.splitext(os.path.basename(str(dataset.data_path)))[0]
+        cache_path = os.path.join(bucket_cache_dir, f"{name}_{key.hexdigest()}.npy")
+        if os.path.exists(cache_path):
+            log_message("Loading buckets from %s", cache_path)
+            bucket_ids = np.load(cache_path)
+            os.utime(cache_path)
+            return bucket_ids
+
+    log_message("Building buckets of %s samples...", format_numel_str(len(data)))
+    bucket_ids = bucket.get_bucket_ids(*columns, seeds, fps_max=dataset.fps_max)
+    if cache_path is not None:
+        os.makedirs(bucket_cache_dir, exist_ok=True)
+        tmp_path = f"{cache_path}.{os.getpid()}.tmp.npy"
+        np.save(tmp_path, bucket_ids)
+        os.replace(tmp_path, cache_path)
+        log_message("Saved buckets to %s", cache_path)
+        prune_bucket_cache(bucket_cache_dir, name, max_cache_files)
+    return bucket_ids
+
+
+def prune_bucket_cache(bucket_cache_dir: str, name: str, max_cache_files: int) -> None:
+    """Remove all but the `max_cache_files` most recently used bucket files of the dataset `name`."""
+    pattern = re.compile(rf"{re.escape(name)}_[0-9a-f]{{32}}\.npy")
+    paths = [os.path.join(bucket_cache_dir, f) for f in os.listdir(bucket_cache_dir) if pattern.fullmatch(f)]
+    paths.sort(key=os.path.getmtime, reverse=True)
+    for path in paths[max_cache_files:]:
+        os.remove(path)
+        log_message("Removed stale buckets %s", path)
+
+
+def group_by_bucket_ids(bucket: Bucket, bucket_ids: np.ndarray) -> OrderedDict:
+    """
+    Sample indices of every non-empty bucket, in the order of their first sample, with ascending indices.
+
+    Returns:
+        OrderedDict: (hw_id, t_id, ar_id) -> list of sample indices.
+    """
+    valid_indices = np.flatnonzero(bucket_ids >= 0)
+    valid_indices = valid_indices[np.argsort(bucket_ids[valid_indices], kind="stable")]
+    codes, starts = np.unique(bucket_ids[valid_indices], return_index=True)
+    groups = np.split(valid_indices, starts[1:]) if len(valid_indices) > 0 else []
+    bucket_sample_dict = OrderedDict()
+    for k in np.argsort([group[0] for group in groups], kind="stable"):
+        bucket_sample_dict[bucket.bucket_keys[codes[k]]] = groups[k].tolist()
+    return bucket_sample_dict
 
 
 class StatefulDistributedSampler(DistributedSampler):
@@ -75,6 +139,7 @@ class VariableVideoBatchSampler(DistributedSampler):
         verbose: bool = False,
         num_bucket_build_workers: int = 1,
         num_groups: int = 1,
+        bucket_cache_dir: str | None = None,
     ) -> None:
         super().__init__(
             dataset=dataset, num_replicas=num_replicas, rank=rank, shuffle=shuffle, seed=seed, drop_last=drop_last
@@ -84,18 +149,12 @@ class VariableVideoBatchSampler(DistributedSampler):
         self.bucket = Bucket(bucket_config)
         self.verbose = verbose
         self.last_micro_batch_access_index = 0
+        # buckets are assigned with vectorized numpy, kept so that existing configs still work
         self.num_bucket_build_workers = num_bucket_build_workers
         self._cached_bucket_sample_dict = None
         self._cached_num_total_batch = None
         self.num_groups = num_groups
-
-        if dist.get_rank() == 0:
-            pandarallel.initialize(
-                nb_workers=self.num_bucket_build_workers,
-                progress_bar=False,
-                verbose=0,
-                use_memory_fs=False,
-            )
+        self.bucket_cache_dir = bucket_cache_dir
 
     def __iter__(self) -> Iterator[list[int]]:
         bucket_sample_dict, _ = self.group_by_bucket()
@@ -218,31 +277,16 @@ class VariableVideoBatchSampler(DistributedSampler):
         if self._cached_bucket_sample_dict is not None:
             return self._cached_bucket_sample_dict, self._cached_num_total_batch
 
-        # use pandarallel to accelerate bucket processing
-        log_message("Building buckets using %d workers...", self.num_bucket_build_workers)
         bucket_ids = None
         if dist.get_rank() == 0:
-            data = self.dataset.data.copy(deep=True)
-            data["id"] = data.index
-            bucket_ids = data.parallel_apply(
-                apply,
-                axis=1,
-                method=self.bucket.get_bucket_id,
-                seed=self.seed + self.epoch,
-                num_bucket=self.bucket.num_bucket,
-                fps_max=self.dataset.fps_max,
-            )
+            bucket_ids = build_bucket_ids(self.dataset, self.bucket, self.seed + self.epoch, self.bucket_cache_dir)
         dist.barrier()
         bucket_ids = sync_object_across_devices(bucket_ids)
         dist.barrier()
 
         # group by bucket
         # each data sample is put into a bucket with a similar image/video size
-        bucket_sample_dict = defaultdict(list)
-        bucket_ids_np = np.array(bucket_ids)
-        valid_indices = np.where(bucket_ids_np != None)[0]
-        for i in valid_indices:
-            bucket_sample_dict[bucket_ids_np[i]].append(i)
+        bucket_sample_dict = group_by_bucket_ids(self.bucket, bucket_ids)
 
         # cache the bucket sample dict
         self._cached_bucket_sample_dict = bucket_sample_dict
@@ -82,18 +82,23 @@ def download_url(input_path):
     return output_path
 
 
-def temporal_random_crop(
-    vframes: torch.Tensor, num_frames: int, frame_interval: int, return_frame_indices: bool = False
-) -> torch.Tensor | tuple[torch.Tensor, np.ndarray]:
+def temporal_random_crop_indices(
+    total_frames: int, num_frames: int, frame_interval: int, rng: random.Random = random
+) -> np.ndarray:
     temporal_sample = video_transforms.TemporalRandomCrop(num_frames * frame_interval)
-    total_frames = len(vframes)
-    start_frame_ind, end_frame_ind = temporal_sample(total_frames)
+    start_frame_ind, end_frame_ind = temporal_sample(total_frames, rng)
 
     assert (
         end_frame_ind - start_frame_ind >= num_frames
     ), f"Not enough frames to sample, {end_frame_ind} - {start_frame_ind} < {num_frames}"
 
-    frame_indices = np.linspace(start_frame_ind, end_frame_ind - 1, num_frames, dtype=int)
+    return np.linspace(start_frame_ind, end_frame_ind - 1, num_frames, dtype=int)
+
+
+def temporal_random_crop(
+    vframes: torch.Tensor, num_frames: int, frame_interval: int, return_frame_indices: bool = False
+) -> torch.Tensor | tuple[torch.Tensor, np.ndarray]:
+    frame_indices = temporal_random_crop_indices(len(vframes), num_frames, frame_interval)
     video = vframes[frame_indices]
     if return_frame_indices:
         return video, frame_indices
@@ -199,6 +204,29 @@ def read_from_path(path, image_size, transform_name="center"):
         return read_image_from_path(path, image_size=image_size, transform_name=transform_name)
 
 
+def to_uint8_frames(x: torch.Tensor, value_range=(-1, 1), chunk_size: int | None = None) -> torch.Tensor:
+    """
+    Normalize float videos to uint8 frames on their device, as `save_sample` does on cpu.
+
+    Args:
+        x (Tensor): shape [..., C, T, H, W]
+        value_range (tuple): range of the input values, mapped to [0, 255]
+        chunk_size (int): frames converted at a time, bounds the fp32 working memory
+
+    Returns:
+        Tensor: uint8 frames of shape [..., T, H, W, C]
+    """
+    low, high = value_range
+    num_frames = x.shape[-3]
+    chunk_size = chunk_size or num_frames
+    out = torch.empty(*x.shape[:-4], *x.shape[-3:], x.shape[-4], dtype=torch.uint8, device=x.device)
+    for start in range(0, num_frames, chunk_size):
+        frames = x[..., start : start + chunk_size, :, :].to(torch.float32, copy=True)
+        frames.clamp_(min=low, max=high).sub_(low).mul_(255 / max(high - low, 1e-5)).add_(0.5).clamp_(0, 255)
+        out[..., start : start + chunk_size, :, :, :].copy_(frames.movedim(-4, -1))
+    return out
+
+
 def save_sample(
     x,
     save_path=None,
@@ -211,11 +239,18 @@ def save_sample(
 ):
     """
     Args:
-        x (Tensor): shape [C, T, H, W]
+        x (Tensor): shape [C, T, H, W], or uint8 frames of shape [T, H, W, C] from `to_uint8_frames`
     """
     assert x.ndim == 4
 
-    if not force_video and x.shape[1] == 1:  # T = 1: save as image
+    if x.dtype == torch.uint8:
+        if not force_video and x.shape[0] == 1:  # T = 1: save as image
+            save_path += ".png"
+            Image.fromarray(x[0].cpu().numpy()).save(save_path)
+        else:
+            save_path += ".mp4"
+            write_video(save_path, x.cpu(), fps=fps, video_codec="h264", options={"crf": str(crf)})
+    elif not force_video and x.shape[1] == 1:  # T = 1: save as image
         save_path += ".png"
         x = x.squeeze(1)
         save_image([x], save_path, normalize=normalize, value_range=value_range)
@@ -414,6 +449,13 @@ def save_latent(latent, path, exist_handling="overwrite"):
         save_tensor_to_disk(latent, path, exist_handling=exist_handling)
 
 
-def cache_latents(latents, path, exist_handling="overwrite"):
+def cache_latents(latents, path, exist_handling="overwrite", store=None):
+    """
+    Save every sample of a batch of latents, one file per path, or under the path as key into
+    `store` (a `LatentStoreWriter`) to avoid writing one small file per sample.
+    """
     for i in range(latents.shape[0]):
-        save_latent(latents[i], path[i], exist_handling=exist_handling)
+        if store is not None:
+            store.write(path[i], latents[i], exist_handling=exist_handling)
+        else:
+            save_latent(latents[i], path[i], exist_handling=exist_handling)
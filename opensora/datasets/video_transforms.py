@@ -12,6 +12,7 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.# Modified from Latte
 
+import math
 import numbers
 
 # - This file is adapted from https://github.com/Vchitect/Latte/blob/main/datasets/video_transforms.py
@@ -226,6 +227,104 @@ def hflip(clip):
     return clip.flip(-1)
 
 
+def get_resized_crop_params(name, clip, size):
+    """
+    The resize and crop done by the video transform `name` of `get_transforms_video` to a clip.
+
+    Args:
+        name (str): "center", "resize_crop" or "rand_size_crop"
+        clip (torch.tensor): Video clip to be transformed. Size is (T, C, H, W)
+        size (tuple(int, int)): image_size of the transform
+    Returns:
+        tuple(int, ...): size (sh, sw) of the resized clip and crop (i, j, th, tw) in the resized clip
+    """
+    h, w = clip.size(-2), clip.size(-1)
+    if name == "center":
+        assert size[0] == size[1], "image_size must be square for center crop"
+        scale_ = size[0] / min(h, w)
+        sh, sw = int(round(h * scale_)), int(round(w * scale_))
+        th, tw = size
+        if sh < th or sw < tw:
+            raise ValueError("height and width must be no smaller than crop_size")
+        return sh, sw, int(round((sh - th) / 2.0)), int(round((sw - tw) / 2.0)), th, tw
+    elif name == "resize_crop":
+        th, tw = size[0], size[1]
+        rh, rw = th / h, tw / w
+        if rh > rw:
+            sh, sw = th, round(w * rh)
+            return sh, sw, 0, int(round(sw - tw) / 2.0), th, tw
+        sh, sw = round(h * rw), tw
+        return sh, sw, int(round(sh - th) / 2.0), 0, th, tw
+    elif name == "rand_size_crop":
+        i, j, th, tw = RandomSizedCrop(size).get_params(clip)
+        return h, w, i, j, th, tw
+    raise NotImplementedError(f"Transform {name} not implemented")
+
+
+def _source_range(in_size, resized_size, start, size):
+    # input pixels read by the bilinear resize (align_corners=False) for resized pixels [start, start + size)
+    scale = in_size / resized_size
+    low = max((start + 0.5) * scale - 0.5, 0)
+    high = min(max((start + size - 0.5) * scale - 0.5, 0), in_size - 1)
+    return max(math.floor(low) - 1, 0), min(math.floor(high) + 2, in_size)
+
+
+def resized_crop_window(clip, params):
+    """
+    The part of a uint8 clip read by a resize and crop, to be transformed by `resized_crop_on_device`.
+
+    Args:
+        clip (torch.tensor, dtype=torch.uint8): Video clip to be transformed. Size is (T, C, H, W)
+        params (tuple(int, ...)): resize and crop of `get_resized_crop_params`
+    Returns:
+        window (torch.tensor, dtype=torch.uint8): Size is (T, C, h, w), h <= H and w <= W
+        transform (torch.tensor, dtype=torch.float64): resize and crop of the window. Size is (10,)
+    """
+    h, w = clip.size(-2), clip.size(-1)
+    sh, sw, i, j, th, tw = params
+    top, bottom = _source_range(h, sh, i, th)
+    left, right = _source_range(w, sw, j, tw)
+    transform = torch.tensor([top, left, h, w, h / sh, w / sw, i, j, th, tw], dtype=torch.float64)
+    return clip[..., top:bottom, left:right], transform
+
+
+def resized_crop_on_device(video, transform, mean=(0.5, 0.5, 0.5), std=(0.5, 0.5, 0.5)):
+    """
+    Batched `ToTensorVideo`, bilinear resize, crop and `Normalize` of uint8 windows on their device.
+
+    The results match the cpu transforms of `get_transforms_video` on the full clips up to float rounding.
+
+    Args:
+        video (torch.tensor, dtype=torch.uint8): windows of `resized_crop_window`, zero padded to the same size.
+            Size is (B, C, T, H, W)
+        transform (torch.tensor): transforms of `resized_crop_window`, with the same crop size. Size is (B, 10)
+    Returns:
+        video (torch.tensor, dtype=torch.float): Size is (B, C, T, th, tw)
+    """
+    B, C, T, H, W = video.shape
+    th, tw = int(transform[0, 8]), int(transform[0, 9])
+    transform = transform.to(video.device, torch.float32)
+    top, left, h, w, scale_h, scale_w, i, j = transform[:, :8].unbind(1)
+
+    def source_index(size, start, scale, in_size, offset):
+        # as the bilinear interpolation of torch, in window pixels
+        dst = torch.arange(size, device=video.device, dtype=torch.float32)
+        src = ((dst[None] + start[:, None] + 0.5) * scale[:, None] - 0.5).clamp(min=0)
+        return torch.minimum(src, in_size[:, None] - 1) - offset[:, None]
+
+    # grid_sample coordinates in [-1, 1] with align_corners=False
+    ys = (2 * source_index(th, i, scale_h, h, top) + 1) / H - 1
+    xs = (2 * source_index(tw, j, scale_w, w, left) + 1) / W - 1
+    grid = torch.stack(torch.broadcast_tensors(xs[:, None, :], ys[:, :, None]), dim=-1)
+
+    clip = video.flatten(1, 2).float().div_(255.0)
+    clip = torch.nn.functional.grid_sample(clip, grid, mode="bilinear", padding_mode="border", align_corners=False)
+    clip = clip.view(B, C, T, th, tw)
+    mean = torch.as_tensor(mean, dtype=clip.dtype, device=clip.device)
+    std = torch.as_tensor(std, dtype=clip.dtype, device=clip.device)
+    return clip.sub_(mean[:, None, None, None]).div_(std[:, None, None, None])
+
+
 class ResizeCrop:
     def __init__(self, size):
         if isinstance(size, numbers.Number):
@@ -533,9 +632,9 @@ class TemporalRandomCrop(object):
     def __init__(self, size):
         self.size = size
 
-    def __call__(self, total_frames):
+    def __call__(self, total_frames, rng=random):
         rand_end = max(0, total_frames - self.size - 1)
-        begin_index = random.randint(0, rand_end)
+        begin_index = rng.randint(0, rand_end)
         end_index = min(begin_index + self.size, total_frames)
         return begin_index, end_index
 
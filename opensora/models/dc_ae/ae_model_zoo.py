@@ -21,6 +21,7 @@ import torch
 from huggingface_hub import PyTorchModelHubMixin
 from torch import nn
 
+from opensora.models.vae.lazy_encoder import defer_encoder
 from opensora.registry import MODELS
 from opensora.utils.ckpt import load_checkpoint
 
@@ -61,16 +62,34 @@ def DC_AE(
     spatial_tile_size: int = 256,
     temporal_tile_size: int = 32,
     tile_overlap_factor: float = 0.25,
+    tile_batch_size: int | None = 1,
+    tile_memory_budget: float | None = None,
     scaling_factor: float = None,
     disc_off_grad_ckpt: bool = False,
+    lazy_encoder: bool = False,
+    encoder_device: str | torch.device | None = None,
 ) -> DCAE_HF:
-    if not from_scratch:
-        model = DCAE_HF.from_pretrained(model_name).to(device_map, torch_dtype)
+    if lazy_encoder and not from_scratch:
+        # the decoder weights are read from a checkpoint so that the encoder keys can be skipped
+        if from_pretrained is None:
+            from_pretrained = REGISTERED_DCAE_MODEL.get(model_name, (None, None))[1]
+        assert from_pretrained is not None, (
+            f"lazy_encoder=True needs from_pretrained, {model_name} has no registered default checkpoint path"
+        )
+    if not from_scratch and not lazy_encoder:
+        model = DCAE_HF.from_pretrained(model_name)
     else:
-        model = DCAE_HF(model_name).to(device_map, torch_dtype)
+        # with a lazy encoder, only the decoder weights are loaded below
+        model = DCAE_HF(model_name)
+    if lazy_encoder:
+        # decode-only jobs never move the encoder to the device, see LazyModule
+        model = defer_encoder(model, from_pretrained, encoder_device, torch_dtype)
+    model = model.to(device_map, torch_dtype)
 
     if from_pretrained is not None:
-        model = load_checkpoint(model, from_pretrained, device_map=device_map)
+        model = load_checkpoint(
+            model, from_pretrained, device_map=device_map, exclude_prefixes=("encoder.",) if lazy_encoder else ()
+        )
         print(f"loaded dc_ae from ckpt path: {from_pretrained}")
 
     model.cfg.is_training = is_training
@@ -79,6 +98,8 @@ def DC_AE(
     model.spatial_tile_size = spatial_tile_size
     model.temporal_tile_size = temporal_tile_size
     model.tile_overlap_factor = tile_overlap_factor
+    model.tile_batch_size = tile_batch_size
+    model.tile_memory_budget = tile_memory_budget
     if scaling_factor is not None:
         model.scaling_factor = scaling_factor
     model.decoder.disc_off_grad_ckpt = disc_off_grad_ckpt
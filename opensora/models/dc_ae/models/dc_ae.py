@@ -23,6 +23,8 @@ from omegaconf import MISSING, OmegaConf
 from torch import Tensor
 
 from opensora.acceleration.checkpoint import auto_grad_checkpoint
+from opensora.models.vae.tile_blending import linear_blend, overlap_add_tiles
+from opensora.models.vae.tile_scheduler import batched_tile_apply
 
 from ..utils import init_modules
 from .nn.act import build_act
@@ -541,6 +543,11 @@ class DCAE(nn.Module):
         ), f"temporal tile size {cfg.temporal_tile_size} must be divisible by temporal compression of {cfg.time_compression_ratio}"
         self.temporal_tile_latent_size = cfg.temporal_tile_size // cfg.time_compression_ratio
         self.tile_overlap_factor = cfg.tile_overlap_factor
+        # samples and tiles of the same shape run in micro-batches, optionally sharded over a process group
+        self.tile_batch_size = 1
+        self.tile_memory_budget = None
+        self.tile_process_group = None
+        self.tile_batch_process_group = None
         if self.cfg.pretrained_path is not None:
             self.load_model()
 
@@ -561,8 +568,25 @@ class DCAE(nn.Module):
     # def spatial_compression_ratio(self) -> int:
     #     return 2 ** (self.decoder.num_stages - 1)
 
+    def enable_tile_parallel(self, process_group, batch_process_group=None):
+        """
+        Shard the samples and spatial tiles over a process group, every rank gets the whole result.
+        Ranks of `batch_process_group` hold different samples, which are gathered before sharding.
+        """
+        self.tile_process_group = process_group
+        self.tile_batch_process_group = batch_process_group
+
+    def apply_tiles(self, fn, tiles: list[torch.Tensor]) -> list[torch.Tensor]:
+        return batched_tile_apply(
+            fn,
+            tiles,
+            max_batch_size=self.tile_batch_size,
+            memory_budget=self.tile_memory_budget,
+            process_group=self.tile_process_group,
+            batch_process_group=self.tile_batch_process_group,
+        )
+
     def encode_single(self, x: torch.Tensor, is_video_encoder: bool = False) -> torch.Tensor:
-        assert x.shape[0] == 1
         is_video = x.dim() == 5
         if is_video and not is_video_encoder:
             b, c, f, h, w = x.shape
@@ -570,74 +594,50 @@ class DCAE(nn.Module):
         z = self.encoder(x)
 
         if is_video and not is_video_encoder:
-            z = z.unsqueeze(dim=0).permute(0, 2, 1, 3, 4)
+            z = z.unflatten(0, (b, f)).permute(0, 2, 1, 3, 4)
 
         if self.scaling_factor is not None:
             z = z / self.scaling_factor
 
         return z
 
-    def _encode(self, x: torch.Tensor) -> torch.Tensor:
+    def _encode_batch(self, x: torch.Tensor) -> torch.Tensor:
         if self.cfg.is_training:
             return self.encoder(x)
         is_video_encoder = self.encoder.cfg.is_video if self.encoder.cfg.is_video is not None else False
-        x_ret = []
-        for i in range(x.shape[0]):
-            x_ret.append(self.encode_single(x[i : i + 1], is_video_encoder))
-        return torch.cat(x_ret, dim=0)
+        return self.encode_single(x, is_video_encoder)
+
+    def _encode(self, x: torch.Tensor) -> torch.Tensor:
+        if self.cfg.is_training:
+            return self.encoder(x)
+        return torch.cat(self.apply_tiles(self._encode_batch, list(x.split(1))), dim=0)
 
     def blend_v(self, a: torch.Tensor, b: torch.Tensor, blend_extent: int) -> torch.Tensor:
-        blend_extent = min(a.shape[-2], b.shape[-2], blend_extent)
-        for y in range(blend_extent):
-            b[:, :, :, y, :] = a[:, :, :, -blend_extent + y, :] * (1 - y / blend_extent) + b[:, :, :, y, :] * (
-                y / blend_extent
-            )
-        return b
+        return linear_blend(a, b, blend_extent, dim=-2)
 
     def blend_h(self, a: torch.Tensor, b: torch.Tensor, blend_extent: int) -> torch.Tensor:
-        blend_extent = min(a.shape[-1], b.shape[-1], blend_extent)
-        for x in range(blend_extent):
-            b[:, :, :, :, x] = a[:, :, :, :, -blend_extent + x] * (1 - x / blend_extent) + b[:, :, :, :, x] * (
-                x / blend_extent
-            )
-        return b
+        return linear_blend(a, b, blend_extent, dim=-1)
 
     def blend_t(self, a: torch.Tensor, b: torch.Tensor, blend_extent: int) -> torch.Tensor:
-        blend_extent = min(a.shape[-3], b.shape[-3], blend_extent)
-        for x in range(blend_extent):
-            b[:, :, x, :, :] = a[:, :, -blend_extent + x, :, :] * (1 - x / blend_extent) + b[:, :, x, :, :] * (
-                x / blend_extent
-            )
-        return b
+        return linear_blend(a, b, blend_extent, dim=-3)
 
     def spatial_tiled_encode(self, x: torch.Tensor) -> torch.Tensor:
         net_size = int(self.spatial_tile_size * (1 - self.tile_overlap_factor))
         blend_extent = int(self.spatial_tile_latent_size * self.tile_overlap_factor)
         row_limit = self.spatial_tile_latent_size - blend_extent
 
-        # Split video into tiles and encode them separately.
-        rows = []
-        for i in range(0, x.shape[-2], net_size):
-            row = []
-            for j in range(0, x.shape[-1], net_size):
-                tile = x[:, :, :, i : i + self.spatial_tile_size, j : j + self.spatial_tile_size]
-                tile = self._encode(tile)
-                row.append(tile)
-            rows.append(row)
-        result_rows = []
-        for i, row in enumerate(rows):
-            result_row = []
-            for j, tile in enumerate(row):
-                # blend the above tile and the left tile
-                # to the current tile and add the current tile to the result row
-                if i > 0:
-                    tile = self.blend_v(rows[i - 1][j], tile, blend_extent)
-                if j > 0:
-                    tile = self.blend_h(row[j - 1], tile, blend_extent)
-                result_row.append(tile[:, :, :, :row_limit, :row_limit])
-            result_rows.append(torch.cat(result_row, dim=-1))
-
-        return torch.cat(result_rows, dim=-2)
+        # Split video into tiles and encode them in batches of same-shaped tiles.
+        row_starts, col_starts = range(0, x.shape[-2], net_size), range(0, x.shape[-1], net_size)
+        tiles = [
+            x[:, :, :, i : i + self.spatial_tile_size, j : j + self.spatial_tile_size]
+            for i in row_starts
+            for j in col_starts
+        ]
+        tiles = self.apply_tiles(self._encode_batch, [t for tile in tiles for t in tile.split(1)])
+        tiles = [torch.cat(tiles[k : k + x.shape[0]]) for k in range(0, len(tiles), x.shape[0])]
+        rows = [tiles[k : k + len(col_starts)] for k in range(0, len(tiles), len(col_starts))]
+        # blend the overlaps with linear ramps and accumulate the tiles into the output
+        return overlap_add_tiles(rows, blend_extent, row_limit)
 
     def temporal_tiled_encode(self, x: torch.Tensor) -> torch.Tensor:
         overlap_size = int(self.temporal_tile_size * (1 - self.tile_overlap_factor))
@@ -671,51 +671,59 @@ class DCAE(nn.Module):
         else:
             return self._encode(x)
 
-    def spatial_tiled_decode(self, z: torch.FloatTensor) -> torch.Tensor:
+    def _spatial_decode_tiles(self, z: torch.Tensor) -> tuple[list[torch.Tensor], int]:
+        """Overlapping latent tiles of z, split per sample, and the number of tile columns."""
         net_size = int(self.spatial_tile_latent_size * (1 - self.tile_overlap_factor))
+        # The tiles have an overlap to avoid seams between tiles.
+        row_starts, col_starts = range(0, z.shape[-2], net_size), range(0, z.shape[-1], net_size)
+        tiles = [
+            z[:, :, :, i : i + self.spatial_tile_latent_size, j : j + self.spatial_tile_latent_size]
+            for i in row_starts
+            for j in col_starts
+        ]
+        return [t for tile in tiles for t in tile.split(1)], len(col_starts)
+
+    def _stitch_spatial_decode_tiles(self, tiles: list[torch.Tensor], batch_size: int, n_cols: int) -> torch.Tensor:
         blend_extent = int(self.spatial_tile_size * self.tile_overlap_factor)
         row_limit = self.spatial_tile_size - blend_extent
+        tiles = [torch.cat(tiles[k : k + batch_size]) for k in range(0, len(tiles), batch_size)]
+        rows = [tiles[k : k + n_cols] for k in range(0, len(tiles), n_cols)]
+        # blend the overlaps with linear ramps and accumulate the tiles into the output
+        return overlap_add_tiles(rows, blend_extent, row_limit)
 
-        # Split z into overlapping tiles and decode them separately.
-        # The tiles have an overlap to avoid seams between tiles.
-        rows = []
-        for i in range(0, z.shape[-2], net_size):
-            row = []
-            for j in range(0, z.shape[-1], net_size):
-                tile = z[:, :, :, i : i + self.spatial_tile_latent_size, j : j + self.spatial_tile_latent_size]
-                decoded = self._decode(tile)
-                row.append(decoded)
-            rows.append(row)
-        result_rows = []
-        for i, row in enumerate(rows):
-            result_row = []
-            for j, tile in enumerate(row):
-                # blend the above tile and the left tile
-                # to the current tile and add the current tile to the result row
-                if i > 0:
-                    tile = self.blend_v(rows[i - 1][j], tile, blend_extent)
-                if j > 0:
-                    tile = self.blend_h(row[j - 1], tile, blend_extent)
-                result_row.append(tile[:, :, :, :row_limit, :row_limit])
-            result_rows.append(torch.cat(result_row, dim=-1))
-
-        return torch.cat(result_rows, dim=-2)
+    def spatial_tiled_decode(self, z: torch.FloatTensor) -> torch.Tensor:
+        # Split z into overlapping tiles and decode them in batches of same-shaped tiles.
+        tiles, n_cols = self._spatial_decode_tiles(z)
+        tiles = self.apply_tiles(self._decode_batch, tiles)
+        return self._stitch_spatial_decode_tiles(tiles, z.shape[0], n_cols)
 
     def temporal_tiled_decode(self, z: torch.Tensor) -> torch.Tensor:
         overlap_size = int(self.temporal_tile_latent_size * (1 - self.tile_overlap_factor))
         blend_extent = int(self.temporal_tile_size * self.tile_overlap_factor)
         t_limit = self.temporal_tile_size - blend_extent
 
-        row = []
+        # The tiles of all temporal chunks are decoded in a single call, so that they are batched together
+        # and, with tile parallelism, sharded over the ranks at once.
+        tiles, chunks = [], []
         for i in range(0, z.shape[2], overlap_size):
             tile = z[:, :, i : i + self.temporal_tile_latent_size, :, :]
             if self.use_spatial_tiling and (
                 tile.shape[-1] > self.spatial_tile_latent_size or tile.shape[-2] > self.spatial_tile_latent_size
             ):
-                decoded = self.spatial_tiled_decode(tile)
+                chunk_tiles, n_cols = self._spatial_decode_tiles(tile)
+            else:
+                chunk_tiles, n_cols = list(tile.split(1)), None
+            chunks.append((len(tiles), len(chunk_tiles), n_cols))
+            tiles.extend(chunk_tiles)
+        tiles = self.apply_tiles(self._decode_batch, tiles)
+
+        row = []
+        for start, n_tiles, n_cols in chunks:
+            chunk_tiles = tiles[start : start + n_tiles]
+            if n_cols is None:
+                row.append(torch.cat(chunk_tiles))
             else:
-                decoded = self._decode(tile)
-            row.append(decoded)
+                row.append(self._stitch_spatial_decode_tiles(chunk_tiles, z.shape[0], n_cols))
         result_row = []
         for i, tile in enumerate(row):
             if i > 0:
@@ -725,7 +733,6 @@ class DCAE(nn.Module):
         return torch.cat(result_row, dim=2)
 
     def decode_single(self, z: torch.Tensor, is_video_decoder: bool = False) -> torch.Tensor:
-        assert z.shape[0] == 1
         is_video = z.dim() == 5
         if is_video and not is_video_decoder:
             b, c, f, h, w = z.shape
@@ -736,17 +743,19 @@ class DCAE(nn.Module):
         x = self.decoder(z)
 
         if is_video and not is_video_decoder:
-            x = x.unsqueeze(dim=0).permute(0, 2, 1, 3, 4)
+            x = x.unflatten(0, (b, f)).permute(0, 2, 1, 3, 4)
         return x
 
-    def _decode(self, z: torch.Tensor) -> torch.Tensor:
+    def _decode_batch(self, z: torch.Tensor) -> torch.Tensor:
         if self.cfg.is_training:
             return self.decoder(z)
         is_video_decoder = self.decoder.cfg.is_video if self.decoder.cfg.is_video is not None else False
-        x_ret = []
-        for i in range(z.shape[0]):
-            x_ret.append(self.decode_single(z[i : i + 1], is_video_decoder))
-        return torch.cat(x_ret, dim=0)
+        return self.decode_single(z, is_video_decoder)
+
+    def _decode(self, z: torch.Tensor) -> torch.Tensor:
+        if self.cfg.is_training:
+            return self.decoder(z)
+        return torch.cat(self.apply_tiles(self._decode_batch, list(z.split(1))), dim=0)
 
     def decode(self, z: torch.Tensor) -> torch.Tensor:
         if self.use_temporal_tiling and z.shape[2] > self.temporal_tile_latent_size:
@@ -20,13 +20,15 @@
 # LICENSE file in the root directory of this source tree.
 
 
+from collections import defaultdict
 from dataclasses import dataclass
-from typing import Dict, Optional, Tuple, Union
+from typing import Dict, Iterator, Optional, Tuple, Union
 
 import torch
 import torch.nn as nn
 from diffusers.configuration_utils import ConfigMixin, register_to_config
 
+from opensora.models.vae.lazy_encoder import defer_encoder
 from opensora.registry import MODELS
 from opensora.utils.ckpt import load_checkpoint
 
@@ -54,6 +56,8 @@ from opensora.models.hunyuan_vae.vae import (
     DiagonalGaussianDistribution,
     EncoderCausal3D,
 )
+from opensora.models.vae.tile_blending import linear_blend, overlap_add_tiles
+from opensora.models.vae.tile_scheduler import batched_tile_apply
 
 
 @dataclass
@@ -76,7 +80,12 @@ class AutoEncoder3DConfig:
     use_slicing: bool = False
     use_spatial_tiling: bool = False
     use_temporal_tiling: bool = False
+    use_streaming_decode: bool = False
+    stream_chunk_size: int = 4
+    stream_kv_cache_frames: int | None = None
     tile_overlap_factor: float = 0.25
+    tile_batch_size: int | None = 1
+    tile_memory_budget: float | None = None
     dropout: float = 0.0
     channel: bool = False
 
@@ -135,6 +144,9 @@ class AutoencoderKLCausal3D(ModelMixin, ConfigMixin, FromOriginalVAEMixin):
         self.use_slicing = config.use_slicing
         self.use_spatial_tiling = config.use_spatial_tiling
         self.use_temporal_tiling = config.use_temporal_tiling
+        self.use_streaming_decode = config.use_streaming_decode
+        self.stream_chunk_size = config.stream_chunk_size
+        self.decoder.mid_block.stream_kv_cache_frames = config.stream_kv_cache_frames
 
         # only relevant if vae tiling is enabled
         self.tile_sample_min_tsize = config.sample_tsize
@@ -144,6 +156,11 @@ class AutoencoderKLCausal3D(ModelMixin, ConfigMixin, FromOriginalVAEMixin):
         sample_size = config.sample_size[0] if isinstance(config.sample_size, (list, tuple)) else config.sample_size
         self.tile_latent_min_size = int(sample_size / (2 ** (len(config.block_out_channels) - 1)))
         self.tile_overlap_factor = config.tile_overlap_factor
+        # tiles of the same shape are encoded/decoded in micro-batches, optionally sharded over a process group
+        self.tile_batch_size = config.tile_batch_size
+        self.tile_memory_budget = config.tile_memory_budget
+        self.tile_process_group = None
+        self.tile_batch_process_group = None
 
     def enable_temporal_tiling(self, use_tiling: bool = True):
         self.use_temporal_tiling = use_tiling
@@ -174,6 +191,31 @@ class AutoencoderKLCausal3D(ModelMixin, ConfigMixin, FromOriginalVAEMixin):
         self.disable_spatial_tiling()
         self.disable_temporal_tiling()
 
+    def enable_streaming_decode(
+        self, use_streaming: bool = True, chunk_size: int | None = None, kv_cache_frames: int | None = None
+    ):
+        r"""
+        Enable streaming VAE decoding. The latents are decoded in temporal chunks that carry the causal
+        convolution and attention history of the previous chunks, instead of overlapping blended tiles.
+        `kv_cache_frames` bounds the latent frames the mid-block attention keeps from the previous chunks.
+        """
+        self.use_streaming_decode = use_streaming
+        if chunk_size is not None:
+            self.stream_chunk_size = chunk_size
+        if kv_cache_frames is not None:
+            self.decoder.mid_block.stream_kv_cache_frames = kv_cache_frames
+
+    def disable_streaming_decode(self):
+        self.enable_streaming_decode(False)
+
+    def enable_tile_parallel(self, process_group, batch_process_group=None):
+        r"""
+        Shard the spatial tiles over a process group, every rank gets the whole result. Ranks of
+        `batch_process_group` hold different samples, whose tiles are gathered before sharding.
+        """
+        self.tile_process_group = process_group
+        self.tile_batch_process_group = batch_process_group
+
     def enable_slicing(self):
         r"""
         Enable sliced VAE decoding. When this option is enabled, the VAE will split the input tensor in slices to
@@ -348,6 +390,9 @@ class AutoencoderKLCausal3D(ModelMixin, ConfigMixin, FromOriginalVAEMixin):
                 returned.
 
         """
+        if self.use_streaming_decode and z.shape[2] > self.stream_chunk_size:
+            return torch.cat(list(self.streaming_decode(z)), dim=2)
+
         z = z / self.scale_factor + self.shift_factor  # scale & shift
 
         if self.use_slicing and z.shape[0] > 1:
@@ -357,29 +402,57 @@ class AutoencoderKLCausal3D(ModelMixin, ConfigMixin, FromOriginalVAEMixin):
             decoded = self._decode(z).sample
         return decoded
 
+    def set_stream_state(self, stream_state: dict | None):
+        """Point the causal decoder layers to a streaming state, None returns to whole-clip decoding."""
+        for module in self.decoder.modules():
+            if hasattr(module, "stream_state"):
+                module.stream_state = stream_state
+
+    def streaming_decode(self, z: torch.FloatTensor, chunk_size: int | None = None) -> Iterator[torch.FloatTensor]:
+        """
+        Decode a batch of videos chunk by chunk along time.
+
+        Every `CausalConv3d` keeps its last `kernel_size - 1` input frames and the mid-block attention its
+        keys/values as state between chunks, so chunks neither overlap nor need blending. The convolutions
+        and attention see the same history as whole-clip decoding; GroupNorm statistics are computed per
+        chunk, as in tiled decoding. Spatial tiling is applied inside each chunk with one state per tile.
+
+        The convolution state is constant, but the attention cache grows by the latent frames of every chunk,
+        O(T) in memory and in attention cost per chunk, unless `stream_kv_cache_frames` bounds it.
+
+        Args:
+            z (`torch.FloatTensor`): Input batch of latent vectors.
+            chunk_size (`int`, *optional*): Number of latent frames per chunk, defaults to `stream_chunk_size`.
+
+        Yields:
+            `torch.FloatTensor`: The decoded frames of each chunk, `1 + r * (chunk_size - 1)` frames for the first
+            chunk and `r * chunk_size` for the next ones, with `r` the time compression ratio.
+        """
+        chunk_size = chunk_size or self.stream_chunk_size
+        z = z / self.scale_factor + self.shift_factor  # scale & shift
+        use_spatial_tiling = self.use_spatial_tiling and (
+            z.shape[-1] > self.tile_latent_min_size or z.shape[-2] > self.tile_latent_min_size
+        )
+        stream_states = defaultdict(dict)
+        try:
+            for i in range(0, z.shape[2], chunk_size):
+                chunk = z[:, :, i : i + chunk_size]
+                if use_spatial_tiling:
+                    yield self.spatial_tiled_decode(chunk, stream_states=stream_states).sample
+                else:
+                    self.set_stream_state(stream_states[None])
+                    yield self.decoder(self.post_quant_conv(chunk))
+        finally:
+            self.set_stream_state(None)
+
     def blend_v(self, a: torch.Tensor, b: torch.Tensor, blend_extent: int) -> torch.Tensor:
-        blend_extent = min(a.shape[-2], b.shape[-2], blend_extent)
-        for y in range(blend_extent):
-            b[:, :, :, y, :] = a[:, :, :, -blend_extent + y, :] * (1 - y / blend_extent) + b[:, :, :, y, :] * (
-                y / blend_extent
-            )
-        return b
+        return linear_blend(a, b, blend_extent, dim=-2)
 
     def blend_h(self, a: torch.Tensor, b: torch.Tensor, blend_extent: int) -> torch.Tensor:
-        blend_extent = min(a.shape[-1], b.shape[-1], blend_extent)
-        for x in range(blend_extent):
-            b[:, :, :, :, x] = a[:, :, :, :, -blend_extent + x] * (1 - x / blend_extent) + b[:, :, :, :, x] * (
-                x / blend_extent
-            )
-        return b
+        return linear_blend(a, b, blend_extent, dim=-1)
 
     def blend_t(self, a: torch.Tensor, b: torch.Tensor, blend_extent: int) -> torch.Tensor:
-        blend_extent = min(a.shape[-3], b.shape[-3], blend_extent)
-        for x in range(blend_extent):
-            b[:, :, x, :, :] = a[:, :, -blend_extent + x, :, :] * (1 - x / blend_extent) + b[:, :, x, :, :] * (
-                x / blend_extent
-            )
-        return b
+        return linear_blend(a, b, blend_extent, dim=-3)
 
     def spatial_tiled_encode(self, x: torch.FloatTensor, return_moments: bool = False) -> DiagonalGaussianDistribution:
         r"""Encode a batch of images/videos using a tiled encoder.
@@ -404,37 +477,31 @@ class AutoencoderKLCausal3D(ModelMixin, ConfigMixin, FromOriginalVAEMixin):
         blend_extent = int(self.tile_latent_min_size * self.tile_overlap_factor)
         row_limit = self.tile_latent_min_size - blend_extent
 
-        # Split video into tiles and encode them separately.
-        rows = []
-        for i in range(0, x.shape[-2], overlap_size):
-            row = []
-            for j in range(0, x.shape[-1], overlap_size):
-                tile = x[:, :, :, i : i + self.tile_sample_min_size, j : j + self.tile_sample_min_size]
-                tile = self.encoder(tile)
-                tile = self.quant_conv(tile)
-                row.append(tile)
-            rows.append(row)
-        result_rows = []
-        for i, row in enumerate(rows):
-            result_row = []
-            for j, tile in enumerate(row):
-                # blend the above tile and the left tile
-                # to the current tile and add the current tile to the result row
-                if i > 0:
-                    tile = self.blend_v(rows[i - 1][j], tile, blend_extent)
-                if j > 0:
-                    tile = self.blend_h(row[j - 1], tile, blend_extent)
-                result_row.append(tile[:, :, :, :row_limit, :row_limit])
-            result_rows.append(torch.cat(result_row, dim=-1))
-
-        moments = torch.cat(result_rows, dim=-2)
+        # Split video into tiles and encode them in batches of same-shaped tiles.
+        row_starts, col_starts = range(0, x.shape[-2], overlap_size), range(0, x.shape[-1], overlap_size)
+        tiles = [
+            x[:, :, :, i : i + self.tile_sample_min_size, j : j + self.tile_sample_min_size]
+            for i in row_starts
+            for j in col_starts
+        ]
+        tiles = batched_tile_apply(
+            lambda tile: self.quant_conv(self.encoder(tile)),
+            tiles,
+            max_batch_size=self.tile_batch_size,
+            memory_budget=self.tile_memory_budget,
+            process_group=self.tile_process_group,
+            batch_process_group=self.tile_batch_process_group,
+        )
+        rows = [tiles[k : k + len(col_starts)] for k in range(0, len(tiles), len(col_starts))]
+        # blend the overlaps with linear ramps and accumulate the tiles into the output
+        moments = overlap_add_tiles(rows, blend_extent, row_limit)
         if return_moments:
             return moments
         posterior = DiagonalGaussianDistribution(moments)
         return posterior
 
     def spatial_tiled_decode(
-        self, z: torch.FloatTensor, return_dict: bool = True
+        self, z: torch.FloatTensor, return_dict: bool = True, stream_states: dict | None = None
     ) -> Union[DecoderOutput, torch.FloatTensor]:
         r"""
         Decode a batch of images/videos using a tiled decoder.
@@ -443,6 +510,8 @@ class AutoencoderKLCausal3D(ModelMixin, ConfigMixin, FromOriginalVAEMixin):
             z (`torch.FloatTensor`): Input batch of latent vectors.
             return_dict (`bool`, *optional*, defaults to `True`):
                 Whether or not to return a [`~models.vae.DecoderOutput`] instead of a plain tuple.
+            stream_states (`dict`, *optional*):
+                Streaming decode states of the tiles, keyed by tile position.
 
         Returns:
             [`~models.vae.DecoderOutput`] or `tuple`:
@@ -453,31 +522,29 @@ class AutoencoderKLCausal3D(ModelMixin, ConfigMixin, FromOriginalVAEMixin):
         blend_extent = int(self.tile_sample_min_size * self.tile_overlap_factor)
         row_limit = self.tile_sample_min_size - blend_extent
 
-        # Split z into overlapping tiles and decode them separately.
+        # Split z into overlapping tiles and decode them in batches of same-shaped tiles.
         # The tiles have an overlap to avoid seams between tiles.
-        rows = []
-        for i in range(0, z.shape[-2], overlap_size):
-            row = []
-            for j in range(0, z.shape[-1], overlap_size):
-                tile = z[:, :, :, i : i + self.tile_latent_min_size, j : j + self.tile_latent_min_size]
-                tile = self.post_quant_conv(tile)
-                decoded = self.decoder(tile)
-                row.append(decoded)
-            rows.append(row)
-        result_rows = []
-        for i, row in enumerate(rows):
-            result_row = []
-            for j, tile in enumerate(row):
-                # blend the above tile and the left tile
-                # to the current tile and add the current tile to the result row
-                if i > 0:
-                    tile = self.blend_v(rows[i - 1][j], tile, blend_extent)
-                if j > 0:
-                    tile = self.blend_h(row[j - 1], tile, blend_extent)
-                result_row.append(tile[:, :, :, :row_limit, :row_limit])
-            result_rows.append(torch.cat(result_row, dim=-1))
-
-        dec = torch.cat(result_rows, dim=-2)
+        row_starts, col_starts = range(0, z.shape[-2], overlap_size), range(0, z.shape[-1], overlap_size)
+        positions = [(i, j) for i in row_starts for j in col_starts]
+        tiles = [z[:, :, :, i : i + self.tile_latent_min_size, j : j + self.tile_latent_min_size] for i, j in positions]
+        if stream_states is not None:
+            # every tile carries its own streaming state, decode them one by one
+            decoded = []
+            for (i, j), tile in zip(positions, tiles):
+                self.set_stream_state(stream_states[(i, j)])
+                decoded.append(self.decoder(self.post_quant_conv(tile)))
+        else:
+            decoded = batched_tile_apply(
+                lambda tile: self.decoder(self.post_quant_conv(tile)),
+                tiles,
+                max_batch_size=self.tile_batch_size,
+                memory_budget=self.tile_memory_budget,
+                process_group=self.tile_process_group,
+                batch_process_group=self.tile_batch_process_group,
+            )
+        rows = [decoded[k : k + len(col_starts)] for k in range(0, len(decoded), len(col_starts))]
+        # blend the overlaps with linear ramps and accumulate the tiles into the output
+        dec = overlap_add_tiles(rows, blend_extent, row_limit)
         if not return_dict:
             return (dec,)
 
@@ -627,12 +694,23 @@ def CausalVAE3D_HUNYUAN(
     from_pretrained: str = None,
     device_map: str | torch.device = "cuda",
     torch_dtype: torch.dtype = torch.bfloat16,
+    lazy_encoder: bool = False,
+    encoder_device: str | torch.device | None = None,
     **kwargs,
 ) -> AutoencoderKLCausal3D:
     config = AutoEncoder3DConfig(from_pretrained=from_pretrained, **kwargs)
     with torch.device(device_map):
         model = AutoencoderKLCausal3D(config).to(torch_dtype)
+    if lazy_encoder:
+        # decode-only jobs never load the encoder, see LazyModule
+        model = defer_encoder(model, from_pretrained, encoder_device, torch_dtype)
     if from_pretrained:
-        model = load_checkpoint(model, from_pretrained, device_map=device_map, strict=True)
+        model = load_checkpoint(
+            model,
+            from_pretrained,
+            device_map=device_map,
+            strict=True,
+            exclude_prefixes=("encoder.",) if lazy_encoder else (),
+        )
 
     return model
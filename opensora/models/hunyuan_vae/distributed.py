@@ -511,10 +511,10 @@ def prepare_parallel_causal_attention_mask(
         fmin = torch.finfo(torch.float16).min
     else:
         fmin = torch.finfo(dtype).min
-    mask = torch.full((local_seq_len, seq_len), fmin, dtype=dtype, device=device)
-    for i in range(local_seq_len):
-        i_frame = (i + local_seq_start) // n_hw
-        mask[i, : (i_frame + 1) * n_hw] = 0
+    q_frame = torch.arange(local_seq_start, local_seq_start + local_seq_len, device=device) // n_hw
+    k_frame = torch.arange(seq_len, device=device) // n_hw
+    mask = torch.zeros((local_seq_len, seq_len), dtype=dtype, device=device)
+    mask.masked_fill_(k_frame[None] > q_frame[:, None], fmin)
     if batch_size is not None:
         mask = mask.unsqueeze(0).expand(batch_size, -1, -1)
     return mask
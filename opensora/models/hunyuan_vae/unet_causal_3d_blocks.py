@@ -19,6 +19,7 @@
 # This source code is licensed under the license found in the
 # LICENSE file in the root directory of this source tree.
 
+from functools import lru_cache
 from typing import Optional, Tuple, Union
 
 import numpy as np
@@ -49,12 +50,16 @@ def chunk_nearest_interpolate(
     return torch.cat(x_chunks, dim=1)
 
 
+@lru_cache(maxsize=4)
+def _causal_attention_mask(n_frame: int, n_hw: int, dtype, device) -> torch.Tensor:
+    frame = torch.arange(n_frame * n_hw, device=device) // n_hw
+    mask = torch.zeros(n_frame * n_hw, n_frame * n_hw, dtype=dtype, device=device)
+    return mask.masked_fill_(frame[None] > frame[:, None], float("-inf"))
+
+
 def prepare_causal_attention_mask(n_frame: int, n_hw: int, dtype, device, batch_size: int = None):
-    seq_len = n_frame * n_hw
-    mask = torch.full((seq_len, seq_len), float("-inf"), dtype=dtype, device=device)
-    for i in range(seq_len):
-        i_frame = i // n_hw
-        mask[i, : (i_frame + 1) * n_hw] = 0
+    # cached, callers must not modify it in place
+    mask = _causal_attention_mask(n_frame, n_hw, dtype, torch.device(device))
     if batch_size is not None:
         mask = mask.unsqueeze(0).expand(batch_size, -1, -1)
     return mask
@@ -90,11 +95,29 @@ class CausalConv3d(nn.Module):
         self.time_causal_padding = padding
 
         self.conv = ChannelChunkConv3d(chan_in, chan_out, kernel_size, stride=stride, dilation=dilation, **kwargs)
+        # set by streaming decode, holds the last `kernel_size - 1` input frames of the previous chunk
+        self.stream_state = None
 
     def forward(self, x):
+        if self.stream_state is not None:
+            return self.stream_forward(x)
         x = F.pad(x, self.time_causal_padding, mode=self.pad_mode)
         return self.conv(x)
 
+    def stream_forward(self, x):
+        # pad time with the cached history instead of replicating the first frame, only the first chunk replicates
+        t_pad = self.time_causal_padding[4]
+        if t_pad > 0:
+            if self in self.stream_state:
+                x = torch.cat((self.stream_state[self], x), dim=2)
+            else:
+                x = F.pad(x, (0, 0, 0, 0, t_pad, 0), mode=self.pad_mode)
+            # a copy, a view would keep the whole padded chunk alive until the next one
+            self.stream_state[self] = x[:, :, -t_pad:].clone()
+        x = F.pad(x, self.time_causal_padding[:4] + (0, 0), mode=self.pad_mode)
+        return self.conv(x)
+
+
 class UpsampleCausal3D(nn.Module):
     """
     A 3D upsampling layer with an optional convolution.
@@ -113,6 +136,8 @@ class UpsampleCausal3D(nn.Module):
         self.out_channels = out_channels or channels
         self.upsample_factor = upsample_factor
         self.conv = CausalConv3d(self.channels, self.out_channels, kernel_size=kernel_size, bias=bias)
+        # set by streaming decode, only the first frame of the first chunk is upsampled spatially only
+        self.stream_state = None
 
     def forward(
         self,
@@ -135,6 +160,10 @@ class UpsampleCausal3D(nn.Module):
 
         # interpolate H & W only for the first frame; interpolate T & H & W for the rest
         T = hidden_states.size(2)
+        if self.stream_state is not None:
+            if self in self.stream_state:
+                return self.conv(chunk_nearest_interpolate(hidden_states, scale_factor=self.upsample_factor))
+            self.stream_state[self] = True
         first_h, other_h = hidden_states.split((1, T - 1), dim=2)
         # process non-1st frames
         if T > 1:
@@ -341,6 +370,49 @@ class UNetMidBlockCausal3D(nn.Module):
 
         self.attentions = nn.ModuleList(attentions)
         self.resnets = nn.ModuleList(resnets)
+        # set by streaming decode, holds the keys and values of the previous chunks
+        self.stream_state = None
+        # latent frames of keys/values kept between chunks, None keeps them all
+        self.stream_kv_cache_frames = None
+
+    def causal_attention(self, attn: Attention, hidden_states: torch.FloatTensor, n_hw: int) -> torch.FloatTensor:
+        """
+        Frame causal attention without a dense mask: every frame attends to itself and the frames before it,
+        including, when streaming, the cached keys/values of the previous chunks.
+
+        The cache holds every frame decoded so far, so its memory and the attention cost of a chunk grow linearly
+        with the number of chunks. `stream_kv_cache_frames` bounds it to the last frames, at the cost of dropping
+        the attention to older frames.
+        """
+        residual = hidden_states
+        hidden_states = attn.group_norm(hidden_states.transpose(1, 2)).transpose(1, 2)
+        query = attn.to_q(hidden_states)
+        key = attn.to_k(hidden_states)
+        value = attn.to_v(hidden_states)
+        if self.stream_state is not None:
+            if attn in self.stream_state:
+                past_key, past_value = self.stream_state[attn]
+                key = torch.cat((past_key, key), dim=1)
+                value = torch.cat((past_value, value), dim=1)
+            if self.stream_kv_cache_frames is None:
+                self.stream_state[attn] = (key, value)
+            else:
+                start = max(key.size(1) - self.stream_kv_cache_frames * n_hw, 0)
+                self.stream_state[attn] = (key[:, start:].clone(), value[:, start:].clone())
+
+        L = query.size(1)
+        n_past = key.size(1) - L
+        query, key, value = (rearrange(x, "b l (n d) -> b n l d", n=attn.heads) for x in (query, key, value))
+        hidden_states = torch.empty_like(query)
+        for start in range(0, L, n_hw):
+            end = start + n_hw
+            hidden_states[:, :, start:end] = F.scaled_dot_product_attention(
+                query[:, :, start:end], key[:, :, : n_past + end], value[:, :, : n_past + end]
+            )
+        hidden_states = rearrange(hidden_states, "b n l d -> b l (n d)")
+
+        hidden_states = attn.to_out[1](attn.to_out[0](hidden_states))
+        return (hidden_states + residual) / attn.rescale_output_factor
 
     def forward(self, hidden_states: torch.FloatTensor, attention_mask: Optional[torch.Tensor]) -> torch.FloatTensor:
         hidden_states = self.resnets[0](hidden_states)
@@ -348,7 +420,10 @@ class UNetMidBlockCausal3D(nn.Module):
             if attn is not None:
                 B, C, T, H, W = hidden_states.shape
                 hidden_states = rearrange(hidden_states, "b c f h w -> b (f h w) c")
-                hidden_states = attn(hidden_states, attention_mask=attention_mask)
+                if attention_mask is None:
+                    hidden_states = self.causal_attention(attn, hidden_states, H * W)
+                else:
+                    hidden_states = attn(hidden_states, attention_mask=attention_mask)
                 hidden_states = rearrange(hidden_states, "b (f h w) c -> b c f h w", f=T, h=H, w=W)
             hidden_states = resnet(hidden_states)
 
@@ -20,7 +20,6 @@ from opensora.models.hunyuan_vae.unet_causal_3d_blocks import (
     DownEncoderBlockCausal3D,
     UNetMidBlockCausal3D,
     UpDecoderBlockCausal3D,
-    prepare_causal_attention_mask,
 )
 
 
@@ -118,12 +117,10 @@ class EncoderCausal3D(nn.Module):
         conv_out_channels = 2 * out_channels if double_z else out_channels
         self.conv_out = CausalConv3d(block_out_channels[-1], conv_out_channels, kernel_size=3)
 
-    def prepare_attention_mask(self, hidden_states: torch.Tensor) -> torch.Tensor:
-        B, C, T, H, W = hidden_states.shape
-        attention_mask = prepare_causal_attention_mask(
-            T, H * W, hidden_states.dtype, hidden_states.device, batch_size=B
-        )
-        return attention_mask
+    def prepare_attention_mask(self, hidden_states: torch.Tensor) -> torch.Tensor | None:
+        # None runs the mid block frame causal attention without materializing a dense mask,
+        # parallel policies replace this method to return their explicit mask
+        return None
 
     def forward(self, sample: torch.FloatTensor) -> torch.FloatTensor:
         r"""The forward method of the `EncoderCausal3D` class."""
@@ -235,12 +232,10 @@ class DecoderCausal3D(nn.Module):
         sample = self.conv_act(sample)
         return sample
 
-    def prepare_attention_mask(self, hidden_states: torch.Tensor) -> torch.Tensor:
-        B, C, T, H, W = hidden_states.shape
-        attention_mask = prepare_causal_attention_mask(
-            T, H * W, hidden_states.dtype, hidden_states.device, batch_size=B
-        )
-        return attention_mask
+    def prepare_attention_mask(self, hidden_states: torch.Tensor) -> torch.Tensor | None:
+        # None runs the mid block frame causal attention without materializing a dense mask,
+        # parallel policies replace this method to return their explicit mask
+        return None
 
     def forward(
         self,
@@ -253,8 +248,8 @@ class DecoderCausal3D(nn.Module):
 
         upscale_dtype = next(iter(self.up_blocks.parameters())).dtype
 
-        # middle
-        if self.mid_block.add_attention:
+        # middle, streaming decode attends to the cached frames through the implicit causal path
+        if self.mid_block.add_attention and self.mid_block.stream_state is None:
             attention_mask = self.prepare_attention_mask(sample)
         else:
             attention_mask = None
@@ -1,13 +1,15 @@
+from contextlib import nullcontext
+from dataclasses import dataclass
 from functools import partial
 from typing import Dict, List, Optional, Tuple, Union
 
 import torch
 import torch.distributed as dist
 import torch.nn as nn
+import torch.nn.functional as F
 from colossalai.shardformer.layer import (FusedLinear1D_Col, FusedLinear1D_Row,
                                           Linear1D_Col, Linear1D_Row)
-from colossalai.shardformer.layer._operation import all_to_all_comm
-from colossalai.shardformer.layer.attn import RingComm, _rescale_out_lse
+from colossalai.shardformer.layer.attn import RingComm
 from colossalai.shardformer.layer.utils import is_share_sp_tp
 from colossalai.shardformer.policies.base_policy import (
     ModulePolicyDescription, Policy, SubModuleReplacementDescription)
@@ -15,7 +17,6 @@ from colossalai.shardformer.shard import ShardConfig
 from einops import rearrange
 from flash_attn.flash_attn_interface import (_flash_attn_backward,
                                              _flash_attn_forward)
-from liger_kernel.ops.rope import LigerRopeFunction
 
 try:
     from flash_attn_interface import \
@@ -30,9 +31,11 @@ except:
 from torch import Tensor
 
 from opensora.acceleration.checkpoint import auto_grad_checkpoint
+from opensora.acceleration.communications import all_to_all_single_async
+from opensora.utils.logger import log_message
 
-from .layers import DoubleStreamBlock, SingleStreamBlock
-from .math import apply_rope, attention
+from .layers import DoubleStreamBlock, SelfAttention, SingleStreamBlock
+from .math import apply_pe, attention, cat_pe, slice_pe
 from .model import MMDiTModel
 
 
@@ -91,7 +94,7 @@ class _GatherForwardSplitBackwardVarLen(torch.autograd.Function):
         ctx.dim = dim
         rank = dist.get_rank(process_group)
 
-        ctx.grad_scale = sum(splits) / splits[rank]
+        ctx.grad_scale = sum(splits) / max(splits[rank], 1)
         ctx.splits = splits
         world_size = dist.get_world_size(ctx.process_group)
         shapes = [list(input_.shape) for _ in range(world_size)]
@@ -216,8 +219,143 @@ def _fa_backward(
         )
 
 
+def _torch_attn_forward(
+    q: torch.Tensor, k: torch.Tensor, v: torch.Tensor, softmax_scale: float
+) -> Tuple[torch.Tensor, torch.Tensor]:
+    """Reference attention for CPU tensors, returns the output [B, S, N, D] and lse [B, N, S] like flash attention."""
+    q, k, v = [x.transpose(1, 2).float() for x in (q, k, v)]
+    scores = torch.matmul(q, k.transpose(-2, -1)) * softmax_scale
+    lse = torch.logsumexp(scores, dim=-1)
+    out = torch.matmul(torch.softmax(scores, dim=-1), v)
+    return out.transpose(1, 2), lse
+
+
+def _torch_attn_backward(
+    dout: torch.Tensor,
+    q: torch.Tensor,
+    k: torch.Tensor,
+    v: torch.Tensor,
+    out: torch.Tensor,
+    softmax_lse: torch.Tensor,
+    dq: torch.Tensor,
+    dk: torch.Tensor,
+    dv: torch.Tensor,
+    softmax_scale: float,
+) -> None:
+    """Reference backward of `_torch_attn_forward` given the lse over every block, writes into dq, dk and dv."""
+    dout, q, k, v, out = [x.transpose(1, 2).float() for x in (dout, q, k, v, out)]
+    probs = torch.exp(torch.matmul(q, k.transpose(-2, -1)) * softmax_scale - softmax_lse.float().unsqueeze(-1))
+    dv.copy_(torch.matmul(probs.transpose(-2, -1), dout).transpose(1, 2))
+    dscores = probs * (torch.matmul(dout, v.transpose(-2, -1)) - (dout * out).sum(-1, keepdim=True))
+    dq.copy_((torch.matmul(dscores, k) * softmax_scale).transpose(1, 2))
+    dk.copy_((torch.matmul(dscores.transpose(-2, -1), q) * softmax_scale).transpose(1, 2))
+
+
+def _merge_out_lse(out: torch.Tensor, lse: torch.Tensor, block_out: torch.Tensor, block_lse: torch.Tensor) -> None:
+    """
+    Merge one attention block into the running output in place (online softmax):
+        lse <- log(exp(lse) + exp(block_lse))
+        out <- out + sigmoid(block_lse - lse) * (block_out - out)
+
+    Args:
+        out (torch.Tensor): running fp32 output, [B, S, N, D]
+        lse (torch.Tensor): running fp32 log sum exp, [B, S, N, 1]
+        block_out (torch.Tensor): output of the new block, [B, S, N, D]
+        block_lse (torch.Tensor): log sum exp of the new block, [B, N, S]
+    """
+    block_lse = block_lse.transpose(1, 2).unsqueeze(-1)
+    out.lerp_(block_out.to(out.dtype), torch.sigmoid(block_lse - lse))
+    lse.sub_(F.logsigmoid(lse - block_lse))
+
+
+class RingAttentionTimer:
+    """
+    Per-step communication/computation timing of `RingAttention.forward`, recorded with CUDA events on the
+    compute stream and on the stream prefetching the next K/V block. Timing is only recorded for CUDA tensors.
+
+    Usage:
+        RING_ATTN_TIMER.enable()
+        ...  # run the model
+        logger.info(RING_ATTN_TIMER.summary())
+    """
+
+    def __init__(self) -> None:
+        self.enabled = False
+        self._steps = []
+
+    def enable(self) -> None:
+        self.enabled = True
+        self.reset()
+
+    def disable(self) -> None:
+        self.enabled = False
+
+    def reset(self) -> None:
+        self._steps = []
+
+    def new_step(self, with_comm: bool) -> Dict[str, torch.cuda.Event]:
+        names = ("comm_start", "comm_end", "start", "end") if with_comm else ("start", "end")
+        events = {name: torch.cuda.Event(enable_timing=True) for name in names}
+        self._steps.append(events)
+        return events
+
+    def summary(self) -> Dict[str, float]:
+        """
+        Returns the mean per-step comm and compute time (ms), the exposed communication time that did not overlap
+        with attention (ms) and the fraction of the shorter of the two that was hidden.
+        """
+        torch.cuda.synchronize()
+        comm, compute, exposed, hidden = [], [], [], []
+        for events in self._steps:
+            step_compute = events["start"].elapsed_time(events["end"])
+            compute.append(step_compute)
+            if "comm_start" not in events:
+                continue
+            step_comm = events["comm_start"].elapsed_time(events["comm_end"])
+            begin = min(0.0, events["start"].elapsed_time(events["comm_start"]))
+            finish = max(step_compute, events["start"].elapsed_time(events["comm_end"]))
+            wall = finish - begin
+            comm.append(step_comm)
+            exposed.append(max(0.0, wall - step_compute))
+            hidden.append((step_comm + step_compute - wall) / max(min(step_comm, step_compute), 1e-6))
+
+        def mean(x):
+            return sum(x) / len(x) if x else 0.0
+
+        return dict(
+            steps=len(self._steps),
+            comm_ms=mean(comm),
+            compute_ms=mean(compute),
+            exposed_comm_ms=mean(exposed),
+            overlap_ratio=mean(hidden),
+        )
+
+
+RING_ATTN_TIMER = RingAttentionTimer()
+
+
+def _ring_seq_lens(seq_lens: Optional[List[int]], local_len: int, sp_size: int) -> List[int]:
+    if seq_lens is None:
+        return [local_len] * sp_size
+    assert len(seq_lens) == sp_size, f"Expected {sp_size} sequence lengths, got {seq_lens}"
+    return list(seq_lens)
+
+
+def _stack_kv(k: torch.Tensor, v: torch.Tensor, max_len: int) -> torch.Tensor:
+    """Stack k and v of shape [B, S, N, D] into a (2, B, max_len, N, D) ring buffer, padding the sequence."""
+    if k.shape[1] == max_len:
+        return torch.stack((k, v))
+    kv = k.new_empty((2, k.shape[0], max_len, *k.shape[2:]))
+    kv[0, :, : k.shape[1]] = k
+    kv[1, :, : k.shape[1]] = v
+    return kv
+
+
+def _stream_context(stream: Optional[torch.cuda.Stream]):
+    return torch.cuda.stream(stream) if stream is not None else nullcontext()
+
+
 class RingAttention(torch.autograd.Function):
-    ATTN_DONE: torch.cuda.Event = None
     SP_STREAM: torch.cuda.Stream = None
 
     @staticmethod
@@ -231,19 +369,26 @@ class RingAttention(torch.autograd.Function):
         dropout_p: float = 0.0,
         softmax_scale: Optional[float] = None,
         deterministic: Optional[bool] = False,
+        seq_lens: Optional[List[int]] = None,
     ) -> Tuple[torch.Tensor, torch.Tensor]:
         """Ring attention forward
 
+        Step i attends to the K/V block held in one half of a preallocated double buffer while the block of step
+        i + 1 is received into the other half on `sp_stream`. The receive only waits for the attention that last
+        read its buffer (step i - 1), so the exchange always overlaps with the current `_fa_forward`.
+
         Args:
             ctx (_type_): self
             q (torch.Tensor): shape [B, S, N, D]
             k (torch.Tensor): shape [B, S, N, D]
             v (torch.Tensor): shape [B, S, N, D]
             sp_group (dist.ProcessGroup): sequence parallel group
-            sp_stream (torch.cuda.Stream): sequence parallel stream
+            sp_stream (torch.cuda.Stream): stream prefetching K/V blocks, None for CPU tensors
             dropout_p (float, optional): dropout prob. Defaults to 0.0.
             softmax_scale (Optional[float], optional): softmax scale. Defaults to None.
             deterministic (Optional[bool], optional): backward deterministic mode. Defaults to False.
+            seq_lens (Optional[List[int]], optional): local sequence length of every rank when they differ.
+                K/V blocks then travel padded to the longest one. Defaults to None (equal lengths).
 
         Returns:
             Tuple[torch.Tensor, torch.Tensor]: output and log sum exp. Output's shape should be [B, S, N, D]. LSE's shape should be [B, N, S].
@@ -251,57 +396,64 @@ class RingAttention(torch.autograd.Function):
         if softmax_scale is None:
             softmax_scale = q.shape[-1] ** (-0.5)
         sp_size = dist.get_world_size(sp_group)
+        sp_rank = dist.get_rank(sp_group)
         kv_comms: List[RingComm] = [RingComm(sp_group) for _ in range(2)]
+        seq_lens = _ring_seq_lens(seq_lens, k.shape[1], sp_size)
 
         # [B, S, N, D]
         q, k, v = [x.contiguous() for x in [q, k, v]]
-        # Pre-allocate double buffer for overlapping and receiving next step's inputs
-        kv_buffers = [torch.stack((k, v))]  # (2, B, S, N, D)
+        # double buffer: step i reads kv_buffers[i % 2], step i + 1's inputs are received in the other one
+        kv_buffers = [_stack_kv(k, v, max(seq_lens))]  # (2, B, S, N, D)
         kv_buffers.append(torch.empty_like(kv_buffers[0]))
-        # outputs
-        out = None
-        block_out = [None, None]
-        softmax_lse = [None, None]
-        block_softmax_lse = [None, None]  # log sum exp, the denominator of softmax in attention
         rng_states = [None for _ in range(sp_size)]
-        sp_streams = [torch.cuda.current_stream(), sp_stream]
+        out = softmax_lse = None
 
-        def _kv_comm(i):
-            # Avoid overwriting attn input when it shares mem with buffer
-            if not RingAttention.ATTN_DONE.query():
-                kv_buffers[(i + 1) % 2] = torch.empty_like(kv_buffers[i % 2])
-            if i < sp_size - 1:
-                kv_comms[i % 2].send_recv(kv_buffers[i % 2], kv_buffers[(i + 1) % 2])
+        timer = RING_ATTN_TIMER if RING_ATTN_TIMER.enabled and sp_stream is not None else None
+        if sp_stream is not None:
+            compute_stream = torch.cuda.current_stream()
+            attn_done = [torch.cuda.Event(), torch.cuda.Event()]
+            kv_ready = torch.cuda.Event()
+            # kv_buffers[0] is written on the compute stream
+            sp_stream.wait_stream(compute_stream)
 
         for i in range(sp_size):
-            with torch.cuda.stream(sp_streams[i % 2]):
-                # Wait for current kv from prev rank
-                # NOTE: waiting outside the current stream will NOT correctly synchronize.
-                if i == 0:
-                    _kv_comm(i)
-                else:
-                    kv_comms[(i + 1) % 2].wait()
-                kv_block = kv_buffers[i % 2]
-                q_block = q
-                block_out[i % 2], block_softmax_lse[i % 2], rng_states[i] = _fa_forward(
-                    q_block, kv_block[0], kv_block[1], dropout_p, softmax_scale
-                )
-                RingAttention.ATTN_DONE.record()
-                # Pipeline the next KV comm with output correction instead of the next flash attn
-                # to minimize idle time when comm takes longer than attn.
-                _kv_comm(i + 1)
-                block_softmax_lse[i % 2] = (
-                    block_softmax_lse[i % 2].transpose(1, 2).unsqueeze(-1).contiguous().float()
-                )  # [B, N, S] -> [B, S, N, 1]
-                assert block_out[i % 2].shape[:-1] == block_softmax_lse[i % 2].shape[:-1]
-                # Output and log sum exp correction. Ideally overlap this with the next flash attn kernel.
-                # In reality this always finishes before next flash attn; no need for extra sync.
-                if i == 0:
-                    out = block_out[0]
-                    softmax_lse = block_softmax_lse[0]
-                else:
-                    out, softmax_lse = _rescale_out_lse(out, block_out[i % 2], softmax_lse, block_softmax_lse[i % 2])
-        torch.cuda.current_stream().wait_stream(sp_stream)
+            events = timer.new_step(with_comm=i < sp_size - 1) if timer is not None else None
+            if i < sp_size - 1:
+                with _stream_context(sp_stream):
+                    if sp_stream is not None and i > 0:
+                        # the receive buffer was read by the attention of the previous step
+                        sp_stream.wait_event(attn_done[(i + 1) % 2])
+                    if events is not None:
+                        events["comm_start"].record(sp_stream)
+                    kv_comms[i % 2].send_recv(kv_buffers[i % 2], kv_buffers[(i + 1) % 2])
+                    # NOTE: waiting inside the prefetch stream only blocks that stream, not the host
+                    kv_comms[i % 2].wait()
+                    if sp_stream is not None:
+                        kv_ready.record(sp_stream)
+                    if events is not None:
+                        events["comm_end"].record(sp_stream)
+
+            if events is not None:
+                events["start"].record(compute_stream)
+            # the block of step i comes from rank (sp_rank - i)
+            kv_block = kv_buffers[i % 2][:, :, : seq_lens[(sp_rank - i) % sp_size]]
+            if q.is_cuda:
+                block_out, block_lse, rng_states[i] = _fa_forward(q, kv_block[0], kv_block[1], dropout_p, softmax_scale)
+            else:
+                block_out, block_lse = _torch_attn_forward(q, kv_block[0], kv_block[1], softmax_scale)
+            if sp_stream is not None:
+                attn_done[i % 2].record(compute_stream)
+            if events is not None:
+                events["end"].record(compute_stream)
+
+            if i == 0:
+                out = block_out.float()
+                softmax_lse = block_lse.transpose(1, 2).unsqueeze(-1).float().contiguous()  # [B, N, S] -> [B, S, N, 1]
+            else:
+                _merge_out_lse(out, softmax_lse, block_out, block_lse)
+            if sp_stream is not None and i < sp_size - 1:
+                compute_stream.wait_event(kv_ready)
+
         out = out.to(q.dtype)
         softmax_lse = softmax_lse.squeeze(-1).transpose(1, 2).contiguous()
 
@@ -309,6 +461,7 @@ class RingAttention(torch.autograd.Function):
         ctx.softmax_scale = softmax_scale
         ctx.deterministic = deterministic
         ctx.sp_group = sp_group
+        ctx.seq_lens = seq_lens
         ctx.save_for_backward(q, k, v, out, softmax_lse, *rng_states)  # lse [B, N, S]
         return out, softmax_lse
 
@@ -319,17 +472,20 @@ class RingAttention(torch.autograd.Function):
 
         sp_group = ctx.sp_group
         sp_size = dist.get_world_size(sp_group)
+        sp_rank = dist.get_rank(sp_group)
+        seq_lens = ctx.seq_lens
+        max_len = max(seq_lens)
         kv_comm = RingComm(sp_group)
         dkv_comm = RingComm(sp_group)
 
         grad_output = grad_output.contiguous()
-        kv_buffers = [torch.stack((k, v))]  # (2, B, S, N, D)
+        kv_buffers = [_stack_kv(k, v, max_len)]  # (2, B, S, N, D)
         kv_buffers.append(torch.empty_like(kv_buffers[0]))
         dq = None
         dq_block = torch.empty_like(q)
-        dk_block = torch.empty_like(k)
-        dv_block = torch.empty_like(v)
+        dkv_block = torch.empty_like(kv_buffers[0])
         dkv_buffers = [torch.empty_like(kv, dtype=torch.float) for kv in kv_buffers]
+        local_len = k.shape[1]
         del k, v
 
         for i in range(sp_size):
@@ -338,35 +494,40 @@ class RingAttention(torch.autograd.Function):
             if i < sp_size - 1:
                 kv_comm.send_recv(kv_buffers[i % 2], kv_buffers[(i + 1) % 2])
 
-            k_block, v_block = kv_buffers[i % 2]
-            _fa_backward(
-                grad_output,
-                q,
-                k_block,
-                v_block,
-                out,
-                softmax_lse,
-                dq_block,
-                dk_block,
-                dv_block,
-                rng_states[i],
-                dropout_p=ctx.dropout_p,
-                softmax_scale=ctx.softmax_scale,
-                deterministic=ctx.deterministic,
-            )
+            block_len = seq_lens[(sp_rank - i) % sp_size]
+            k_block, v_block = kv_buffers[i % 2][:, :, :block_len]
+            dk_block, dv_block = dkv_block[:, :, :block_len]
+            if not q.is_cuda:
+                _torch_attn_backward(
+                    grad_output, q, k_block, v_block, out, softmax_lse, dq_block, dk_block, dv_block, ctx.softmax_scale
+                )
+            else:
+                _fa_backward(
+                    grad_output,
+                    q,
+                    k_block,
+                    v_block,
+                    out,
+                    softmax_lse,
+                    dq_block,
+                    dk_block,
+                    dv_block,
+                    rng_states[i],
+                    dropout_p=ctx.dropout_p,
+                    softmax_scale=ctx.softmax_scale,
+                    deterministic=ctx.deterministic,
+                )
 
             if i == 0:
-                dq = dq_block.float()
-                dkv_buffers[i % 2][0] = dk_block.float()
-                dkv_buffers[i % 2][1] = dv_block.float()
+                dq = dq_block.to(torch.float, copy=True)
+                dkv_buffers[i % 2][:, :, :block_len] = dkv_block[:, :, :block_len].float()
             else:
                 dq += dq_block
                 dkv_comm.wait()
-                dkv_buffers[i % 2][0] += dk_block
-                dkv_buffers[i % 2][1] += dv_block
+                dkv_buffers[i % 2][:, :, :block_len] += dkv_block[:, :, :block_len]
             dkv_comm.send_recv(dkv_buffers[i % 2], dkv_buffers[(i + 1) % 2])
         dkv_comm.wait()
-        dkv = dkv_buffers[sp_size % 2]
+        dkv = dkv_buffers[sp_size % 2][:, :, :local_len]
 
         dq, dk, dv = [x.to(q.dtype) for x in (dq, *dkv)]
 
@@ -382,6 +543,7 @@ class RingAttention(torch.autograd.Function):
         softmax_scale: Optional[float] = None,
         deterministic: bool = False,
         return_softmax: bool = False,
+        seq_lens: Optional[List[int]] = None,
     ):
         """Ring attention
 
@@ -394,105 +556,255 @@ class RingAttention(torch.autograd.Function):
             softmax_scale (Optional[float], optional): softmax scale. Defaults to None.
             deterministic (Optional[bool], optional): backward deterministic mode. Defaults to False.
             return_softmax (bool, optional): return softmax or not. Defaults to False.
+            seq_lens (Optional[List[int]], optional): local sequence length of every rank. Defaults to None.
 
         Returns:
             Tuple[torch.Tensor, torch.Tensor]: output and log sum exp. Output's shape should be [B, S, N, D]. LSE's shape should be [B, N, S].
         """
-        if RingAttention.ATTN_DONE is None:
-            RingAttention.ATTN_DONE = torch.cuda.Event()
-        if RingAttention.SP_STREAM is None:
+        if q.is_cuda and RingAttention.SP_STREAM is None:
             RingAttention.SP_STREAM = torch.cuda.Stream()
+        sp_stream = RingAttention.SP_STREAM if q.is_cuda else None
         out, softmax_lse = RingAttention.apply(
-            q, k, v, sp_group, RingAttention.SP_STREAM, dropout_p, softmax_scale, deterministic
+            q, k, v, sp_group, sp_stream, dropout_p, softmax_scale, deterministic, seq_lens
         )
         if return_softmax:
             return out, softmax_lse
         return out
 
 
-def ring_attention(q: Tensor, k: Tensor, v: Tensor, pe: Tensor, sp_group: dist.ProcessGroup) -> Tensor:
-    if isinstance(pe, torch.Tensor):
-        q, k = apply_rope(q, k, pe)
-    else:
-        cos, sin = pe
-        q, k = LigerRopeFunction.apply(q, k, cos, sin)
+def ring_attention(
+    q: Tensor, k: Tensor, v: Tensor, pe: Tensor, sp_group: dist.ProcessGroup, seq_lens: Optional[List[int]] = None
+) -> Tensor:
+    q, k = apply_pe(q, k, pe)
     q, k, v = [x.transpose(1, 2) for x in (q, k, v)]  # [B, H, L, D] -> [B, L, H, D]
-    x = RingAttention.attention(q, k, v, sp_group)
+    x = RingAttention.attention(q, k, v, sp_group, seq_lens=seq_lens)
     x = rearrange(x, "B L H D -> B L (H D)")
     return x
 
 
+@dataclass
+class SequenceParallelContext:
+    """
+    Runtime state shared by `mmdit_model_forward` and the distributed block processors.
+
+    Args:
+        sp_group (dist.ProcessGroup): the full sequence parallel group.
+        ulysses_group (dist.ProcessGroup, optional): group exchanging heads with all-to-all (Ulysses).
+        ring_group (dist.ProcessGroup, optional): group running ring attention over the gathered sequence.
+        txt_splits (List[int], optional): number of text tokens held by each sp rank in the current forward.
+        img_splits (List[int], optional): number of image tokens held by each sp rank in the current forward.
+        num_sharded_forwards (int): number of forward passes that ran with the sequence sharded.
+    """
+
+    sp_group: dist.ProcessGroup
+    ulysses_group: Optional[dist.ProcessGroup] = None
+    ring_group: Optional[dist.ProcessGroup] = None
+    txt_splits: Optional[List[int]] = None
+    img_splits: Optional[List[int]] = None
+    num_sharded_forwards: int = 0
+
+    @classmethod
+    def from_shard_config(cls, shard_config: ShardConfig, ulysses_size: int = 1) -> "SequenceParallelContext":
+        sp_group = shard_config.sequence_parallel_process_group
+        mode = shard_config.sequence_parallelism_mode
+        if mode == "all_to_all":
+            return cls(sp_group, ulysses_group=sp_group)
+        if mode == "ring_attn" and ulysses_size > 1:
+            ulysses_group, ring_group = create_2d_sp_groups(sp_group, ulysses_size)
+            return cls(sp_group, ulysses_group=ulysses_group, ring_group=ring_group)
+        return cls(sp_group, ring_group=sp_group)
+
+    @property
+    def seq_splits(self) -> List[int]:
+        return [t + i for t, i in zip(self.txt_splits, self.img_splits)]
+
+    def update_splits(self, txt_splits: List[int], img_splits: List[int]) -> None:
+        if (txt_splits, img_splits) != (self.txt_splits, self.img_splits):
+            log_message(
+                "Sequence parallelism in effect over %s ranks: txt splits %s, img splits %s",
+                len(txt_splits),
+                txt_splits,
+                img_splits,
+            )
+        self.txt_splits, self.img_splits = txt_splits, img_splits
+        self.num_sharded_forwards += 1
+
+    def ring_lens(self) -> List[int]:
+        """Sequence length held by every rank of the ring group when attention starts."""
+        seq_splits = self.seq_splits
+        if self.ulysses_group is None:
+            return seq_splits
+        ulysses_size = dist.get_world_size(self.ulysses_group)
+        return [sum(seq_splits[i : i + ulysses_size]) for i in range(0, len(seq_splits), ulysses_size)]
+
+    def ulysses_lens(self, splits: List[int]) -> List[int]:
+        """Restrict per-sp-rank token counts to the members of this rank's Ulysses group."""
+        size = dist.get_world_size(self.ulysses_group)
+        base = dist.get_rank(self.sp_group) - dist.get_rank(self.ulysses_group)
+        return splits[base : base + size]
+
+    def use_ring(self) -> bool:
+        return self.ring_group is not None and dist.get_world_size(self.ring_group) > 1
+
+
+def create_2d_sp_groups(
+    sp_group: dist.ProcessGroup, ulysses_size: int
+) -> Tuple[dist.ProcessGroup, dist.ProcessGroup]:
+    """
+    Split a sequence parallel group into all-to-all groups of consecutive ranks (intra-node) and ring groups
+    made of the ranks with the same position in every all-to-all group (inter-node).
+
+    Every rank of the default group must call this, since `dist.new_group` is collective.
+
+    Args:
+        sp_group (dist.ProcessGroup): sequence parallel group, whose ranks are expected to be node-contiguous.
+        ulysses_size (int): size of each all-to-all group, usually the number of GPUs per node.
+
+    Returns:
+        Tuple[dist.ProcessGroup, dist.ProcessGroup]: the all-to-all group and the ring group of this rank.
+    """
+    sp_ranks = dist.get_process_group_ranks(sp_group)
+    sp_size = len(sp_ranks)
+    assert sp_size % ulysses_size == 0, f"Expected sp size({sp_size}) % ulysses size({ulysses_size}) == 0"
+    all_sp_ranks = [None] * dist.get_world_size()
+    dist.all_gather_object(all_sp_ranks, sp_ranks)
+
+    rank = dist.get_rank()
+    ulysses_group = ring_group = None
+    for ranks in sorted(set(tuple(r) for r in all_sp_ranks)):
+        for i in range(0, sp_size, ulysses_size):
+            group_ranks = list(ranks[i : i + ulysses_size])
+            group = dist.new_group(group_ranks)
+            if rank in group_ranks:
+                ulysses_group = group
+        for i in range(ulysses_size):
+            group_ranks = list(ranks[i::ulysses_size])
+            group = dist.new_group(group_ranks)
+            if rank in group_ranks:
+                ring_group = group
+    return ulysses_group, ring_group
+
+
+class UlyssesQKVExchange:
+    """
+    Fused q/k/v all-to-all for Ulysses attention: heads are scattered and the sequence is gathered in a single
+    collective. The exchange is launched on construction, so work issued before `wait` overlaps with it.
+
+    Args:
+        q, k, v (Tensor): local tensors of shape [B, H, L, D].
+        group (dist.ProcessGroup): the all-to-all group.
+        seq_lens (List[int]): local sequence length of every rank in the group.
+    """
+
+    def __init__(self, q: Tensor, k: Tensor, v: Tensor, group: dist.ProcessGroup, seq_lens: List[int]) -> None:
+        world_size = len(seq_lens)
+        B, H, _, D = q.shape
+        self.shape = (B, H // world_size, D)
+        self.seq_lens = seq_lens
+        # [U, 3, B, H/U, L, D]: one contiguous block per destination rank
+        send = torch.stack([x.unflatten(1, (world_size, H // world_size)).movedim(1, 0) for x in (q, k, v)], dim=1)
+        unit = 3 * B * (H // world_size) * D
+        self.buffer, self.work = all_to_all_single_async(
+            send, group, [send.numel() // world_size] * world_size, [unit * l for l in seq_lens]
+        )
+
+    def wait(self) -> Tuple[Tensor, Tensor, Tensor]:
+        """Returns q, k, v of shape [B, H/U, sum(seq_lens), D]."""
+        self.work.wait()
+        B, H, D = self.shape
+        chunks = self.buffer.split([3 * B * H * l * D for l in self.seq_lens])
+        qkv = torch.cat([c.view(3, B, H, l, D) for c, l in zip(chunks, self.seq_lens)], dim=3)
+        return qkv.unbind(0)
+
+
+def ulysses_gather_heads(x: Tensor, group: dist.ProcessGroup, part_lens: List[List[int]]) -> Tensor:
+    """
+    Inverse of `UlyssesQKVExchange` for the attention output.
+
+    Args:
+        x (Tensor): [B, L, H/U * D], made of consecutive parts (e.g. text then image), each being the
+            concatenation of the tokens of every rank in the group.
+        group (dist.ProcessGroup): the all-to-all group.
+        part_lens (List[List[int]]): for each part, the number of tokens contributed by every rank.
+
+    Returns:
+        Tensor: [B, L_local, H * D] holding this rank's tokens, parts kept in order.
+    """
+    world_size = dist.get_world_size(group)
+    rank = dist.get_rank(group)
+    B, _, HD = x.shape
+    parts = [p.split(lens, dim=1) for p, lens in zip(x.split([sum(lens) for lens in part_lens], dim=1), part_lens)]
+    send = torch.cat([torch.cat([p[r] for p in parts], dim=1).reshape(-1) for r in range(world_size)])
+    local_len = sum(lens[rank] for lens in part_lens)
+    input_splits = [B * sum(lens[r] for lens in part_lens) * HD for r in range(world_size)]
+    recv, work = all_to_all_single_async(send, group, input_splits, [B * local_len * HD] * world_size)
+    work.wait()
+    return rearrange(recv.view(world_size, B, local_len, HD), "U B L D -> B L (U D)")
+
+
+def _self_attention_qkv(self_attn: SelfAttention, x: Tensor, num_heads: int, head_dim: int) -> Tuple[Tensor, ...]:
+    if self_attn.fused_qkv:
+        qkv = self_attn.qkv(x)
+        q, k, v = rearrange(qkv, "B L (K H D) -> K B H L D", K=3, H=num_heads, D=head_dim)
+    else:
+        q = rearrange(self_attn.q_proj(x), "B L (H D) -> B L H D", H=num_heads)
+        k = rearrange(self_attn.k_proj(x), "B L (H D) -> B L H D", H=num_heads)
+        v = rearrange(self_attn.v_proj(x), "B L (H D) -> B L H D", H=num_heads)
+    q, k = self_attn.norm(q, k, v)
+    if not self_attn.fused_qkv:
+        q = rearrange(q, "B L H D -> B H L D")
+        k = rearrange(k, "B L H D -> B H L D")
+        v = rearrange(v, "B L H D -> B H L D")
+    return q, k, v
+
+
 class DistributedDoubleStreamBlockProcessor:
-    def __init__(self, shard_config: ShardConfig) -> None:
+    def __init__(self, shard_config: ShardConfig, sp_context: Optional[SequenceParallelContext] = None) -> None:
         self.shard_config = shard_config
+        self.sp_context = sp_context or SequenceParallelContext.from_shard_config(shard_config)
+
+    def _attention(self, q: Tensor, k: Tensor, v: Tensor, pe) -> Tensor:
+        if self.shard_config.enable_sequence_parallelism and self.sp_context.use_ring():
+            return ring_attention(q, k, v, pe, self.sp_context.ring_group, self.sp_context.ring_lens())
+        return attention(q, k, v, pe=pe)
 
     def __call__(
         self, attn: DoubleStreamBlock, img: Tensor, txt: Tensor, vec: Tensor, pe: Tensor
     ) -> tuple[Tensor, Tensor]:
         img_mod1, img_mod2 = attn.img_mod(vec)
         txt_mod1, txt_mod2 = attn.txt_mod(vec)
-
-        # prepare image for attention
-        img_modulated = attn.img_norm1(img)
-        img_modulated = (1 + img_mod1.scale) * img_modulated + img_mod1.shift
-        if attn.img_attn.fused_qkv:
-            img_qkv = attn.img_attn.qkv(img_modulated)
-            img_q, img_k, img_v = rearrange(img_qkv, "B L (K H D) -> K B H L D", K=3, H=attn.num_heads, D=attn.head_dim)
-        else:
-            img_q = rearrange(attn.img_attn.q_proj(img_modulated), "B L (H D) -> B L H D", H=attn.num_heads)
-            img_k = rearrange(attn.img_attn.k_proj(img_modulated), "B L (H D) -> B L H D", H=attn.num_heads)
-            img_v = rearrange(attn.img_attn.v_proj(img_modulated), "B L (H D) -> B L H D", H=attn.num_heads)
-        img_q, img_k = attn.img_attn.norm(img_q, img_k, img_v)
-        if not attn.img_attn.fused_qkv:
-            img_q = rearrange(img_q, "B L H D -> B H L D")
-            img_k = rearrange(img_k, "B L H D -> B H L D")
-            img_v = rearrange(img_v, "B L H D -> B H L D")
-
-        # prepare txt for attention
-        txt_modulated = attn.txt_norm1(txt)
-        txt_modulated = (1 + txt_mod1.scale) * txt_modulated + txt_mod1.shift
-        if attn.txt_attn.fused_qkv:
-            txt_qkv = attn.txt_attn.qkv(txt_modulated)
-            txt_q, txt_k, txt_v = rearrange(txt_qkv, "B L (K H D) -> K B H L D", K=3, H=attn.num_heads, D=attn.head_dim)
-        else:
-            txt_q = rearrange(attn.txt_attn.q_proj(txt_modulated), "B L (H D) -> B L H D", H=attn.num_heads)
-            txt_k = rearrange(attn.txt_attn.k_proj(txt_modulated), "B L (H D) -> B L H D", H=attn.num_heads)
-            txt_v = rearrange(attn.txt_attn.v_proj(txt_modulated), "B L (H D) -> B L H D", H=attn.num_heads)
-        txt_q, txt_k = attn.txt_attn.norm(txt_q, txt_k, txt_v)
-        if not attn.txt_attn.fused_qkv:
-            txt_q = rearrange(txt_q, "B L H D -> B H L D")
-            txt_k = rearrange(txt_k, "B L H D -> B H L D")
-            txt_v = rearrange(txt_v, "B L H D -> B H L D")
-
-        txt_len = txt_q.size(2)
-        # run actual attention
-        q = torch.cat((txt_q, img_q), dim=2)
-        k = torch.cat((txt_k, img_k), dim=2)
-        v = torch.cat((txt_v, img_v), dim=2)
-
-        if (
-            self.shard_config.enable_sequence_parallelism
-            and self.shard_config.sequence_parallelism_mode == "all_to_all"
-        ):
-            assert (
-                attn.num_heads % self.shard_config.sequence_parallel_size == 0
-            ), f"Expected num heads({attn.num_heads}) % sp size({self.shard_config.sequence_parallel_size}) == 0"
-            # TODO: overlap the communication with computation
-            q = all_to_all_comm(q, self.shard_config.sequence_parallel_process_group, scatter_dim=1, gather_dim=2)
-            k = all_to_all_comm(k, self.shard_config.sequence_parallel_process_group, scatter_dim=1, gather_dim=2)
-            v = all_to_all_comm(v, self.shard_config.sequence_parallel_process_group, scatter_dim=1, gather_dim=2)
-
-        if self.shard_config.enable_sequence_parallelism and self.shard_config.sequence_parallelism_mode == "ring_attn":
-            attn1 = ring_attention(q, k, v, pe, self.shard_config.sequence_parallel_process_group)
+        txt_len = txt.size(1)
+        ctx = self.sp_context
+
+        img_modulated = (1 + img_mod1.scale) * attn.img_norm1(img) + img_mod1.shift
+        img_q, img_k, img_v = _self_attention_qkv(attn.img_attn, img_modulated, attn.num_heads, attn.head_dim)
+
+        if self.shard_config.enable_sequence_parallelism and ctx.ulysses_group is not None:
+            # rope is position-wise, so it is applied to the local tokens before heads are scattered
+            txt_lens, img_lens = ctx.ulysses_lens(ctx.txt_splits), ctx.ulysses_lens(ctx.img_splits)
+            img_q, img_k = apply_pe(img_q, img_k, slice_pe(pe, txt_len, txt_len + img.size(1)))
+            img_exchange = UlyssesQKVExchange(img_q, img_k, img_v, ctx.ulysses_group, img_lens)
+
+            # the txt projection and norm overlap with the img exchange
+            txt_modulated = (1 + txt_mod1.scale) * attn.txt_norm1(txt) + txt_mod1.shift
+            txt_q, txt_k, txt_v = _self_attention_qkv(attn.txt_attn, txt_modulated, attn.num_heads, attn.head_dim)
+            txt_q, txt_k = apply_pe(txt_q, txt_k, slice_pe(pe, 0, txt_len))
+            txt_exchange = UlyssesQKVExchange(txt_q, txt_k, txt_v, ctx.ulysses_group, txt_lens)
+
+            txt_q, txt_k, txt_v = txt_exchange.wait()
+            img_q, img_k, img_v = img_exchange.wait()
+            q = torch.cat((txt_q, img_q), dim=2)
+            k = torch.cat((txt_k, img_k), dim=2)
+            v = torch.cat((txt_v, img_v), dim=2)
+            attn1 = self._attention(q, k, v, None)
+            attn1 = ulysses_gather_heads(attn1, ctx.ulysses_group, [txt_lens, img_lens])
         else:
-            attn1 = attention(q, k, v, pe=pe)
-        if (
-            self.shard_config.enable_sequence_parallelism
-            and self.shard_config.sequence_parallelism_mode == "all_to_all"
-        ):
-            attn1 = all_to_all_comm(
-                attn1, self.shard_config.sequence_parallel_process_group, scatter_dim=1, gather_dim=2
-            )
+            txt_modulated = (1 + txt_mod1.scale) * attn.txt_norm1(txt) + txt_mod1.shift
+            txt_q, txt_k, txt_v = _self_attention_qkv(attn.txt_attn, txt_modulated, attn.num_heads, attn.head_dim)
+            q = torch.cat((txt_q, img_q), dim=2)
+            k = torch.cat((txt_k, img_k), dim=2)
+            v = torch.cat((txt_v, img_v), dim=2)
+            attn1 = self._attention(q, k, v, pe)
         txt_attn, img_attn = attn1[:, :txt_len], attn1[:, txt_len:]
 
         # calculate the img bloks
@@ -506,12 +818,19 @@ class DistributedDoubleStreamBlockProcessor:
 
 
 class DistributedSingleStreamBlockProcessor:
-    def __init__(self, shard_config: ShardConfig) -> None:
+    def __init__(self, shard_config: ShardConfig, sp_context: Optional[SequenceParallelContext] = None) -> None:
         self.shard_config = shard_config
+        self.sp_context = sp_context or SequenceParallelContext.from_shard_config(shard_config)
+
+    def _attention(self, q: Tensor, k: Tensor, v: Tensor, pe) -> Tensor:
+        if self.shard_config.enable_sequence_parallelism and self.sp_context.use_ring():
+            return ring_attention(q, k, v, pe, self.sp_context.ring_group, self.sp_context.ring_lens())
+        return attention(q, k, v, pe=pe)
 
     def __call__(self, attn: SingleStreamBlock, x: Tensor, vec: Tensor, pe: Tensor) -> Tensor:
         mod, _ = attn.modulation(vec)
         x_mod = (1 + mod.scale) * attn.pre_norm(x) + mod.shift
+        ctx = self.sp_context
 
         if attn.fused_qkv:
             qkv, mlp = torch.split(attn.linear1(x_mod), [3 * attn.hidden_size, attn.mlp_hidden_dim], dim=-1)
@@ -527,54 +846,45 @@ class DistributedSingleStreamBlockProcessor:
             k = rearrange(k, "B L H D -> B H L D")
             v = rearrange(v, "B L H D -> B H L D")
 
-        if (
-            self.shard_config.enable_sequence_parallelism
-            and self.shard_config.sequence_parallelism_mode == "all_to_all"
-        ):
-            assert (
-                attn.num_heads % self.shard_config.sequence_parallel_size == 0
-            ), f"Expected num heads({attn.num_heads}) % sp size({self.shard_config.sequence_parallel_size}) == 0"
-            q = all_to_all_comm(q, self.shard_config.sequence_parallel_process_group, scatter_dim=1, gather_dim=2)
-            k = all_to_all_comm(k, self.shard_config.sequence_parallel_process_group, scatter_dim=1, gather_dim=2)
-            v = all_to_all_comm(v, self.shard_config.sequence_parallel_process_group, scatter_dim=1, gather_dim=2)
-
         # compute attention
-        if self.shard_config.enable_sequence_parallelism and self.shard_config.sequence_parallelism_mode == "ring_attn":
-            attn_1 = ring_attention(q, k, v, pe, self.shard_config.sequence_parallel_process_group)
+        if self.shard_config.enable_sequence_parallelism and ctx.ulysses_group is not None:
+            seq_lens = ctx.ulysses_lens(ctx.seq_splits)
+            q, k = apply_pe(q, k, pe)
+            exchange = UlyssesQKVExchange(q, k, v, ctx.ulysses_group, seq_lens)
+            # the mlp activation overlaps with the exchange
+            mlp = attn.mlp_act(mlp)
+            q, k, v = exchange.wait()
+            attn_1 = self._attention(q, k, v, None)
+            attn_1 = ulysses_gather_heads(attn_1, ctx.ulysses_group, [seq_lens])
         else:
-            attn_1 = attention(q, k, v, pe=pe)
+            attn_1 = self._attention(q, k, v, pe)
+            mlp = attn.mlp_act(mlp)
 
-        if (
-            self.shard_config.enable_sequence_parallelism
-            and self.shard_config.sequence_parallelism_mode == "all_to_all"
-        ):
-            attn_1 = all_to_all_comm(
-                attn_1, self.shard_config.sequence_parallel_process_group, scatter_dim=1, gather_dim=2
-            )
-
-        # compute activation in mlp stream, cat again and run second linear layer
-        output = attn.linear2(torch.cat((attn_1, attn.mlp_act(mlp)), 2))
+        # cat again and run second linear layer
+        output = attn.linear2(torch.cat((attn_1, mlp), 2))
         output = x + mod.gate * output
         return output
 
 
-class _TempSwitchCP(torch.autograd.Function):
-    @staticmethod
-    def forward(ctx, input_, shard_config: ShardConfig, value: bool):
-        ctx.old_value = shard_config.enable_sequence_parallelism
-        ctx.shard_config = shard_config
-        shard_config.enable_sequence_parallelism = value
-        return input_
+def partition_sequence(txt_len: int, img_len: int, sp_size: int) -> Tuple[List[int], List[int]]:
+    """
+    Split text and image tokens independently across sequence parallel ranks.
 
-    @staticmethod
-    def backward(ctx, grad_output):
-        print(f"in backward, sp mode: {ctx.shard_config.enable_sequence_parallelism}")
-        ctx.shard_config.enable_sequence_parallelism = ctx.old_value
-        return grad_output, None, None
+    Each modality is spread as evenly as possible. Extra text tokens go to the first ranks and extra image tokens
+    to the last ones, so the local sequence lengths differ by at most one and every rank holds image tokens as
+    soon as there are at least `sp_size` of them.
 
+    Args:
+        txt_len (int): number of text tokens.
+        img_len (int): number of image tokens.
+        sp_size (int): sequence parallel size.
 
-def switch_sequence_parallelism(input_, shard_config: ShardConfig, value: bool):
-    return _TempSwitchCP.apply(input_, shard_config, value)
+    Returns:
+        Tuple[List[int], List[int]]: number of text tokens and of image tokens held by each rank.
+    """
+    txt_splits = [txt_len // sp_size + int(r < txt_len % sp_size) for r in range(sp_size)]
+    img_splits = [img_len // sp_size + int(r >= sp_size - img_len % sp_size) for r in range(sp_size)]
+    return txt_splits, img_splits
 
 
 def mmdit_model_forward(
@@ -593,45 +903,43 @@ def mmdit_model_forward(
     internal_txt: Optional[Tensor] = None,
     internal_pe: Optional[Tensor] = None,
     internal_vec: Optional[Tensor] = None,
+    sp_context: Optional[SequenceParallelContext] = None,
     **kwargs,
 ):
     txt_len = txt.shape[1]
     if shard_config.pipeline_stage_manager is None or shard_config.pipeline_stage_manager.is_first_stage():
         img, txt, vec, pe = self.prepare_block_inputs(img, img_ids, txt, txt_ids, timesteps, y_vec, cond, guidance)
-        has_grad = img.grad_fn is not None
-        old_sequence_parallelism = shard_config.enable_sequence_parallelism
         if shard_config.enable_sequence_parallelism:
-            assert (
-                txt.shape[1] + img.shape[1]
-            ) % shard_config.sequence_parallel_size == 0, (
-                f"Expected {txt.shape[1] +img.shape[1]} % {shard_config.sequence_parallel_size} == 0"
-            )
-            mask = torch.zeros(txt.shape[1] + img.shape[1], dtype=bool)
-            mask[txt.shape[1] :] = 1
-            mask_chunks = mask.chunk(shard_config.sequence_parallel_size)
-            cur_mask = mask_chunks[dist.get_rank(shard_config.sequence_parallel_process_group)]
-            txt_splits = [len(c) - c.sum().item() for c in mask_chunks]
-            img_splits = [c.sum().item() for c in mask_chunks]
-            if 0 in img_splits:
-                # temporarily disable sequence parallelism to avoid stucking
-                img = switch_sequence_parallelism(img, shard_config, False)
+            sp_group = shard_config.sequence_parallel_process_group
+            sp_rank = dist.get_rank(sp_group)
+            if sp_context is None:
+                # sequence parallelism shared with tensor parallelism keeps contiguous chunks of [txt, img], so the
+                # gathered sequence is in the order of the full pe
+                assert (
+                    txt.shape[1] + img.shape[1]
+                ) % shard_config.sequence_parallel_size == 0, (
+                    f"Expected {txt.shape[1] + img.shape[1]} % {shard_config.sequence_parallel_size} == 0"
+                )
+                sp_size = shard_config.sequence_parallel_size
+                chunk_len = (txt.shape[1] + img.shape[1]) // sp_size
+                txt_splits = [min(max(txt.shape[1] - r * chunk_len, 0), chunk_len) for r in range(sp_size)]
+                img_splits = [chunk_len - t for t in txt_splits]
             else:
-                img = split_forward_gather_backward_var_len(
-                    img, 1, shard_config.sequence_parallel_process_group, img_splits
+                txt_splits, img_splits = partition_sequence(
+                    txt.shape[1], img.shape[1], shard_config.sequence_parallel_size
                 )
-                txt = split_forward_gather_backward_var_len(
-                    txt, 1, shard_config.sequence_parallel_process_group, txt_splits
+            img = split_forward_gather_backward_var_len(img, 1, sp_group, img_splits)
+            txt = split_forward_gather_backward_var_len(txt, 1, sp_group, txt_splits)
+            if sp_context is not None:
+                sp_context.update_splits(txt_splits, img_splits)
+                # pe does not require grad, keep the positions of the local tokens
+                txt_start, img_start = sum(txt_splits[:sp_rank]), txt_len + sum(img_splits[:sp_rank])
+                pe = cat_pe(
+                    [
+                        slice_pe(pe, txt_start, txt_start + txt_splits[sp_rank]),
+                        slice_pe(pe, img_start, img_start + img_splits[sp_rank]),
+                    ]
                 )
-                if shard_config.sequence_parallelism_mode == "ring_attn":
-                    # pe does not require grad
-                    sp_rank = dist.get_rank(shard_config.sequence_parallel_process_group)
-                    if isinstance(pe, torch.Tensor):
-                        pe = pe.chunk(shard_config.sequence_parallel_size, dim=2)[sp_rank].clone()
-                    else:
-                        cos, sin = pe
-                        cos = cos.chunk(shard_config.sequence_parallel_size, dim=1)[sp_rank].clone()
-                        sin = sin.chunk(shard_config.sequence_parallel_size, dim=1)[sp_rank].clone()
-                        pe = (cos, sin)
     else:
         img, txt, vec, pe = internal_img, internal_txt, internal_vec, internal_pe
 
@@ -669,7 +977,7 @@ def mmdit_model_forward(
         }
 
     if shard_config.enable_sequence_parallelism:
-        img = img[:, cur_mask]
+        img = img[:, txt_splits[sp_rank] :]
     else:
         img = img[:, txt_len:]
 
@@ -677,13 +985,23 @@ def mmdit_model_forward(
 
     if shard_config.enable_sequence_parallelism:
         img = gather_forward_split_backward_var_len(img, 1, shard_config.sequence_parallel_process_group, img_splits)
-
-    if not has_grad:
-        shard_config.enable_sequence_parallelism = old_sequence_parallelism
     return img
 
 
 class MMDiTPolicy(Policy):
+    """
+    Shardformer policy of MMDiT.
+
+    Args:
+        ulysses_size (int): with `sequence_parallelism_mode="ring_attn"`, run all-to-all attention inside groups of
+            this many consecutive sp ranks and ring attention across the groups (2D sequence parallelism).
+    """
+
+    def __init__(self, ulysses_size: int = 1) -> None:
+        super().__init__()
+        self.ulysses_size = ulysses_size
+        self.sp_context = None
+
     def config_sanity_check(self):
         if self.shard_config.enable_sequence_parallelism and is_share_sp_tp(
             self.shard_config.sequence_parallelism_mode
@@ -707,14 +1025,21 @@ class MMDiTPolicy(Policy):
 
         if self.shard_config.enable_sequence_parallelism:
             if not is_share_sp_tp(self.shard_config.sequence_parallelism_mode):
+                if self.sp_context is None:
+                    self.sp_context = SequenceParallelContext.from_shard_config(self.shard_config, self.ulysses_size)
+                if self.sp_context.ulysses_group is not None:
+                    ulysses_size = dist.get_world_size(self.sp_context.ulysses_group)
+                    assert (
+                        self.model.config.num_heads % ulysses_size == 0
+                    ), f"Expected num heads({self.model.config.num_heads}) % all-to-all size({ulysses_size}) == 0"
                 policy[DoubleStreamBlock].attribute_replacement["processor"] = DistributedDoubleStreamBlockProcessor(
-                    self.shard_config
+                    self.shard_config, self.sp_context
                 )
                 policy[SingleStreamBlock].attribute_replacement["processor"] = DistributedSingleStreamBlockProcessor(
-                    self.shard_config
+                    self.shard_config, self.sp_context
                 )
         if self.shard_config.enable_sequence_parallelism or self.shard_config.pipeline_stage_manager is not None:
-            fwd_fn = partial(mmdit_model_forward, shard_config=self.shard_config)
+            fwd_fn = partial(mmdit_model_forward, shard_config=self.shard_config, sp_context=self.sp_context)
             if self.shard_config.pipeline_stage_manager is not None:
                 layers_per_stage = self.shard_config.pipeline_stage_manager.distribute_layers(
                     len(self.model.double_blocks) + len(self.model.single_blocks)
@@ -725,7 +1050,12 @@ class MMDiTPolicy(Policy):
                     )
                 else:
                     stage_index = self.shard_config.pipeline_stage_manager.get_stage_index(layers_per_stage)
-                    fwd_fn = partial(mmdit_model_forward, shard_config=self.shard_config, stage_index=stage_index)
+                    fwd_fn = partial(
+                        mmdit_model_forward,
+                        shard_config=self.shard_config,
+                        stage_index=stage_index,
+                        sp_context=self.sp_context,
+                    )
             self.append_or_create_method_replacement(
                 description={
                     "forward": fwd_fn,
@@ -310,6 +310,15 @@ class SingleStreamBlockProcessor:
     def __call__(self, attn: nn.Module, x: Tensor, vec: Tensor, pe: Tensor) -> Tensor:
         mod, _ = attn.modulation(vec)
         x_mod = (1 + mod.scale) * attn.pre_norm(x) + mod.shift
+        output = self.branch(attn, x_mod, pe)
+        output = x + mod.gate * output
+        return output
+
+    def attention(self, q: Tensor, k: Tensor, v: Tensor, pe: Tensor) -> Tensor:
+        return attention(q, k, v, pe=pe)
+
+    def branch(self, attn: nn.Module, x_mod: Tensor, pe: Tensor) -> Tensor:
+        """Parallel attention and MLP of the block on modulated tokens, before gating and residual."""
         if attn.fused_qkv:
             qkv, mlp = torch.split(attn.linear1(x_mod), [3 * attn.hidden_size, attn.mlp_hidden_dim], dim=-1)
             q, k, v = rearrange(qkv, "B L (K H D) -> K B H L D", K=3, H=attn.num_heads)
@@ -326,12 +335,10 @@ class SingleStreamBlockProcessor:
             v = rearrange(v, "B L H D -> B H L D")
 
         # compute attention
-        attn_1 = attention(q, k, v, pe=pe)
+        attn_1 = self.attention(q, k, v, pe)
 
         # compute activation in mlp stream, cat again and run second linear layer
-        output = attn.linear2(torch.cat((attn_1, attn.mlp_act(mlp)), 2))
-        output = x + mod.gate * output
-        return output
+        return attn.linear2(torch.cat((attn_1, attn.mlp_act(mlp)), 2))
 
 
 class SingleStreamBlock(nn.Module):
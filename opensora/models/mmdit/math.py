@@ -1,4 +1,7 @@
+from dataclasses import dataclass
+
 import torch
+import torch.nn.functional as F
 from einops import rearrange
 from flash_attn import flash_attn_func as flash_attn_func_v2
 from liger_kernel.ops.rope import LigerRopeFunction
@@ -14,23 +17,37 @@ except:
 
 
 def flash_attn_func(q: Tensor, k: Tensor, v: Tensor) -> Tensor:
+    if not q.is_cuda:
+        # reference path for CPU runs (e.g. gloo-based checks), q/k/v: [B, L, H, D]
+        x = F.scaled_dot_product_attention(q.transpose(1, 2), k.transpose(1, 2), v.transpose(1, 2))
+        return x.transpose(1, 2)
     if SUPPORT_FA3:
         return flash_attn_func_v3(q, k, v)[0]
     return flash_attn_func_v2(q, k, v)
 
 
-def attention(q: Tensor, k: Tensor, v: Tensor, pe) -> Tensor:
+def apply_pe(q: Tensor, k: Tensor, pe) -> tuple[Tensor, Tensor]:
+    """Apply rotary position embedding to q and k of shape [B, H, L, D]; pe=None is a no-op."""
+    if pe is None or q.size(2) == 0:
+        return q, k
     if isinstance(pe, torch.Tensor):
-        q, k = apply_rope(q, k, pe)
-    else:
-        cos, sin = pe
-        q, k = LigerRopeFunction.apply(q, k, cos, sin)
-        # to compare with the original implementation
-        # k = reverse_rearrange_tensor(k)
+        return apply_rope(q, k, pe)
+    cos, sin = pe
+    # to compare with the original implementation
+    # k = reverse_rearrange_tensor(k)
+    return LigerRopeFunction.apply(q, k, cos, sin)
+
+
+def attention(q: Tensor, k: Tensor, v: Tensor, pe, sparse=None) -> Tensor:
+    """
+    Attention over [B, H, L, D] inputs. ``sparse`` is an optional attention backend called
+    on [B, L, H, D] q/k/v in place of flash attention, e.g. ``SpatioTemporalSparseAttention``.
+    """
+    q, k = apply_pe(q, k, pe)
     q = rearrange(q, "B H L D -> B L H D")
     k = rearrange(k, "B H L D -> B L H D")
     v = rearrange(v, "B H L D -> B L H D")
-    x = flash_attn_func(q, k, v)
+    x = flash_attn_func(q, k, v) if sparse is None else sparse(q, k, v)
     x = rearrange(x, "B L H D -> B L (H D)")
 
     return x
@@ -115,3 +132,46 @@ def reverse_rearrange_tensor(tensor):
 
     # Rearrange the tensor based on the reverse indices
     return tensor.index_select(dim=-1, index=reverse_indices)
+
+
+def slice_pe(pe, start: int, end: int):
+    """
+    Select positions [start, end) of a rotary embedding produced by EmbedND or LigerEmbedND.
+
+    Args:
+        pe (torch.Tensor | tuple): [B, 1, L, D/2, 2, 2] tensor or (cos, sin) of shape [B, L, D].
+        start (int): first position to keep.
+        end (int): position after the last one to keep.
+
+    Returns:
+        torch.Tensor | tuple: The embedding restricted to the selected positions.
+    """
+    if pe is None:
+        return None
+    if isinstance(pe, torch.Tensor):
+        return pe[:, :, start:end]
+    cos, sin = pe
+    return cos[:, start:end], sin[:, start:end]
+
+
+def cat_pe(pes: list):
+    """Concatenate rotary embeddings produced by EmbedND or LigerEmbedND along the sequence."""
+    if isinstance(pes[0], torch.Tensor):
+        return torch.cat(pes, dim=2)
+    return torch.cat([cos for cos, _ in pes], dim=1), torch.cat([sin for _, sin in pes], dim=1)
+
+
+@dataclass
+class TokenLayout:
+    """
+    Layout of the joint text and image sequence seen by the single stream blocks.
+    Shared by processors that need token positions, refreshed by the model forward.
+    """
+
+    txt_len: int = 0
+    grid: tuple[int, int, int] = (1, 1, 1)  # (t, h, w) of the image tokens
+
+    def update(self, txt_len: int, img_ids: Tensor) -> None:
+        # img_ids holds (t, h, w) coordinates in "b (t h w)" order, the last token has the largest ones
+        self.txt_len = txt_len
+        self.grid = tuple(int(i) + 1 for i in img_ids[0, -1].tolist())
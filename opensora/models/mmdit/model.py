@@ -30,8 +30,12 @@ from opensora.models.mmdit.layers import (
     LigerEmbedND,
     MLPEmbedder,
     SingleStreamBlock,
+    SingleStreamBlockProcessor,
     timestep_embedding,
 )
+from opensora.models.mmdit.math import TokenLayout
+from opensora.models.mmdit.sparse_attention import SparseSingleStreamBlockProcessor, SpatioTemporalSparseAttention
+from opensora.models.mmdit.token_reduction import build_token_reduction_processor
 from opensora.registry import MODELS
 from opensora.utils.ckpt import load_checkpoint
 
@@ -58,6 +62,8 @@ class MMDiTConfig:
     grad_ckpt_settings: tuple[int, int] | None = None
     use_liger_rope: bool = False
     patch_size: int = 2
+    token_reduction: dict | None = None
+    sparse_attention: dict | None = None
 
     def get(self, attribute_name, default=None):
         return getattr(self, attribute_name, default)
@@ -139,6 +145,7 @@ class MMDiTModel(nn.Module):
 
         self.final_layer = LastLayer(self.hidden_size, 1, self.out_channels)
         self.initialize_weights()
+        self.set_single_block_processors()
 
         if self.config.grad_ckpt_settings:
             self.forward = self.forward_selective_ckpt
@@ -201,6 +208,42 @@ class MMDiTModel(nn.Module):
 
         return img, txt, vec, pe
 
+    def set_token_reduction(self, token_reduction: dict | None):
+        """
+        Enable inference-time token reduction on a range of single stream blocks, None disables it.
+        Takes ``blocks`` as a [start, end) range and the options of ``build_token_reduction_processor``.
+        """
+        self.config.token_reduction = token_reduction
+        self.set_single_block_processors()
+
+    def set_sparse_attention(self, sparse_attention: dict | None):
+        """
+        Enable spatio-temporal sparse attention on a range of single stream blocks, None disables it.
+        Takes ``blocks`` as a [start, end) range and the options of ``SpatioTemporalSparseAttention``.
+        """
+        self.config.sparse_attention = sparse_attention
+        self.set_single_block_processors()
+
+    def set_single_block_processors(self):
+        token_reduction = dict(self.config.token_reduction or {})
+        sparse_attention = dict(self.config.sparse_attention or {})
+        num_blocks = len(self.single_blocks)
+        reduced = range(*token_reduction.pop("blocks", (0, num_blocks))) if token_reduction else range(0)
+        sparse = range(*sparse_attention.pop("blocks", (0, num_blocks))) if sparse_attention else range(0)
+        assert not set(reduced) & set(sparse), "Token reduction and sparse attention can not share blocks"
+
+        # layout of the image tokens, shared by the processors that need token positions
+        self.token_layout = TokenLayout() if token_reduction or sparse_attention else None
+        if sparse_attention:
+            sparse_attention = SpatioTemporalSparseAttention(self.token_layout, **sparse_attention)
+        for i, block in enumerate(self.single_blocks):
+            if i in reduced:
+                block.set_processor(build_token_reduction_processor(self.token_layout, **token_reduction))
+            elif i in sparse:
+                block.set_processor(SparseSingleStreamBlockProcessor(sparse_attention))
+            else:
+                block.set_processor(SingleStreamBlockProcessor())
+
     def enable_input_require_grads(self):
         """Fit peft lora. This method should not be called manually."""
         self._input_requires_grad = True
@@ -224,6 +267,8 @@ class MMDiTModel(nn.Module):
         for block in self.double_blocks:
             img, txt = auto_grad_checkpoint(block, img, txt, vec, pe)
 
+        if self.token_layout is not None:
+            self.token_layout.update(txt.shape[1], img_ids)
         img = torch.cat((txt, img), 1)
         for block in self.single_blocks:
             img = auto_grad_checkpoint(block, img, vec, pe)
@@ -256,6 +301,8 @@ class MMDiTModel(nn.Module):
             img, txt = block(img, txt, vec, pe)
 
         ckpt_depth_single = self.config.grad_ckpt_settings[1]
+        if self.token_layout is not None:
+            self.token_layout.update(txt.shape[1], img_ids)
         img = torch.cat((txt, img), 1)
         for block in self.single_blocks[:ckpt_depth_single]:
             img = auto_grad_checkpoint(block, img, vec, pe)
@@ -0,0 +1,137 @@
+import torch
+import torch.nn.functional as F
+from torch import Tensor
+
+from opensora.models.mmdit.layers import SingleStreamBlockProcessor
+from opensora.models.mmdit.math import TokenLayout, attention, flash_attn_func
+
+
+def _as_slice(index: Tensor) -> Tensor | slice:
+    """Use a slice instead of a gather when the indices are contiguous."""
+    start, end = int(index[0]), int(index[-1]) + 1
+    if end - start == index.numel():
+        return slice(start, end)
+    return index
+
+
+class SpatioTemporalSparseAttention:
+    """
+    Block sparse attention over the (t, h, w) grid of image tokens.
+
+    Image tokens are tiled into blocks of ``block_size`` (t, h, w) tokens, a size of 0 covers the
+    whole axis. A query block attends to the blocks at most ``window`` blocks away along each axis,
+    to the ``global_frames`` and to the text. Text and global frame queries attend to everything.
+
+    Examples:
+        local temporal windows with a global first frame: block_size=(4, 0, 0), window=(1, 0, 0), global_frames=(0,)
+        sliding 3D window: block_size=(4, 8, 8), window=(1, 1, 1), global_frames=()
+
+    Args:
+        layout (TokenLayout): text length and image grid, refreshed by the model forward.
+        block_size (tuple[int, int, int]): block size along (t, h, w) in tokens.
+        window (tuple[int, int, int]): attended neighbor blocks along (t, h, w).
+        global_frames (tuple[int, ...]): latent frames attended by and attending to every token, negative indices allowed.
+        backend (str): "block" runs one dense attention per query block over its gathered keys,
+            "reference" materializes the full [L, L] mask, only meant for checks on small inputs.
+    """
+
+    def __init__(
+        self,
+        layout: TokenLayout,
+        block_size: tuple[int, int, int] = (4, 0, 0),
+        window: tuple[int, int, int] = (1, 0, 0),
+        global_frames: tuple[int, ...] = (0,),
+        backend: str = "block",
+    ):
+        assert backend in ("block", "reference"), f"Unknown sparse attention backend {backend}"
+        self.layout = layout
+        self.block_size = tuple(block_size)
+        self.window = tuple(window)
+        self.global_frames = tuple(global_frames)
+        self.backend = backend
+        self._plans = {}
+
+    def _token_blocks(self, grid: tuple[int, int, int], device: torch.device) -> tuple[Tensor, Tensor, Tensor]:
+        """Block coordinates [N, 3] and global flags [N] of the image tokens, and the number of blocks per axis."""
+        sizes = torch.tensor([b if b > 0 else g for b, g in zip(self.block_size, grid)], device=device)
+        coords = torch.stack(
+            torch.meshgrid(*[torch.arange(g, device=device) for g in grid], indexing="ij"), dim=-1
+        ).view(-1, 3)
+        num_blocks = (torch.tensor(grid, device=device) + sizes - 1) // sizes
+        is_global = torch.zeros(grid[0], dtype=torch.bool, device=device)
+        if self.global_frames:
+            is_global[torch.tensor(self.global_frames, device=device) % grid[0]] = True
+        return coords // sizes, is_global[coords[:, 0]], num_blocks
+
+    def mask(self, txt_len: int, grid: tuple[int, int, int], device: torch.device) -> Tensor:
+        """Dense [L, L] boolean mask of the pattern, True where attention is allowed."""
+        blocks, is_global, _ = self._token_blocks(grid, device)
+        window = torch.tensor(self.window, device=device)
+        img_mask = ((blocks[:, None] - blocks[None]).abs() <= window).all(dim=-1)
+        img_mask |= is_global[:, None] | is_global[None]
+        L = txt_len + blocks.size(0)
+        mask = torch.ones(L, L, dtype=torch.bool, device=device)
+        mask[txt_len:, txt_len:] = img_mask
+        return mask
+
+    def plan(self, txt_len: int, grid: tuple[int, int, int], device: torch.device) -> list[tuple]:
+        """
+        (query index, key index) pairs covering every query token, cached per layout.
+        The first pair holds the text and global frame queries, which attend to all tokens.
+        """
+        key = (txt_len, grid, device)
+        if key in self._plans:
+            return self._plans[key]
+
+        blocks, is_global, num_blocks = self._token_blocks(grid, device)
+        window = torch.tensor(self.window, device=device)
+        block_ids = (blocks[:, 0] * num_blocks[1] + blocks[:, 1]) * num_blocks[2] + blocks[:, 2]
+        all_blocks = torch.stack(
+            torch.meshgrid(*[torch.arange(int(n), device=device) for n in num_blocks], indexing="ij"), dim=-1
+        ).view(-1, 3)
+
+        txt_idx = torch.arange(txt_len, device=device)
+        img_idx = torch.arange(blocks.size(0), device=device) + txt_len
+        L = txt_len + blocks.size(0)
+        plan = [(torch.cat((txt_idx, img_idx[is_global])), slice(0, L))]
+        for block_id, block in enumerate(all_blocks):
+            q_idx = img_idx[(block_ids == block_id) & ~is_global]
+            if q_idx.numel() == 0:
+                continue
+            neighbor = ((all_blocks - block).abs() <= window).all(dim=-1)
+            kv_idx = torch.cat((txt_idx, img_idx[neighbor[block_ids] | is_global]))
+            plan.append((_as_slice(q_idx), _as_slice(kv_idx)))
+        if plan[0][0].numel() == 0:
+            plan = plan[1:]
+        else:
+            plan[0] = (_as_slice(plan[0][0]), plan[0][1])
+        self._plans[key] = plan
+        return plan
+
+    def reference(self, q: Tensor, k: Tensor, v: Tensor) -> Tensor:
+        mask = self.mask(self.layout.txt_len, self.layout.grid, q.device)
+        x = F.scaled_dot_product_attention(q.transpose(1, 2), k.transpose(1, 2), v.transpose(1, 2), attn_mask=mask)
+        return x.transpose(1, 2)
+
+    def __call__(self, q: Tensor, k: Tensor, v: Tensor) -> Tensor:
+        """q, k, v: [B, L, H, D]"""
+        if self.backend == "reference":
+            return self.reference(q, k, v)
+        out = torch.empty_like(q)
+        for q_idx, kv_idx in self.plan(self.layout.txt_len, self.layout.grid, q.device):
+            x = flash_attn_func(q[:, q_idx], k[:, kv_idx], v[:, kv_idx])
+            if isinstance(q_idx, slice):
+                out[:, q_idx] = x
+            else:
+                out.index_copy_(1, q_idx, x)
+        return out
+
+
+class SparseSingleStreamBlockProcessor(SingleStreamBlockProcessor):
+    """Single stream block attending through a structured sparse pattern, see ``SpatioTemporalSparseAttention``."""
+
+    def __init__(self, sparse: SpatioTemporalSparseAttention):
+        self.sparse = sparse
+
+    def attention(self, q: Tensor, k: Tensor, v: Tensor, pe: Tensor) -> Tensor:
+        return attention(q, k, v, pe=pe, sparse=self.sparse)
@@ -0,0 +1,173 @@
+from collections.abc import Callable
+import torch
+import torch.nn.functional as F
+from torch import Tensor, nn
+
+from opensora.models.mmdit.layers import SingleStreamBlockProcessor
+from opensora.models.mmdit.math import TokenLayout, apply_pe, attention, cat_pe, slice_pe
+
+TOKEN_REDUCTION_MODES = ("merge", "kv_downsample")
+
+
+def _identity(x: Tensor) -> Tensor:
+    return x
+
+
+def gather_pe(pe: Tensor | tuple[Tensor, Tensor], index: Tensor) -> Tensor | tuple[Tensor, Tensor]:
+    """Gather per-sample sequence positions of a positional embedding, index has shape [B, L']."""
+    B, L = index.shape
+    if isinstance(pe, Tensor):
+        # [B, 1, L, D, 2, 2]
+        pe = pe.expand(B, *pe.shape[1:])
+        index = index.view(B, 1, L, 1, 1, 1).expand(-1, pe.size(1), -1, *pe.shape[3:])
+        return torch.gather(pe, 2, index)
+    # liger rope: (cos, sin) each [B, L, D]
+    return tuple(torch.gather(p.expand(B, -1, -1), 1, index[..., None].expand(-1, -1, p.size(-1))) for p in pe)
+
+
+def local_bipartite_matching(
+    metric: Tensor, grid: tuple[int, int, int], window: tuple[int, int, int], ratio: float
+) -> tuple[Callable[[Tensor], Tensor], Callable[[Tensor], Tensor], Tensor | None]:
+    """
+    ToMe style bipartite soft matching restricted to local 3D windows.
+
+    The first token of every (t, h, w) window is a destination, the others are sources.
+    Each source is only compared to the destination of its own window, which keeps the
+    matching linear in the number of tokens, and the ``ratio`` most similar sources
+    are averaged into their destination.
+
+    Args:
+        metric (Tensor): [B, N, C] features used to measure similarity.
+        grid (tuple[int, int, int]): (t, h, w) layout of the N tokens.
+        window (tuple[int, int, int]): window size along (t, h, w).
+        ratio (float): fraction of the N tokens to remove.
+
+    Returns:
+        merge, unmerge functions and the [B, N'] original index of every kept token.
+    """
+    B, N, _ = metric.shape
+    device = metric.device
+    t, h, w = grid
+    assert t * h * w == N, f"Token grid {grid} does not match {N} tokens"
+
+    is_dst = torch.zeros(t, h, w, dtype=torch.bool, device=device)
+    is_dst[:: window[0], :: window[1], :: window[2]] = True
+    is_dst = is_dst.flatten()
+    positions = torch.arange(N, device=device)
+    dst_idx, src_idx = positions[is_dst], positions[~is_dst]
+    num_dst = dst_idx.numel()
+    r = min(int(N * ratio), src_idx.numel())
+    if r <= 0:
+        return _identity, _identity, None
+
+    # destination slot of every source, i.e. the first token of its window
+    dst_slot = torch.empty(N, dtype=torch.long, device=device)
+    dst_slot[dst_idx] = torch.arange(num_dst, device=device)
+    src_t = src_idx // (h * w)
+    src_h = src_idx // w % h
+    src_w = src_idx % w
+    src_dst = (src_t - src_t % window[0]) * h * w + (src_h - src_h % window[1]) * w + (src_w - src_w % window[2])
+    src_dst = dst_slot[src_dst]
+
+    with torch.no_grad():
+        metric = metric / metric.norm(dim=-1, keepdim=True)
+        scores = (metric[:, src_idx] * metric[:, dst_idx[src_dst]]).sum(dim=-1)  # [B, Ns]
+        order = scores.argsort(dim=-1, descending=True)
+    merged, unmerged = order[:, :r], order[:, r:]  # positions within the sources
+    merged_dst = src_dst[merged]  # [B, r]
+    kept_idx = torch.cat((src_idx[unmerged], dst_idx.expand(B, -1)), dim=1)
+
+    def merge(x: Tensor) -> Tensor:
+        C = x.size(-1)
+        src, dst = x[:, src_idx], x[:, dst_idx]
+        unm = torch.gather(src, 1, unmerged[..., None].expand(-1, -1, C))
+        src = torch.gather(src, 1, merged[..., None].expand(-1, -1, C))
+        dst = dst.scatter_reduce(1, merged_dst[..., None].expand(-1, -1, C), src, reduce="mean")
+        return torch.cat((unm, dst), dim=1)
+
+    def unmerge(x: Tensor) -> Tensor:
+        C = x.size(-1)
+        unm, dst = x.split([x.size(1) - num_dst, num_dst], dim=1)
+        out = x.new_empty(B, N, C)
+        out[:, dst_idx] = dst
+        out.scatter_(1, src_idx[unmerged][..., None].expand(-1, -1, C), unm)
+        src = torch.gather(dst, 1, merged_dst[..., None].expand(-1, -1, C))
+        out.scatter_(1, src_idx[merged][..., None].expand(-1, -1, C), src)
+        return out
+
+    return merge, unmerge, kept_idx
+
+
+class TokenMergeSingleStreamBlockProcessor(SingleStreamBlockProcessor):
+    """
+    Merges similar image tokens before a single stream block and unmerges its output.
+    Text tokens are never merged. Only active in eval mode.
+    """
+
+    def __init__(self, layout: TokenLayout, ratio: float = 0.5, window: tuple[int, int, int] = (1, 2, 2)):
+        self.layout = layout
+        self.ratio = ratio
+        self.window = tuple(window)
+
+    def __call__(self, attn: nn.Module, x: Tensor, vec: Tensor, pe: Tensor) -> Tensor:
+        if attn.training:
+            return super().__call__(attn, x, vec, pe)
+
+        txt_len = self.layout.txt_len
+        mod, _ = attn.modulation(vec)
+        x_mod = (1 + mod.scale) * attn.pre_norm(x) + mod.shift
+
+        txt_mod, img_mod = x_mod[:, :txt_len], x_mod[:, txt_len:]
+        merge, unmerge, kept_idx = local_bipartite_matching(img_mod, self.layout.grid, self.window, self.ratio)
+        if kept_idx is not None:
+            pe = cat_pe([slice_pe(pe, 0, txt_len), gather_pe(slice_pe(pe, txt_len, x.size(1)), kept_idx)])
+
+        output = self.branch(attn, torch.cat((txt_mod, merge(img_mod)), dim=1), pe)
+        output = torch.cat((output[:, :txt_len], unmerge(output[:, txt_len:])), dim=1)
+        return x + mod.gate * output
+
+
+class KVDownsampleSingleStreamBlockProcessor(SingleStreamBlockProcessor):
+    """
+    Keeps every query but attends to average pooled image keys and values.
+    Rope is applied at full resolution before pooling. Only active in eval mode.
+    """
+
+    def __init__(self, layout: TokenLayout, kv_stride: tuple[int, int, int] = (1, 2, 2)):
+        self.layout = layout
+        self.kv_stride = tuple(kv_stride)
+        self.full_attention = SingleStreamBlockProcessor()
+
+    def __call__(self, attn: nn.Module, x: Tensor, vec: Tensor, pe: Tensor) -> Tensor:
+        if attn.training:
+            return self.full_attention(attn, x, vec, pe)
+        return super().__call__(attn, x, vec, pe)
+
+    def _pool(self, x: Tensor) -> Tensor:
+        B, H, _, D = x.shape
+        t, h, w = self.layout.grid
+        x = x.reshape(B * H, t, h, w, D).permute(0, 4, 1, 2, 3)
+        x = F.avg_pool3d(x, self.kv_stride, self.kv_stride, ceil_mode=True)
+        return x.flatten(2).transpose(1, 2).reshape(B, H, -1, D)
+
+    def attention(self, q: Tensor, k: Tensor, v: Tensor, pe: Tensor) -> Tensor:
+        txt_len = self.layout.txt_len
+        q, k = apply_pe(q, k, pe)
+        k = torch.cat((k[:, :, :txt_len], self._pool(k[:, :, txt_len:])), dim=2)
+        v = torch.cat((v[:, :, :txt_len], self._pool(v[:, :, txt_len:])), dim=2)
+        return attention(q, k, v, pe=None)
+
+
+def build_token_reduction_processor(layout: TokenLayout, mode: str = "merge", **kwargs) -> SingleStreamBlockProcessor:
+    """
+    Build the token reduction processor of a single stream block.
+
+    Args:
+        layout (TokenLayout): layout shared with the model forward.
+        mode (str): "merge" to merge similar image tokens (``ratio``, ``window``),
+            "kv_downsample" to attend to pooled image keys and values (``kv_stride``).
+    """
+    assert mode in TOKEN_REDUCTION_MODES, f"Unknown token reduction mode {mode}, expected one of {TOKEN_REDUCTION_MODES}"
+    if mode == "merge":
+        return TokenMergeSingleStreamBlockProcessor(layout, **kwargs)
+    return KVDownsampleSingleStreamBlockProcessor(layout, **kwargs)
@@ -8,9 +8,12 @@ from opensora.registry import MODELS
 
 @MODELS.register_module("text_embedder")
 class HFEmbedder(nn.Module):
-    def __init__(self, from_pretrained: str, max_length: int, shardformer: bool = False, **hf_kwargs):
+    def __init__(
+        self, from_pretrained: str, max_length: int, shardformer: bool = False, is_clip: bool = None, **hf_kwargs
+    ):
         super().__init__()
-        self.is_clip = "openai" in from_pretrained
+        # inferred from the name unless given, e.g. for small test checkpoints
+        self.is_clip = "openai" in from_pretrained if is_clip is None else is_clip
         self.max_length = max_length
         self.output_key = "pooler_output" if self.is_clip else "last_hidden_state"
 
@@ -27,6 +27,7 @@ from torch.nn.functional import silu as swish
 from opensora.registry import MODELS
 from opensora.utils.ckpt import load_checkpoint
 
+from .lazy_encoder import defer_encoder
 from .utils import DiagonalGaussianDistribution
 
 
@@ -318,6 +319,8 @@ def AutoEncoderFlux(
     shift_factor=0.1159,
     device_map: str | torch.device = "cuda",
     torch_dtype: torch.dtype = torch.bfloat16,
+    lazy_encoder: bool = False,
+    encoder_device: str | torch.device | None = None,
 ) -> AutoEncoder:
     config = AutoEncoderConfig(
         from_pretrained=from_pretrained,
@@ -334,6 +337,15 @@ def AutoEncoderFlux(
     )
     with torch.device(device_map):
         model = AutoEncoder(config).to(torch_dtype)
+    if lazy_encoder:
+        # decode-only jobs never load the encoder, see LazyModule
+        model = defer_encoder(model, from_pretrained or None, encoder_device, torch_dtype, cache_dir)
     if from_pretrained:
-        model = load_checkpoint(model, from_pretrained, cache_dir=cache_dir, device_map=device_map)
+        model = load_checkpoint(
+            model,
+            from_pretrained,
+            cache_dir=cache_dir,
+            device_map=device_map,
+            exclude_prefixes=("encoder.",) if lazy_encoder else (),
+        )
     return model
@@ -0,0 +1,90 @@
+import torch
+from torch import nn
+
+from opensora.utils.ckpt import load_state_dict_subset
+from opensora.utils.logger import log_message
+
+
+class LazyModule(nn.Module):
+    """
+    Stand-in for a submodule that is only needed by some jobs, e.g. the encoder of a VAE used for decoding.
+
+    The wrapped module is kept out of the module tree, so it takes no device memory until the first call:
+    with a checkpoint its weights stay on the meta device and only its own keys are read on first use,
+    without one they are parked on cpu. Moving or casting the parent does not touch it.
+
+    Args:
+        module (nn.Module): the submodule to defer.
+        path (str | None): checkpoint holding the weights of the submodule under `prefix`,
+            None to keep the current weights on cpu.
+        prefix (str): key prefix of the submodule in the checkpoint.
+        device (torch.device | str | None): device the submodule runs on, e.g. "cpu" to never use
+            accelerator memory for it, None to follow the device of its inputs.
+        torch_dtype (torch.dtype | None): dtype of the materialized submodule.
+        cache_dir (str | None): the directory to cache the downloaded checkpoint.
+    """
+
+    def __init__(
+        self,
+        module: nn.Module,
+        path: str | None = None,
+        prefix: str = "encoder.",
+        device: torch.device | str | None = None,
+        torch_dtype: torch.dtype | None = None,
+        cache_dir: str | None = None,
+    ):
+        super().__init__()
+        self.path = path
+        self.prefix = prefix
+        self.device = device
+        self.torch_dtype = torch_dtype
+        self.cache_dir = cache_dir
+        self.materialized = False
+        # not registered as a submodule on purpose
+        self.__dict__["module"] = module.to("meta" if path is not None else "cpu")
+
+    def materialize(self, device: torch.device | str | None = None) -> nn.Module:
+        module = self.__dict__["module"]
+        device = self.device or device or "cpu"
+        if not self.materialized:
+            log_message(f"Materializing deferred {self.prefix.rstrip('.')} on {device}")
+            if self.path is not None:
+                module = module.to_empty(device=device)
+                module.load_state_dict(load_state_dict_subset(self.path, self.prefix, self.cache_dir), strict=True)
+            self.materialized = True
+        module = module.to(device=device, dtype=self.torch_dtype)
+        self.__dict__["module"] = module
+        return module
+
+    def forward(self, x: torch.Tensor, *args, **kwargs):
+        module = self.materialize(x.device)
+        module.train(self.training)
+        device = next(module.parameters()).device
+        out = module(x.to(device), *args, **kwargs)
+        if isinstance(out, torch.Tensor):
+            out = out.to(x.device)
+        return out
+
+    def __getattr__(self, name: str):
+        try:
+            return super().__getattr__(name)
+        except AttributeError:
+            # attributes such as configs are readable without materializing the weights
+            return getattr(self.__dict__["module"], name)
+
+
+def defer_encoder(
+    model: nn.Module,
+    path: str | None = None,
+    device: torch.device | str | None = None,
+    torch_dtype: torch.dtype | None = None,
+    cache_dir: str | None = None,
+) -> nn.Module:
+    """
+    Replace `model.encoder` with a `LazyModule`, materialized on the first encode.
+    Call before loading the checkpoint, excluding the "encoder." keys (see `load_checkpoint(exclude_prefixes=...)`).
+    """
+    model.encoder = LazyModule(
+        model.encoder, path=path, prefix="encoder.", device=device, torch_dtype=torch_dtype, cache_dir=cache_dir
+    )
+    return model
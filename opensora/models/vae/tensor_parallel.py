@@ -21,7 +21,7 @@ from colossalai.tensor.d_tensor.sharding_spec import ShardingSpec
 from torch.distributed import ProcessGroup
 from torch.nn.parameter import Parameter
 
-from .utils import ChannelChunkConv3d, channel_chunk_conv3d
+from .utils import ChannelChunkConv3d, chunk_conv3d
 
 
 def shard_channelwise(
@@ -149,7 +149,7 @@ class Conv3dTPCol(nn.Conv3d):
         bias = None
         if self.bias is not None:
             bias = self.bias
-        out = channel_chunk_conv3d(
+        out = chunk_conv3d(
             input,
             weight,
             bias,
@@ -158,6 +158,7 @@ class Conv3dTPCol(nn.Conv3d):
             self.dilation,
             self.groups,
             ChannelChunkConv3d.CONV3D_NUMEL_LIMIT,
+            strategy=ChannelChunkConv3d.CHUNK_STRATEGY,
         )
         if not self.gather_output:
             return out
@@ -254,7 +255,7 @@ class Conv3dTPRow(nn.Conv3d):
         if self.split_input:
             input = split_forward_gather_backward(input, 1, self.tp_group)
         weight = self.weight
-        out = channel_chunk_conv3d(
+        out = chunk_conv3d(
             input,
             weight,
             None,
@@ -263,6 +264,7 @@ class Conv3dTPRow(nn.Conv3d):
             self.dilation,
             self.groups,
             ChannelChunkConv3d.CONV3D_NUMEL_LIMIT,
+            strategy=ChannelChunkConv3d.CHUNK_STRATEGY,
         )
         # del input
         out = reduce_forward(out, self.tp_group)
@@ -0,0 +1,100 @@
+from collections import defaultdict
+from collections.abc import Callable
+
+import torch
+import torch.distributed as dist
+
+from opensora.utils.misc import reset_cuda_peak_memory
+
+
+def _run_with_peak_memory(fn: Callable[[torch.Tensor], torch.Tensor], x: torch.Tensor) -> tuple[torch.Tensor, int]:
+    """Run fn and return its output with the peak CUDA memory it allocated on top of what was in use."""
+    torch.cuda.synchronize()
+    allocated = torch.cuda.memory_allocated()
+    # keeps the peak so far for log_cuda_max_memory
+    reset_cuda_peak_memory()
+    out = fn(x)
+    return out, torch.cuda.max_memory_allocated() - allocated
+
+
+def _broadcast_tiles(outputs: list, process_group: dist.ProcessGroup, device: torch.device) -> list[torch.Tensor]:
+    """Share the tiles held by every rank, a tile is set on the rank owning it and None on the others."""
+    world_size = dist.get_world_size(process_group)
+    rank = dist.get_rank(process_group)
+    meta = [(i, out.shape, out.dtype) for i, out in enumerate(outputs) if out is not None]
+    all_meta = [None] * world_size
+    dist.all_gather_object(all_meta, meta, group=process_group)
+    for owner, owner_meta in enumerate(all_meta):
+        src = dist.get_global_rank(process_group, owner)
+        for i, shape, dtype in owner_meta:
+            if owner == rank:
+                outputs[i] = outputs[i].contiguous()
+            else:
+                outputs[i] = torch.empty(shape, dtype=dtype, device=device)
+            dist.broadcast(outputs[i], src=src, group=process_group)
+    return outputs
+
+
+def batched_tile_apply(
+    fn: Callable[[torch.Tensor], torch.Tensor],
+    tiles: list[torch.Tensor],
+    max_batch_size: int | None = None,
+    memory_budget: float | None = None,
+    process_group: dist.ProcessGroup | None = None,
+    batch_process_group: dist.ProcessGroup | None = None,
+) -> list[torch.Tensor]:
+    """
+    Apply a per-sample function (e.g. a VAE decoder) to a list of tiles with as few calls as possible.
+
+    Tiles of the same shape are concatenated along the batch dimension and run together in micro-batches.
+    With a memory budget on CUDA, the first tile of every shape runs alone to measure its peak memory,
+    which then bounds the micro-batch size of the remaining tiles of that shape.
+
+    Args:
+        fn (Callable): function mapping a [B, ...] batch to a [B, ...] output, independently per sample.
+        tiles (list[torch.Tensor]): the tiles, each with its own batch dimension.
+        max_batch_size (int | None): maximum number of tiles per call, None for no limit.
+        memory_budget (float | None): peak memory in GB a call may allocate, None for no limit.
+        process_group (dist.ProcessGroup | None): tiles are sharded round robin over the group and the
+            results shared with every rank.
+        batch_process_group (dist.ProcessGroup | None): group of the ranks holding different samples, e.g. the
+            data parallel group. The tiles of all its ranks are gathered before sharding, so that ranks of
+            `process_group` never mix tiles of different samples, and every rank gets the outputs of its own tiles.
+
+    Returns:
+        list[torch.Tensor]: fn applied to every tile, in the order of the input.
+    """
+    if batch_process_group is not None and dist.get_world_size(batch_process_group) > 1:
+        num_tiles = [None] * dist.get_world_size(batch_process_group)
+        dist.all_gather_object(num_tiles, len(tiles), group=batch_process_group)
+        offset = sum(num_tiles[: dist.get_rank(batch_process_group)])
+        all_tiles = [None] * sum(num_tiles)
+        all_tiles[offset : offset + len(tiles)] = tiles
+        all_tiles = _broadcast_tiles(all_tiles, batch_process_group, tiles[0].device)
+        outputs = batched_tile_apply(fn, all_tiles, max_batch_size, memory_budget, process_group)
+        return outputs[offset : offset + len(tiles)]
+
+    outputs = [None] * len(tiles)
+    indices = range(len(tiles))
+    if process_group is not None and dist.get_world_size(process_group) > 1:
+        indices = indices[dist.get_rank(process_group) :: dist.get_world_size(process_group)]
+
+    groups = defaultdict(list)
+    for i in indices:
+        groups[tiles[i].shape].append(i)
+
+    for shape, group in groups.items():
+        batch_size = max_batch_size or len(group)
+        if memory_budget is not None and tiles[group[0]].is_cuda:
+            outputs[group[0]], peak = _run_with_peak_memory(fn, tiles[group[0]])
+            batch_size = min(batch_size, max(1, int(memory_budget * 1024**3 // max(peak, 1))))
+            group = group[1:]
+        for start in range(0, len(group), batch_size):
+            micro_batch = group[start : start + batch_size]
+            out = fn(torch.cat([tiles[i] for i in micro_batch]))
+            for i, tile_out in zip(micro_batch, out.split(shape[0])):
+                outputs[i] = tile_out
+
+    if process_group is not None and dist.get_world_size(process_group) > 1:
+        outputs = _broadcast_tiles(outputs, process_group, tiles[0].device)
+    return outputs
@@ -1,4 +1,5 @@
 import math
+import time
 
 import numpy as np
 import torch
@@ -71,6 +72,7 @@ def channel_chunk_conv3d(
     dilation: list,
     groups: int,
     numel_limit: int,
+    upcast: bool = True,
 ):
     out_channels, in_channels = weight.shape[:2]
     kernel_size = weight.shape[2:]
@@ -83,30 +85,211 @@ def channel_chunk_conv3d(
     )
     if n_in_chunks == 1 and n_out_chunks == 1:
         return F.conv3d(input, weight, bias, stride, padding, dilation, groups)
-    # output = torch.empty(output_shape, device=input.device, dtype=input.dtype)
-    # outputs = output.chunk(n_out_chunks, dim=1)
+    output = torch.empty(output_shape, device=input.device, dtype=input.dtype)
     input_shards = input.chunk(n_in_chunks, dim=1)
     weight_chunks = weight.chunk(n_out_chunks)
-    output_list = []
     if bias is not None:
         bias_chunks = bias.chunk(n_out_chunks)
     else:
         bias_chunks = [None] * n_out_chunks
-    for weight_, bias_ in zip(weight_chunks, bias_chunks):
+    for output_, weight_, bias_ in zip(output.chunk(n_out_chunks, dim=1), weight_chunks, bias_chunks):
         weight_shards = weight_.chunk(n_in_chunks, dim=1)
         o = None
         for x, w in zip(input_shards, weight_shards):
             if o is None:
-                o = F.conv3d(x, w, None, stride, padding, dilation, groups).float()
+                o = F.conv3d(x, w, None, stride, padding, dilation, groups)
+                # partial sums are accumulated in fp32 in a single buffer
+                o = o.float() if upcast and n_in_chunks > 1 else o
             else:
-                o += F.conv3d(x, w, None, stride, padding, dilation, groups).float()
-        o = o.to(input.dtype)
+                o += F.conv3d(x, w, None, stride, padding, dilation, groups)
         if bias_ is not None:
             o += bias_[None, :, None, None, None]
-        # inplace operation cannot be used during training
-        # output_.copy_(o)
-        output_list.append(o)
-    return torch.cat(output_list, dim=1)
+        output_.copy_(o)
+    return output
+
+
+def get_conv3d_axis_n_chunks(
+    input_shape: torch.Size,
+    output_shape: list,
+    dim: int,
+    kernel_size: list,
+    stride: list,
+    dilation: list,
+    numel_limit: int,
+) -> int | None:
+    """
+    Number of chunks along `dim` (-3 for time, -2 for height) keeping every output chunk and the input rows it
+    reads, halo included, under `numel_limit`. None if even single output rows are too large.
+    """
+    i = dim + 3
+    size_out = output_shape[dim]
+    in_numel_per_row = math.prod(input_shape) // input_shape[dim]
+    out_numel_per_row = math.prod(output_shape) // size_out
+    halo = dilation[i] * (kernel_size[i] - 1)
+    n_chunks = max(1, math.ceil(max(math.prod(input_shape), math.prod(output_shape)) / numel_limit))
+    for n in range(n_chunks, size_out + 1):
+        rows = math.ceil(size_out / n)
+        in_rows = min((rows - 1) * stride[i] + halo + 1, input_shape[dim])
+        if rows * out_numel_per_row < numel_limit and in_rows * in_numel_per_row < numel_limit:
+            return n
+    return None
+
+
+def _conv3d_rows(
+    input: torch.Tensor,
+    weight: torch.Tensor,
+    bias: torch.Tensor,
+    stride: list,
+    padding: list,
+    dilation: list,
+    groups: int,
+    dim: int,
+    start: int,
+    end: int,
+) -> torch.Tensor:
+    """Output rows [start, end) along `dim`, computed from the input rows they read, zero padded at the borders."""
+    i = dim + 3
+    in_start = start * stride[i] - padding[i]
+    in_end = (end - 1) * stride[i] - padding[i] + dilation[i] * (weight.shape[dim] - 1) + 1
+    lo, hi = max(in_start, 0), min(in_end, input.shape[dim])
+    x = input.narrow(dim, lo, hi - lo)
+    if lo > in_start or hi < in_end:
+        pad = [0] * 6
+        pad[-2 * i - 2], pad[-2 * i - 1] = lo - in_start, in_end - hi
+        x = F.pad(x, pad)
+    padding = list(padding)
+    padding[i] = 0
+    return F.conv3d(x, weight, bias, stride, padding, dilation, groups)
+
+
+def axis_chunk_conv3d(
+    input: torch.Tensor,
+    weight: torch.Tensor,
+    bias: torch.Tensor,
+    stride: list,
+    padding: list,
+    dilation: list,
+    groups: int,
+    numel_limit: int,
+    dim: int = -3,
+    n_chunks: int | None = None,
+) -> torch.Tensor:
+    """
+    conv3d split along the time (dim=-3) or height (dim=-2) axis. Every chunk reads its input rows with the
+    halo of the kernel and is written into a preallocated output, the full channel depth runs in one call.
+    """
+    out_channels = weight.shape[0]
+    output_shape = get_conv3d_output_shape(input.shape, out_channels, weight.shape[2:], stride, padding, dilation)
+    if n_chunks is None:
+        n_chunks = get_conv3d_axis_n_chunks(
+            input.shape, output_shape, dim, weight.shape[2:], stride, dilation, numel_limit
+        )
+        assert n_chunks is not None, f"cannot chunk conv3d of input {tuple(input.shape)} along dim {dim}"
+    if n_chunks == 1:
+        return F.conv3d(input, weight, bias, stride, padding, dilation, groups)
+    output = torch.empty(output_shape, device=input.device, dtype=input.dtype)
+    rows = math.ceil(output_shape[dim] / n_chunks)
+    for start in range(0, output_shape[dim], rows):
+        end = min(start + rows, output_shape[dim])
+        output.narrow(dim, start, end - start).copy_(
+            _conv3d_rows(input, weight, bias, stride, padding, dilation, groups, dim, start, end)
+        )
+    return output
+
+
+CONV3D_CHUNK_DIMS = {"time": -3, "height": -2}
+# per conv shape, estimated time in seconds of every chunking strategy, measured on first use
+CONV3D_CHUNK_COSTS: dict[tuple, dict[str, float]] = {}
+
+
+def _time_conv3d(fn, device: torch.device) -> float:
+    fn()  # warmup, e.g. cudnn algorithm selection
+    if device.type == "cuda":
+        torch.cuda.synchronize(device)
+    start = time.perf_counter()
+    fn()
+    if device.type == "cuda":
+        torch.cuda.synchronize(device)
+    return time.perf_counter() - start
+
+
+@torch.no_grad()
+def measure_conv3d_chunk_costs(
+    input: torch.Tensor,
+    weight: torch.Tensor,
+    stride: list,
+    padding: list,
+    dilation: list,
+    groups: int,
+    numel_limit: int,
+) -> dict[str, float]:
+    """
+    Estimate the time of every feasible chunking strategy by timing a single chunk and scaling by the
+    number of chunks, which keeps the measurement cheap and its memory bounded by one chunk.
+    """
+    out_channels, in_channels = weight.shape[:2]
+    kernel_size = weight.shape[2:]
+    output_shape = get_conv3d_output_shape(input.shape, out_channels, kernel_size, stride, padding, dilation)
+    costs = {}
+    if groups == 1:
+        n_in = get_conv3d_n_chunks(input.numel(), in_channels, numel_limit)
+        n_out = get_conv3d_n_chunks(math.prod(output_shape), out_channels, numel_limit)
+        x, w = input.chunk(n_in, dim=1)[0], weight.chunk(n_out)[0].chunk(n_in, dim=1)[0]
+        costs["channel"] = n_in * n_out * _time_conv3d(
+            lambda: F.conv3d(x, w, None, stride, padding, dilation, groups), input.device
+        )
+    for strategy, dim in CONV3D_CHUNK_DIMS.items():
+        n_chunks = get_conv3d_axis_n_chunks(input.shape, output_shape, dim, kernel_size, stride, dilation, numel_limit)
+        if n_chunks is None:
+            continue
+        rows = math.ceil(output_shape[dim] / n_chunks)
+        costs[strategy] = n_chunks * _time_conv3d(
+            lambda: _conv3d_rows(input, weight, None, stride, padding, dilation, groups, dim, 0, rows), input.device
+        )
+    return costs
+
+
+def chunk_conv3d(
+    input: torch.Tensor,
+    weight: torch.Tensor,
+    bias: torch.Tensor,
+    stride: list,
+    padding: list,
+    dilation: list,
+    groups: int,
+    numel_limit: int,
+    strategy: str = "auto",
+    upcast: bool = True,
+) -> torch.Tensor:
+    """
+    conv3d too large for a single kernel call, split along channels, time or height.
+
+    With strategy="auto" the cheapest strategy is picked from ``CONV3D_CHUNK_COSTS``, measured once per
+    (input shape, weight shape, conv params, dtype, device) the first time that shape is seen.
+    """
+    if strategy == "auto":
+        key = (
+            tuple(input.shape),
+            tuple(weight.shape),
+            tuple(stride),
+            tuple(padding),
+            tuple(dilation),
+            groups,
+            input.dtype,
+            str(input.device),
+        )
+        if key not in CONV3D_CHUNK_COSTS:
+            CONV3D_CHUNK_COSTS[key] = measure_conv3d_chunk_costs(
+                input, weight, stride, padding, dilation, groups, numel_limit
+            )
+        costs = CONV3D_CHUNK_COSTS[key]
+        strategy = min(costs, key=costs.get) if costs else "channel"
+    if strategy == "channel":
+        return channel_chunk_conv3d(input, weight, bias, stride, padding, dilation, groups, numel_limit, upcast)
+    assert strategy in CONV3D_CHUNK_DIMS, f"Unknown conv3d chunking strategy {strategy}"
+    return axis_chunk_conv3d(
+        input, weight, bias, stride, padding, dilation, groups, numel_limit, dim=CONV3D_CHUNK_DIMS[strategy]
+    )
 
 
 class DiagonalGaussianDistribution(object):
@@ -151,43 +334,29 @@ class DiagonalGaussianDistribution(object):
 
 
 class ChannelChunkConv3d(nn.Conv3d):
-    CONV3D_NUMEL_LIMIT = 2**31
-
-    def _get_output_numel(self, input_shape: torch.Size) -> int:
-        numel = self.out_channels
-        if len(input_shape) == 5:
-            numel *= input_shape[0]
-        for i, d in enumerate(input_shape[-3:]):
-            d_out = math.floor(
-                (d + 2 * self.padding[i] - self.dilation[i] * (self.kernel_size[i] - 1) - 1) / self.stride[i] + 1
-            )
-            numel *= d_out
-        return numel
+    """
+    Conv3d that splits calls too large for a single kernel (over CONV3D_NUMEL_LIMIT elements).
+    CHUNK_STRATEGY is one of "channel", "time", "height" or "auto", see `chunk_conv3d`.
+    """
 
-    def _get_n_chunks(self, numel: int, n_channels: int):
-        n_chunks = math.ceil(numel / ChannelChunkConv3d.CONV3D_NUMEL_LIMIT)
-        n_chunks = ceil_to_divisible(n_chunks, n_channels)
-        return n_chunks
+    CONV3D_NUMEL_LIMIT = 2**31
+    CHUNK_STRATEGY = "auto"
 
     def forward(self, input: Tensor) -> Tensor:
         if input.numel() // input.size(0) < ChannelChunkConv3d.CONV3D_NUMEL_LIMIT:
             return super().forward(input)
-        n_in_chunks = self._get_n_chunks(input.numel(), self.in_channels)
-        n_out_chunks = self._get_n_chunks(self._get_output_numel(input.shape), self.out_channels)
-        if n_in_chunks == 1 and n_out_chunks == 1:
-            return super().forward(input)
-        outputs = []
-        input_shards = input.chunk(n_in_chunks, dim=1)
-        for weight, bias in zip(self.weight.chunk(n_out_chunks), self.bias.chunk(n_out_chunks)):
-            weight_shards = weight.chunk(n_in_chunks, dim=1)
-            o = None
-            for x, w in zip(input_shards, weight_shards):
-                if o is None:
-                    o = F.conv3d(x, w, bias, self.stride, self.padding, self.dilation, self.groups)
-                else:
-                    o += F.conv3d(x, w, None, self.stride, self.padding, self.dilation, self.groups)
-            outputs.append(o)
-        return torch.cat(outputs, dim=1)
+        return chunk_conv3d(
+            input,
+            self.weight,
+            self.bias,
+            self.stride,
+            self.padding,
+            self.dilation,
+            self.groups,
+            ChannelChunkConv3d.CONV3D_NUMEL_LIMIT,
+            strategy=ChannelChunkConv3d.CHUNK_STRATEGY,
+            upcast=False,
+        )
 
 
 @torch.compile(mode="max-autotune-no-cudagraphs", dynamic=True)
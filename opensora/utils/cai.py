@@ -1,10 +1,12 @@
 import colossalai
 import torch
 import torch.distributed as dist
+import torch.nn as nn
 from colossalai.booster import Booster
 from colossalai.cluster import DistCoordinator
 
 from opensora.acceleration.parallel_states import (
+    get_data_parallel_group,
     get_sequence_parallel_group,
     get_tensor_parallel_group,
     set_sequence_parallel_group,
@@ -26,11 +28,18 @@ def set_group_size(plugin_config: dict):
     """
     tp_size = int(plugin_config.get("tp_size", 1))
     sp_size = int(plugin_config.get("sp_size", 1))
+    ulysses_size = int(plugin_config.get("ulysses_size", 1))
     if tp_size > 1:
         assert sp_size == 1
         plugin_config["tp_size"] = tp_size = min(tp_size, torch.cuda.device_count())
         log_message(f"Using TP with size {tp_size}")
-    if sp_size > 1:
+    if sp_size > 1 and ulysses_size > 1:
+        # 2D sequence parallelism spans nodes, only the all-to-all part stays inside one node
+        assert tp_size == 1
+        plugin_config["ulysses_size"] = ulysses_size = min(ulysses_size, torch.cuda.device_count())
+        plugin_config["sp_size"] = sp_size = min(sp_size, dist.get_world_size())
+        log_message(f"Using 2D SP with size {sp_size} (all-to-all size {ulysses_size})")
+    elif sp_size > 1:
         assert tp_size == 1
         plugin_config["sp_size"] = sp_size = min(sp_size, torch.cuda.device_count())
         log_message(f"Using SP with size {sp_size}")
@@ -48,15 +57,20 @@ def init_inference_environment():
             set_sequence_parallel_group(dist.group.WORLD)
 
 
+# tensor parallel policies of the autoencoders, by registered type
+AE_POLICIES = {"hunyuan_vae": HunyuanVaePolicy}
+
+
 def get_booster(cfg: dict, ae: bool = False):
     suffix = "_ae" if ae else ""
-    policy = HunyuanVaePolicy if ae else MMDiTPolicy
+    policy = AE_POLICIES.get(cfg.get("ae", {}).get("type", "hunyuan_vae")) if ae else MMDiTPolicy
 
     plugin_type = cfg.get(f"plugin{suffix}", "zero2")
     plugin_config = cfg.get(f"plugin_config{suffix}", {})
     plugin_kwargs = {}
     booster = None
     if plugin_type == "hybrid":
+        assert policy is not None, f"no tensor parallel policy for {cfg.ae.type}, use plugin_ae='tile_parallel' instead"
         set_group_size(plugin_config)
         plugin_kwargs = dict(custom_policy=policy)
 
@@ -71,6 +85,26 @@ def get_booster(cfg: dict, ae: bool = False):
     return booster
 
 
+def enable_ae_tile_parallel(cfg: dict, model_ae: nn.Module) -> nn.Module:
+    """
+    With plugin_ae="tile_parallel", shard the tiles and samples decoded by the autoencoder over all ranks
+    instead of sharding its layers. Works for any autoencoder with `enable_tile_parallel` (dc_ae, hunyuan_vae).
+    The data parallel ranks decode different samples, so their tiles are gathered before being sharded and every
+    rank keeps the videos of its own samples.
+
+    Args:
+        cfg (dict): The configuration.
+        model_ae (nn.Module): The autoencoder.
+
+    Returns:
+        nn.Module: The autoencoder.
+    """
+    if cfg.get("plugin_ae", None) == "tile_parallel" and is_distributed() and dist.get_world_size() > 1:
+        model_ae.enable_tile_parallel(dist.group.WORLD, batch_process_group=get_data_parallel_group())
+        log_message(f"Using tile parallel autoencoder over {dist.get_world_size()} ranks")
+    return model_ae
+
+
 def get_is_saving_process(cfg: dict):
     """
     Check if the current process is the one that saves the model.
@@ -15,6 +15,7 @@ from colossalai.checkpoint_io import GeneralCheckpointIO
 from colossalai.utils.safetensors import save as async_save
 from colossalai.zero.low_level import LowLevelZeroOptimizer
 from huggingface_hub import hf_hub_download
+from safetensors import safe_open
 from safetensors.torch import load_file
 from tensornvme.async_file_io import AsyncFileWriter
 from torch.optim import Optimizer
@@ -81,6 +82,45 @@ def print_load_warning(missing: list[str], unexpected: list[str]) -> None:
         log_message("Model loaded successfully")
 
 
+def _load_state_dict(
+    model: nn.Module, ckpt: dict, strict: bool, exclude_prefixes: tuple[str, ...] = ()
+) -> tuple[list[str], list[str]]:
+    """Load a state dict, the excluded keys are not reported as missing even when strict."""
+    if not exclude_prefixes:
+        return model.load_state_dict(ckpt, strict=strict)
+    missing, unexpected = model.load_state_dict(ckpt, strict=False)
+    missing = [k for k in missing if not k.startswith(exclude_prefixes)]
+    if strict and (len(missing) > 0 or len(unexpected) > 0):
+        raise RuntimeError(
+            f"Error(s) in loading state_dict for {model.__class__.__name__}: "
+            f"missing keys {missing}, unexpected keys {unexpected}"
+        )
+    return missing, unexpected
+
+
+def load_state_dict_subset(path: str, prefix: str, cache_dir: str = None) -> dict[str, torch.Tensor]:
+    """
+    Reads the tensors under `prefix` from a safetensors or .pt/.pth checkpoint, with the prefix stripped.
+    Safetensors checkpoints only read the requested tensors from disk.
+
+    Args:
+        path (str): The path to the checkpoint.
+        prefix (str): The key prefix to read, e.g. "encoder.".
+        cache_dir (str): The directory to cache the downloaded checkpoint.
+
+    Returns:
+        dict[str, torch.Tensor]: The state dict of the submodule on cpu.
+    """
+    if not os.path.exists(path):
+        path = load_from_hf_hub(path, cache_dir)
+    if path.endswith(".safetensors"):
+        with safe_open(path, framework="pt", device="cpu") as f:
+            return {k[len(prefix) :]: f.get_tensor(k) for k in f.keys() if k.startswith(prefix)}
+    assert path.endswith(".pt") or path.endswith(".pth"), f"Unsupported checkpoint for partial loading: {path}"
+    ckpt = torch.load(path, map_location="cpu")
+    return {k[len(prefix) :]: v for k, v in ckpt.items() if k.startswith(prefix)}
+
+
 def load_checkpoint(
     model: nn.Module,
     path: str,
@@ -89,6 +129,7 @@ def load_checkpoint(
     cai_model_name: str = "model",
     strict: bool = False,
     rename_keys: dict = None,  # rename keys in the checkpoint to support fine-tuning with a different model architecture; map old_key_prefix to new_key_prefix
+    exclude_prefixes: tuple[str, ...] = (),
 ) -> nn.Module:
     """
     Loads a checkpoint into model from a path. Support three types of checkpoints:
@@ -102,6 +143,8 @@ def load_checkpoint(
         cache_dir (str): The directory to cache the downloaded checkpoint.
         device_map (torch.device | str): The device to map the checkpoint to.
         cai_model_name (str): The name of the model in the checkpoint.
+        exclude_prefixes (tuple[str, ...]): Keys starting with these prefixes are neither read nor expected,
+            e.g. a submodule loaded later with `load_state_dict_subset`.
 
     Returns:
         nn.Module: The model with the loaded checkpoint.
@@ -112,8 +155,14 @@ def load_checkpoint(
     assert os.path.exists(path), f"Could not find checkpoint at {path}"
 
     log_message(f"Loading checkpoint from {path}")
+    if exclude_prefixes:
+        assert not os.path.isdir(path), "exclude_prefixes is not supported for sharded checkpoints"
     if path.endswith(".safetensors"):
-        ckpt = load_file(path, device='cpu')
+        if exclude_prefixes:
+            with safe_open(path, framework="pt", device="cpu") as f:
+                ckpt = {k: f.get_tensor(k) for k in f.keys() if not k.startswith(exclude_prefixes)}
+        else:
+            ckpt = load_file(path, device='cpu')
 
         if rename_keys is not None:
             # rename keys in the loaded state_dict with old_key_prefix to with new_key_prefix.
@@ -128,11 +177,13 @@ def load_checkpoint(
                 renamed_ckpt[new_key] = v
             ckpt = renamed_ckpt
 
-        missing, unexpected = model.load_state_dict(ckpt, strict=strict)
+        missing, unexpected = _load_state_dict(model, ckpt, strict, exclude_prefixes)
         print_load_warning(missing, unexpected)
     elif path.endswith(".pt") or path.endswith(".pth"):
         ckpt = torch.load(path, map_location=device_map)
-        missing, unexpected = model.load_state_dict(ckpt, strict=strict)
+        if exclude_prefixes:
+            ckpt = {k: v for k, v in ckpt.items() if not k.startswith(exclude_prefixes)}
+        missing, unexpected = _load_state_dict(model, ckpt, strict, exclude_prefixes)
         print_load_warning(missing, unexpected)
     else:
         assert os.path.isdir(path), f"Invalid checkpoint path: {path}"
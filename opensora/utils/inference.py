@@ -1,6 +1,9 @@
 import copy
 import os
 import re
+import weakref
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from enum import Enum
 
 import torch
@@ -9,6 +12,7 @@ from torch import nn
 from opensora.datasets import save_sample
 from opensora.datasets.aspect import get_image_size
 from opensora.datasets.utils import read_from_path, rescale_image_by_path
+from opensora.models.vae.tile_scheduler import batched_tile_apply
 from opensora.utils.logger import log_message
 from opensora.utils.prompt_refine import refine_prompts
 
@@ -213,73 +217,188 @@ def add_noise_to_ref(masked_ref: torch.Tensor, masks: torch.Tensor, t: float, si
     return masks * z_noisy
 
 
+# encoded references of every autoencoder keyed by (file identity, size, transform, frames), see
+# `collect_references_batch`; the latents of an autoencoder are dropped with it
+REFERENCE_LATENT_CACHE: "weakref.WeakKeyDictionary[nn.Module, OrderedDict]" = weakref.WeakKeyDictionary()
+REFERENCE_LATENT_CACHE_SIZE = 64  # per autoencoder
+
+
+def clear_reference_cache(model_ae: nn.Module | None = None):
+    """Drop the cached reference latents of an autoencoder, or of every autoencoder when None."""
+    if model_ae is None:
+        REFERENCE_LATENT_CACHE.clear()
+    else:
+        REFERENCE_LATENT_CACHE.pop(model_ae, None)
+
+
+def _reference_identity(path: str) -> tuple:
+    """Identify a local file by its path, size and modification time, so that edited files are encoded again."""
+    if os.path.exists(path):
+        stat = os.stat(path)
+        return (os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+    return (path,)
+
+
+def _reference_jobs(reference_path: str, cond_type: str) -> list[tuple[str, str]]:
+    """(path, frames) of every reference of a sample, frames being "head", "tail", "first" or "last"."""
+    ref_path = reference_path.split(";")
+    if "v2v" in cond_type:
+        if "head" in cond_type:  # v2v head
+            return [(ref_path[0], "head")]
+        elif "tail" in cond_type:  # v2v tail
+            return [(ref_path[0], "tail")]
+        raise NotImplementedError
+    elif cond_type == "i2v_head":  # take the 1st frame from first ref_path
+        return [(ref_path[0], "first")]
+    elif cond_type == "i2v_tail":  # take the last frame from last ref_path
+        return [(ref_path[-1], "last")]
+    elif cond_type == "i2v_loop":  # first frame and last frame
+        return [(ref_path[0], "first"), (ref_path[-1], "last")]
+    raise NotImplementedError(f"Unknown condition type {cond_type}")
+
+
+def _select_reference_frames(r: torch.Tensor, frames: str, cond_type: str, is_causal: bool) -> torch.Tensor:
+    if frames == "first":
+        return r[:, :1]
+    if frames == "last":
+        return r[:, -1:]
+    actual_t = r.size(1)
+    # if reference not long enough, default to shorter ref
+    target_t = 64 if (actual_t >= 64 and "easy" in cond_type) else 32
+    if is_causal:
+        target_t += 1
+    assert actual_t >= target_t, f"need at least {target_t} reference frames for v2v generation"
+    return r[:, :target_t] if frames == "head" else r[:, -target_t:]
+
+
 def collect_references_batch(
     reference_paths: list[str],
     cond_type: str,
     model_ae: nn.Module,
     image_size: tuple[int, int],
     is_causal=False,
+    num_workers: int = 8,
+    encode_batch_size: int | None = 8,
+    use_cache: bool = True,
 ):
+    """
+    Read and encode the references of a batch.
+
+    References are read in a thread pool, the frames of the same shape are encoded together in micro-batches
+    of `encode_batch_size`, and the latents are cached by file, size, transform and frames, so a reference
+    repeated across a batch or across calls is encoded once. Cached latents are reused as they are, including
+    the posterior sample of autoencoders that sample when encoding. The cache of an autoencoder lives as long as
+    the autoencoder, or until `clear_reference_cache`.
+
+    Returns:
+        list: per sample, None without reference or the list of references of shape [C, T, H, W]
+    """
     refs_x = []  # refs_x: [batch, ref_num, C, T, H, W]
     device = next(model_ae.parameters()).device
     dtype = next(model_ae.parameters()).dtype
-    for reference_path in reference_paths:
-        if reference_path == "":
-            refs_x.append(None)
+    transform_name = "resize_crop"
+
+    cache = REFERENCE_LATENT_CACHE.setdefault(model_ae, OrderedDict()) if use_cache else OrderedDict()
+    jobs = [[] if path != "" else None for path in reference_paths]
+    keys = {}
+    for reference_path, sample_jobs in zip(reference_paths, jobs):
+        if sample_jobs is None:
             continue
-        ref_path = reference_path.split(";")
-        ref = []
-
-        if "v2v" in cond_type:
-            r = read_from_path(ref_path[0], image_size, transform_name="resize_crop")  # size [C, T, H, W]
-            actual_t = r.size(1)
-            target_t = (
-                64 if (actual_t >= 64 and "easy" in cond_type) else 32
-            )  # if reference not long enough, default to shorter ref
-            if is_causal:
-                target_t += 1
-            assert actual_t >= target_t, f"need at least {target_t} reference frames for v2v generation"
-            if "head" in cond_type:  # v2v head
-                r = r[:, :target_t]
-            elif "tail" in cond_type:  # v2v tail
-                r = r[:, -target_t:]
-            else:
-                raise NotImplementedError
-            r_x = model_ae.encode(r.unsqueeze(0).to(device, dtype))
-            r_x = r_x.squeeze(0)  # size [C, T, H, W]
-            ref.append(r_x)
-        elif cond_type == "i2v_head":  # take the 1st frame from first ref_path
-            r = read_from_path(ref_path[0], image_size, transform_name="resize_crop")  # size [C, T, H, W]
-            r = r[:, :1]
-            r_x = model_ae.encode(r.unsqueeze(0).to(device, dtype))
-            r_x = r_x.squeeze(0)  # size [C, T, H, W]
-            ref.append(r_x)
-        elif cond_type == "i2v_tail":  # take the last frame from last ref_path
-            r = read_from_path(ref_path[-1], image_size, transform_name="resize_crop")  # size [C, T, H, W]
-            r = r[:, -1:]
-            r_x = model_ae.encode(r.unsqueeze(0).to(device, dtype))
-            r_x = r_x.squeeze(0)  # size [C, T, H, W]
-            ref.append(r_x)
-        elif cond_type == "i2v_loop":
-            # first frame
-            r_head = read_from_path(ref_path[0], image_size, transform_name="resize_crop")  # size [C, T, H, W]
-            r_head = r_head[:, :1]
-            r_x_head = model_ae.encode(r_head.unsqueeze(0).to(device, dtype))
-            r_x_head = r_x_head.squeeze(0)  # size [C, T, H, W]
-            ref.append(r_x_head)
-            # last frame
-            r_tail = read_from_path(ref_path[-1], image_size, transform_name="resize_crop")  # size [C, T, H, W]
-            r_tail = r_tail[:, -1:]
-            r_x_tail = model_ae.encode(r_tail.unsqueeze(0).to(device, dtype))
-            r_x_tail = r_x_tail.squeeze(0)  # size [C, T, H, W]
-            ref.append(r_x_tail)
+        for path, frames in _reference_jobs(reference_path, cond_type):
+            identity = _reference_identity(path)
+            key = (identity, tuple(image_size), transform_name, cond_type, is_causal, frames)
+            keys[key] = (path, frames)
+            sample_jobs.append(key)
+
+    latents = {}
+    missing = []
+    for key in keys:
+        if key in cache:
+            cache.move_to_end(key)
+            latents[key] = cache[key]
         else:
-            raise NotImplementedError(f"Unknown condition type {cond_type}")
-
-        refs_x.append(ref)
+            missing.append(key)
+
+    if len(missing) > 0:
+        paths = list(dict.fromkeys(keys[key][0] for key in missing))
+        with ThreadPoolExecutor(max_workers=max(1, min(num_workers, len(paths)))) as executor:
+            videos = dict(
+                zip(paths, executor.map(lambda path: read_from_path(path, image_size, transform_name), paths))
+            )  # size [C, T, H, W]
+        clips = [
+            _select_reference_frames(videos[keys[key][0]], keys[key][1], cond_type, is_causal).unsqueeze(0)
+            for key in missing
+        ]
+        encoded = batched_tile_apply(
+            lambda x: model_ae.encode(x.to(device, dtype)), clips, max_batch_size=encode_batch_size
+        )
+        for key, r_x in zip(missing, encoded):
+            latents[key] = r_x.squeeze(0)  # size [C, T, H, W]
+            if use_cache:
+                cache[key] = latents[key]
+                while len(cache) > REFERENCE_LATENT_CACHE_SIZE:
+                    cache.popitem(last=False)
+
+    for sample_jobs in jobs:
+        refs_x.append(None if sample_jobs is None else [latents[key] for key in sample_jobs])
     return refs_x
 
 
+# latent frames taken from the end of a generation to condition the next segment
+CONTINUATION_LATENT_FRAMES = {"i2v_head": 1, "v2v_head": 8, "v2v_head_easy": 16}
+
+
+def continuation_references(
+    latents: torch.Tensor, cond_type: str, causal: bool = True
+) -> list[list[torch.Tensor]]:
+    """
+    Use the last latent frames of a generation as the references of the next segment, without decoding.
+
+    With a causal VAE, the reused frames were encoded with the context of the frames before them, unlike
+    a reference encoded from scratch, so the continuation only approximates re-encoding the decoded frames
+    (see `encode_continuation_references`).
+
+    Args:
+        latents (torch.Tensor): The latents of the generation, of shape [B, C, T, H, W].
+        cond_type (str): i2v_head, v2v_head or v2v_head_easy.
+        causal (bool): Whether the VAE is causal, v2v conditions take one more frame.
+
+    Returns:
+        list[list[torch.Tensor]]: The references, in the layout of `collect_references_batch`.
+    """
+    assert cond_type in CONTINUATION_LATENT_FRAMES, f"cannot continue a generation with {cond_type}"
+    k = CONTINUATION_LATENT_FRAMES[cond_type] + (int(causal) if "v2v" in cond_type else 0)
+    assert latents.size(2) >= k, f"need at least {k} latent frames to continue with {cond_type}"
+    return [[z[:, -k:]] for z in latents]
+
+
+def encode_continuation_references(
+    model_ae: nn.Module, x: torch.Tensor, cond_type: str, causal: bool = True
+) -> list[list[torch.Tensor]]:
+    """
+    Encode the last decoded frames of a generation as the references of the next segment, on device.
+
+    Args:
+        model_ae (nn.Module): The autoencoder.
+        x (torch.Tensor): The decoded videos, float [B, C, T, H, W] in [-1, 1] or uint8 frames [B, T, H, W, C].
+        cond_type (str): i2v_head, v2v_head or v2v_head_easy.
+        causal (bool): Whether the VAE is causal, v2v conditions take one more frame.
+
+    Returns:
+        list[list[torch.Tensor]]: The references, in the layout of `collect_references_batch`.
+    """
+    assert cond_type in CONTINUATION_LATENT_FRAMES, f"cannot continue a generation with {cond_type}"
+    if x.dtype == torch.uint8:
+        x = x.permute(0, 4, 1, 2, 3).float().div_(127.5).sub_(1)
+    if cond_type == "i2v_head":
+        target_t = 1
+    else:
+        target_t = (64 if "easy" in cond_type else 32) + int(causal)
+    assert x.size(2) >= target_t, f"need at least {target_t} frames to continue with {cond_type}"
+    dtype = next(model_ae.parameters()).dtype
+    return [[model_ae.encode(r[None, :, -target_t:].to(dtype)).squeeze(0)] for r in x]
+
+
 def prepare_inference_condition(
     z: torch.Tensor,
     mask_cond: str,
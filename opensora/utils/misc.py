@@ -39,6 +39,9 @@ def create_tensorboard_writer(exp_dir: str) -> SummaryWriter:
 
 GIGABYTE = 1024**3
 
+# peaks before the last `reset_cuda_peak_memory`, reported by `log_cuda_max_memory`
+_CUDA_PEAK_BEFORE_RESET = dict(allocated=0, reserved=0)
+
 
 def log_cuda_memory(stage: str = None):
     """
@@ -61,12 +64,21 @@ def log_cuda_max_memory(stage: str = None):
         stage (str): The stage of the training process.
     """
     torch.cuda.synchronize()
-    max_memory_allocated = torch.cuda.max_memory_allocated()
-    max_memory_reserved = torch.cuda.max_memory_reserved()
+    max_memory_allocated = max(torch.cuda.max_memory_allocated(), _CUDA_PEAK_BEFORE_RESET["allocated"])
+    max_memory_reserved = max(torch.cuda.max_memory_reserved(), _CUDA_PEAK_BEFORE_RESET["reserved"])
     log_message("CUDA max memory max memory allocated at " + stage + ": %.1f GB", max_memory_allocated / GIGABYTE)
     log_message("CUDA max memory max memory reserved at " + stage + ": %.1f GB", max_memory_reserved / GIGABYTE)
 
 
+def reset_cuda_peak_memory():
+    """
+    Reset the CUDA peak memory statistics to measure a region, keeping the peaks so far for `log_cuda_max_memory`.
+    """
+    _CUDA_PEAK_BEFORE_RESET["allocated"] = max(_CUDA_PEAK_BEFORE_RESET["allocated"], torch.cuda.max_memory_allocated())
+    _CUDA_PEAK_BEFORE_RESET["reserved"] = max(_CUDA_PEAK_BEFORE_RESET["reserved"], torch.cuda.max_memory_reserved())
+    torch.cuda.reset_peak_memory_stats()
+
+
 # ======================================================
 # Number of parameters
 # ======================================================
@@ -11,12 +11,15 @@ from peft import PeftModel
 from torch import Tensor, nn
 
 from opensora.datasets.aspect import get_image_size
+from opensora.datasets.utils import to_uint8_frames
 from opensora.models.mmdit.model import MMDiTModel
 from opensora.models.text.conditioner import HFEmbedder
 from opensora.registry import MODELS, build_module
 from opensora.utils.inference import (
     SamplingMethod,
     collect_references_batch,
+    continuation_references,
+    encode_continuation_references,
     prepare_inference_condition,
 )
 
@@ -559,6 +562,17 @@ def prepare_models(
     return model, model_ae, model_t5, model_clip, optional_models
 
 
+def decode_uint8(model_ae: nn.Module, z: Tensor, chunk_size: int = 16) -> Tensor:
+    """
+    Decode latents to uint8 frames [B, T, H, W, C] without leaving the device, so that only uint8 data is
+    copied to the host. VAEs decoding in streaming mode are normalized chunk by chunk as they are decoded,
+    the others `chunk_size` frames at a time.
+    """
+    if getattr(model_ae, "use_streaming_decode", False) and z.shape[2] > model_ae.stream_chunk_size:
+        return torch.cat([to_uint8_frames(chunk) for chunk in model_ae.streaming_decode(z)], dim=1)
+    return to_uint8_frames(model_ae.decode(z), chunk_size=chunk_size)
+
+
 def prepare_api(
     model: nn.Module,
     model_ae: nn.Module,
@@ -589,6 +603,9 @@ def prepare_api(
         neg: list[str] = None,
         patch_size: int = 2,
         channel: int = 16,
+        output_uint8: bool = False,
+        ref_latents: list[list[Tensor]] = None,
+        return_latents: bool = False,
         **kwargs,
     ):
         """
@@ -598,9 +615,15 @@ def prepare_api(
             opt (SamplingOption): The sampling options.
             text (list[str], optional): The text prompts. Defaults to None.
             neg (list[str], optional): The negative text prompts. Defaults to None.
+            output_uint8 (bool, optional): Return uint8 frames [B, T, H, W, C] normalized on device instead of
+                float videos [B, C, T, H, W] in [-1, 1]. Defaults to False.
+            ref_latents (list[list[torch.Tensor]], optional): Encoded references used instead of reading and
+                encoding the `ref` paths, e.g. from `continuation_references`. Defaults to None.
+            return_latents (bool, optional): Also return the latents [B, C, T, H, W] the videos are decoded from,
+                to continue the generation. Defaults to False.
 
         Returns:
-            torch.Tensor: The generated images.
+            torch.Tensor: The generated images, and the latents if `return_latents`.
         """
         device = next(model.parameters()).device
         dtype = next(model.parameters()).dtype
@@ -635,7 +658,9 @@ def prepare_api(
 
         # i2v reference conditions
         references = [None] * len(text)
-        if cond_type != "t2v" and "ref" in kwargs:
+        if cond_type != "t2v" and ref_latents is not None:
+            references = ref_latents
+        elif cond_type != "t2v" and "ref" in kwargs:
             reference_path_list = kwargs.pop("ref")
             references = collect_references_batch(
                 reference_path_list,
@@ -705,22 +730,77 @@ def prepare_api(
         elif cond_type == "i2v_loop":
             x[0, :, :1] = references[0][0]
             x[0, :, -1:] = references[0][1]
+        latents = x
 
-        x = model_ae.decode(x)
-        x = x[:, :, : opt.num_frames]  # image
+        if output_uint8:
+            x = decode_uint8(model_ae, x)
+            time_dim = 1
+        else:
+            x = model_ae.decode(x)
+            time_dim = 2
+        x = x.narrow(time_dim, 0, min(opt.num_frames, x.shape[time_dim]))  # image
 
         # remove the duplicate frames
-        if not opt.is_causal_vae:
-            if cond_type == "i2v_head":
-                pad_len = model_ae.compression[0] - 1
-                x = x[:, :, pad_len:]
-            elif cond_type == "i2v_tail":
-                pad_len = model_ae.compression[0] - 1
-                x = x[:, :, :-pad_len]
-            elif cond_type == "i2v_loop":
-                pad_len = model_ae.compression[0] - 1
-                x = x[:, :, pad_len:-pad_len]
-
+        if not opt.is_causal_vae and cond_type in ("i2v_head", "i2v_tail", "i2v_loop"):
+            pad_len = model_ae.compression[0] - 1
+            head = pad_len if cond_type in ("i2v_head", "i2v_loop") else 0
+            tail = pad_len if cond_type in ("i2v_tail", "i2v_loop") else 0
+            x = x.narrow(time_dim, head, x.shape[time_dim] - head - tail)
+
+        if return_latents:
+            return x, latents
         return x
 
     return api_fn
+
+
+def generate_continuation(
+    api_fn: callable,
+    opt: SamplingOption,
+    prompts: list[str],
+    model_ae: nn.Module,
+    cond_type: str = "i2v_head",
+    continuation: str = "latent",
+    ref: str | None = None,
+    **kwargs,
+):
+    """
+    Generate a long video segment by segment, each segment conditioned on the end of the previous one.
+
+    The conditions never leave the device: with continuation="latent" the last latent frames are reused
+    as they are, with continuation="frames" the last decoded frames are encoded again, which matches
+    conditioning on a saved frame but costs a VAE encode per segment.
+
+    Args:
+        api_fn (callable): The API function returned by `prepare_api`.
+        opt (SamplingOption): The sampling options, a causal VAE is expected.
+        prompts (list[str]): One prompt per segment.
+        model_ae (nn.Module): The autoencoder, to encode the frames with continuation="frames".
+        cond_type (str): Condition of the segments after the first, i2v_head, v2v_head or v2v_head_easy.
+        continuation (str): "latent" or "frames".
+        ref (str, optional): Reference path of the first segment, which is generated from text without it.
+        **kwargs: Passed to `api_fn`, e.g. seed, patch_size, channel or output_uint8.
+
+    Yields:
+        torch.Tensor: The videos of each segment, without the frames shared with the previous segment.
+    """
+    assert continuation in ("latent", "frames"), f"Unknown continuation {continuation}"
+    assert opt.is_causal_vae, "continuation expects a causal VAE"
+    time_dim = 1 if kwargs.get("output_uint8", False) else 2
+    ref_latents = None
+    for i, prompt in enumerate(prompts):
+        if i == 0:
+            first_cond_type = "t2v" if ref is None else cond_type
+            ref_kwargs = dict(ref=[ref]) if ref is not None else {}
+            x, latents = api_fn(opt, first_cond_type, text=[prompt], return_latents=True, **ref_kwargs, **kwargs)
+        else:
+            x, latents = api_fn(opt, cond_type, text=[prompt], ref_latents=ref_latents, return_latents=True, **kwargs)
+            # the conditioned latent frames decode to the frames the previous segment ended with
+            k = ref_latents[0][0].size(1)
+            shared = 1 + (k - 1) * opt.temporal_reduction
+            x = x.narrow(time_dim, shared, x.shape[time_dim] - shared)
+        if continuation == "latent":
+            ref_latents = continuation_references(latents, cond_type, causal=opt.is_causal_vae)
+        else:
+            ref_latents = encode_continuation_references(model_ae, x, cond_type, causal=opt.is_causal_vae)
+        yield x
@@ -114,8 +114,9 @@ def create_colossalai_plugin(
         plugin_kwargs["enable_metadata_cache"] = False
 
         custom_policy = plugin_kwargs.pop("custom_policy", None)
+        ulysses_size = plugin_kwargs.pop("ulysses_size", 1)
         if custom_policy is not None:
-            custom_policy = custom_policy()
+            custom_policy = custom_policy(ulysses_size=ulysses_size) if ulysses_size > 1 else custom_policy()
         plugin = HybridParallelPlugin(
             custom_policy=custom_policy,
             **plugin_kwargs,
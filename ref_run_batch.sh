@@ -1,4 +1,5 @@
 #!/bin/bash
+# scripts/diffusion/inference_long.py chains the segments in one process without the mp4/ffmpeg round trip.
 
 BASE_DIR="/data/Open-Sora"
 PROMPT_DIR="${BASE_DIR}/prompts"
@@ -0,0 +1,83 @@
+"""
+Samples/sec of `VideoTextDataset` batches at a fixed number of dataloader workers, for several `num_decode_threads`.
+
+Synthetic videos are written to a temporary directory and read in fixed batches of the same bucket, as given by
+`VariableVideoBatchSampler`. Runs with decode threads are checked to return the same batches as each other.
+
+Usage:
+    python scripts/cnv/benchmark_decode_threads.py --num-workers 2 --decode-threads 0 2 4
+"""
+
+import argparse
+import os
+import tempfile
+import time
+
+import pandas as pd
+import torch
+from torch.utils.data import DataLoader
+
+from opensora.datasets.dataloader import collate_fn_default
+from opensora.datasets.datasets import VideoTextDataset
+
+from benchmark_read_video import write_video
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--num-videos", type=int, default=32)
+    parser.add_argument("--num-frames", type=int, default=150, help="frames of each synthetic video")
+    parser.add_argument("--size", type=int, nargs=2, default=[360, 640], help="height and width of the videos")
+    parser.add_argument("--bucket", type=int, nargs=3, default=[33, 256, 256], help="frames, height and width")
+    parser.add_argument("--batch-size", type=int, default=8)
+    parser.add_argument("--epochs", type=int, default=2)
+    parser.add_argument("--num-workers", type=int, default=2)
+    parser.add_argument("--decode-threads", type=int, nargs="+", default=[0, 2, 4])
+    parser.add_argument("--seed", type=int, default=0)
+    return parser.parse_args()
+
+
+def run(args, data_path: str, num_decode_threads: int) -> tuple[float, list]:
+    dataset = VideoTextDataset(
+        data_path=data_path, transform_name="resize_crop", num_decode_threads=num_decode_threads, fps_max=None
+    )
+    indices = [f"{i}-{'-'.join(map(str, args.bucket))}" for i in range(len(dataset))]
+    batches = [indices[start : start + args.batch_size] for start in range(0, len(indices), args.batch_size)]
+    dataloader = DataLoader(
+        dataset,
+        batch_sampler=batches * args.epochs,
+        num_workers=args.num_workers,
+        collate_fn=collate_fn_default,
+        generator=torch.Generator().manual_seed(args.seed),
+    )
+    outputs = []
+    start = time.perf_counter()
+    for batch in dataloader:
+        outputs.append(batch["video"][:, :, :, 0, 0].clone())
+    return len(indices) * args.epochs / (time.perf_counter() - start), outputs
+
+
+def main():
+    args = parse_args()
+    with tempfile.TemporaryDirectory() as folder:
+        paths = []
+        for i in range(args.num_videos):
+            paths.append(os.path.join(folder, f"{i}.mp4"))
+            write_video(paths[-1], "libx264", args.num_frames, *args.size, gop_size=30)
+        data_path = os.path.join(folder, "data.csv")
+        pd.DataFrame(dict(path=paths, text=["video"] * len(paths), fps=24)).to_csv(data_path, index=False)
+
+        print(f"{args.num_workers} workers, batch size {args.batch_size}")
+        print(f"{'threads':>8} {'samples/s':>10}")
+        reference = None
+        for num_decode_threads in args.decode_threads:
+            throughput, outputs = run(args, data_path, num_decode_threads)
+            print(f"{num_decode_threads:>8} {throughput:>10.1f}")
+            if num_decode_threads > 0:
+                if reference is None:
+                    reference = outputs
+                assert all(torch.equal(a, b) for a, b in zip(reference, outputs)), "batches differ between runs"
+
+
+if __name__ == "__main__":
+    main()
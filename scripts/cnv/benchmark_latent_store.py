@@ -0,0 +1,77 @@
+"""
+Random access samples/sec of cached latents: one `torch.load` file per sample against a `LatentStore`.
+
+Every sample is a video latent and a T5 feature of the given shapes, written to a temporary directory
+in both layouts. The page cache is not dropped, so use a large --num-samples or a cold run to measure disk reads.
+
+Usage:
+    python scripts/cnv/benchmark_latent_store.py --num-samples 2000 --latent-shape 16 33 32 32
+"""
+
+import argparse
+import os
+import tempfile
+import time
+
+import numpy as np
+import torch
+
+from opensora.datasets.latent_store import LatentStore, LatentStoreWriter
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--num-samples", type=int, default=1000)
+    parser.add_argument("--latent-shape", type=int, nargs="+", default=[16, 9, 32, 32])
+    parser.add_argument("--text-shape", type=int, nargs="+", default=[512, 4096])
+    parser.add_argument("--shard-size", type=int, default=256, help="shard size in MB")
+    parser.add_argument("--accesses", type=int, default=1000)
+    parser.add_argument("--seed", type=int, default=0)
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    rng = np.random.default_rng(args.seed)
+    latent = torch.randn(args.latent_shape).to(torch.bfloat16)
+    text = torch.randn(args.text_shape).to(torch.bfloat16)
+    with tempfile.TemporaryDirectory() as folder:
+        keys = []
+        start = time.perf_counter()
+        for i in range(args.num_samples):
+            keys.append((os.path.join(folder, f"{i}_latent.pt"), os.path.join(folder, f"{i}_t5.pt")))
+            torch.save(latent, keys[-1][0])
+            torch.save(text, keys[-1][1])
+        files_write = args.num_samples / (time.perf_counter() - start)
+
+        start = time.perf_counter()
+        with LatentStoreWriter(os.path.join(folder, "store"), shard_size=args.shard_size << 20) as writer:
+            for latent_key, text_key in keys:
+                writer.write(latent_key, latent)
+                writer.write(text_key, text)
+        store_write = args.num_samples / (time.perf_counter() - start)
+
+        indices = rng.integers(0, args.num_samples, args.accesses)
+        start = time.perf_counter()
+        for i in indices:
+            torch.load(keys[i][0], map_location="cpu").float().sum()
+            torch.load(keys[i][1], map_location="cpu").float().sum()
+        files_read = args.accesses / (time.perf_counter() - start)
+
+        start = time.perf_counter()
+        store = LatentStore(os.path.join(folder, "store"))
+        build = time.perf_counter() - start
+        start = time.perf_counter()
+        for i in indices:
+            store[keys[i][0]].float().sum()
+            store[keys[i][1]].float().sum()
+        store_read = args.accesses / (time.perf_counter() - start)
+
+    print(f"{'layout':>8} {'write/s':>10} {'read/s':>10}")
+    print(f"{'files':>8} {files_write:>10.1f} {files_read:>10.1f}")
+    print(f"{'store':>8} {store_write:>10.1f} {store_read:>10.1f} ({store_read / files_read:.1f}x read)")
+    print(f"store index of {len(store)} tensors loaded in {build * 1000:.0f} ms")
+
+
+if __name__ == "__main__":
+    main()
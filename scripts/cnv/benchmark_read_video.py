@@ -0,0 +1,89 @@
+"""
+Frames/sec of training video reads: `read_video_av` of the whole clip then `temporal_random_crop`, against
+`read_video_av_sampled` decoding only the sampled frames.
+
+Synthetic videos of every codec are written to a temporary directory. Each read draws the same random crop for
+both readers and the sampled frames are checked to be equal to the frames of the full read.
+
+Usage:
+    python scripts/cnv/benchmark_read_video.py --num-frames 300 --sample-frames 17 --interval 2
+"""
+
+import argparse
+import os
+import random
+import tempfile
+import time
+
+import av
+import numpy as np
+import torch
+
+from opensora.datasets.read_video import read_video_av, read_video_av_sampled
+from opensora.datasets.utils import temporal_random_crop_indices
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--num-frames", type=int, default=300, help="frames of each synthetic video")
+    parser.add_argument("--size", type=int, nargs=2, default=[240, 320], help="height and width")
+    parser.add_argument("--codecs", type=str, nargs="+", default=["libx264", "mpeg4"])
+    parser.add_argument("--gop-size", type=int, default=30)
+    parser.add_argument("--sample-frames", type=int, default=17)
+    parser.add_argument("--interval", type=int, default=2)
+    parser.add_argument("--reads", type=int, default=20, help="reads per video and reader")
+    parser.add_argument("--seed", type=int, default=0)
+    return parser.parse_args()
+
+
+def write_video(path: str, codec: str, num_frames: int, height: int, width: int, gop_size: int):
+    with av.open(path, "w") as container:
+        stream = container.add_stream(codec, rate=24)
+        stream.height, stream.width = height, width
+        stream.pix_fmt = "yuv420p"
+        stream.codec_context.gop_size = gop_size
+        stream.codec_context.max_b_frames = 2
+        grid = np.arange(height * width * 3, dtype=np.int64).reshape(height, width, 3)
+        for i in range(num_frames):
+            frame = av.VideoFrame.from_ndarray(((grid + 7 * i) % 256).astype(np.uint8), format="rgb24")
+            for packet in stream.encode(frame):
+                container.mux(packet)
+        for packet in stream.encode():
+            container.mux(packet)
+
+
+def main():
+    args = parse_args()
+    print(f"{'codec':>8} {'full fr/s':>10} {'sampled fr/s':>13} {'speedup':>8}")
+    with tempfile.TemporaryDirectory() as folder:
+        for codec in args.codecs:
+            path = os.path.join(folder, f"{codec}.mp4")
+            write_video(path, codec, args.num_frames, *args.size, args.gop_size)
+
+            random.seed(args.seed)
+            full, full_time = [], 0.0
+            for _ in range(args.reads):
+                start = time.perf_counter()
+                vframes, _, _ = read_video_av(filename=path, pts_unit="sec", output_format="TCHW")
+                indices = temporal_random_crop_indices(len(vframes), args.sample_frames, args.interval)
+                full.append(vframes[indices].clone())
+                full_time += time.perf_counter() - start
+
+            random.seed(args.seed)
+            sample_indices = lambda n: temporal_random_crop_indices(n, args.sample_frames, args.interval)
+            sampled_time = 0.0
+            for expected in full:
+                start = time.perf_counter()
+                video, _ = read_video_av_sampled(path, sample_indices)
+                sampled_time += time.perf_counter() - start
+                assert torch.equal(video, expected), f"sampled frames of {codec} differ from the full read"
+
+            frames = args.reads * args.sample_frames
+            print(
+                f"{codec:>8} {frames / full_time:>10.1f} {frames / sampled_time:>13.1f} "
+                f"{full_time / sampled_time:>7.1f}x"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+"""
+Random access rows/sec of the sharded text parquet used by `memory_efficient` datasets.
+
+"legacy" reads the whole shard on every access, as `EfficientParquet` used to, "cached" goes through
+the row index and the per-process shard LRU cache of `EfficientParquet`. The shards are synthetic.
+
+Usage:
+    python scripts/cnv/benchmark_shards.py --rows 200000 --num-shards 256 --cache-size 16 64 256
+"""
+
+import argparse
+import os
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+from opensora.datasets.datasets import EfficientParquet
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=100_000)
+    parser.add_argument("--num-shards", type=int, default=128)
+    parser.add_argument("--text-length", type=int, default=400, help="characters of the synthetic captions")
+    parser.add_argument("--cache-size", type=int, nargs="+", default=[16, 128])
+    parser.add_argument("--accesses", type=int, default=2000)
+    parser.add_argument("--seed", type=int, default=0)
+    return parser.parse_args()
+
+
+def write_shards(folder: str, rows: int, num_shards: int, text_length: int) -> pd.DataFrame:
+    df = pd.DataFrame(
+        dict(
+            path=[f"video_{i}.mp4" for i in range(rows)],
+            text=["a" * text_length] * rows,
+            num_frames=np.full(rows, 129),
+        )
+    )
+    rows_per_shard = (rows + num_shards - 1) // num_shards
+    for i, start in enumerate(range(0, rows, rows_per_shard)):
+        df.iloc[start : start + rows_per_shard][["path", "text"]].to_parquet(
+            os.path.join(folder, f"{i + 1:05d}.parquet"), index=False
+        )
+    return df[["path", "num_frames"]]
+
+
+def legacy_access(df: pd.DataFrame, folder: str, shards: list[str], rows_per_shard: int, index: int) -> str:
+    shard = pd.read_parquet(os.path.join(folder, shards[index // rows_per_shard]), engine="fastparquet")
+    return shard["text"].iloc[index % rows_per_shard]
+
+
+def main():
+    args = parse_args()
+    rng = np.random.default_rng(args.seed)
+    with tempfile.TemporaryDirectory() as folder:
+        df = write_shards(folder, args.rows, args.num_shards, args.text_length)
+        indices = rng.integers(0, args.rows, args.accesses)
+
+        shards = sorted(os.listdir(folder))
+        rows_per_shard = (args.rows + args.num_shards - 1) // args.num_shards
+        start = time.perf_counter()
+        for index in indices:
+            legacy_access(df, folder, shards, rows_per_shard, index)
+        legacy = args.accesses / (time.perf_counter() - start)
+        print(f"{'legacy':>16} {legacy:>10.1f} rows/s")
+
+        for cache_size in args.cache_size:
+            start = time.perf_counter()
+            parquet = EfficientParquet(df, folder, cache_size=cache_size)
+            build = time.perf_counter() - start
+            start = time.perf_counter()
+            for index in indices:
+                parquet.iloc[int(index)]["text"]
+            rate = args.accesses / (time.perf_counter() - start)
+            print(
+                f"{f'cached ({cache_size})':>16} {rate:>10.1f} rows/s {rate / legacy:>6.1f}x "
+                f"(index built in {build * 1000:.0f} ms)"
+            )
+
+
+if __name__ == "__main__":
+    main()
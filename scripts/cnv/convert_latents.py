@@ -0,0 +1,53 @@
+"""
+Convert the per-sample `torch.save` latents and text features of a dataset into a `LatentStore`.
+
+The files listed in the latents_path/text_t5_path/text_clip_path columns are written under their path as key,
+so the dataset file stays unchanged: train with `dataset.latent_store` set to the output directory.
+Files are read with a thread pool; rerunning with the same --rank continues after the finished shards.
+
+Usage:
+    python scripts/cnv/convert_latents.py data.parquet latent_store --num-workers 32
+"""
+
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+
+import torch
+from tqdm import tqdm
+
+from opensora.datasets.latent_store import LatentStoreWriter
+from opensora.datasets.utils import read_file
+
+COLUMNS = ("latents_path", "text_t5_path", "text_clip_path")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("input_path", type=str, help="dataset file (csv or parquet)")
+    parser.add_argument("output_dir", type=str, help="directory of the store")
+    parser.add_argument("--columns", type=str, nargs="+", default=COLUMNS)
+    parser.add_argument("--shard-size", type=int, default=1024, help="shard size in MB")
+    parser.add_argument("--num-workers", type=int, default=16)
+    parser.add_argument("--rank", type=int, default=0, help="convert every world-size-th file from this one")
+    parser.add_argument("--world-size", type=int, default=1)
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    df = read_file(args.input_path)
+    columns = [column for column in args.columns if column in df.columns]
+    assert len(columns) > 0, f"none of {args.columns} in {args.input_path}"
+    paths = list(dict.fromkeys(path for column in columns for path in df[column].dropna()))
+    paths = paths[args.rank :: args.world_size]
+
+    writer = LatentStoreWriter(args.output_dir, prefix=f"rank{args.rank:05d}-", shard_size=args.shard_size << 20)
+    paths = [path for path in paths if path not in writer.keys]
+    with writer, ThreadPoolExecutor(args.num_workers) as executor:
+        tensors = executor.map(lambda path: torch.load(path, map_location="cpu"), paths)
+        for path, tensor in tqdm(zip(paths, tensors), total=len(paths)):
+            writer.write(path, tensor)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,43 +1,87 @@
+"""
+Add the height, width, fps, num_frames, aspect_ratio and resolution columns of the videos of a csv.
+
+Only the container and stream headers are read. The frames are counted from the packets, without decoding them,
+when the header has no frame count or one that disagrees with the duration. The results are appended to
+`<output>.progress.jsonl` as the files are read, so an interrupted run resumes where it stopped. Files which cannot
+be read are listed with their error in `<output>.errors.csv` and left out of the output; a rerun reads them again,
+unless `--no_retry_errors` is given.
+
+Usage:
+    python scripts/cnv/meta.py --input datasets/pexels_45k.csv --output datasets/pexels_45k_nec.csv --num_workers 64
+"""
+
 import argparse
+import json
+import os
+from multiprocessing import Pool
 
+import av
 import numpy as np
 import pandas as pd
-from pandarallel import pandarallel
-from torchvision.io.video import read_video
 from tqdm import tqdm
 
+COLUMNS = ["height", "width", "fps", "num_frames", "aspect_ratio", "resolution"]
+
+
+def count_frames(container: "av.container.InputContainer", stream: "av.video.stream.VideoStream") -> int:
+    # frames before pts 0 are dropped by read_video
+    return sum(
+        1 for packet in container.demux(stream) if packet.size > 0 and packet.pts is not None and packet.pts >= 0
+    )
+
 
-def set_parallel(num_workers: int = None) -> callable:
-    if num_workers == 0:
-        return lambda x, *args, **kwargs: x.progress_apply(*args, **kwargs)
-    else:
-        if num_workers is not None:
-            pandarallel.initialize(progress_bar=True, nb_workers=num_workers)
-        else:
-            pandarallel.initialize(progress_bar=True)
-        return lambda x, *args, **kwargs: x.parallel_apply(*args, **kwargs)
+def header_frames(stream: "av.video.stream.VideoStream") -> int:
+    """Frame count of the header if it agrees with the duration of the stream, else 0."""
+    if stream.frames <= 0 or stream.duration is None or stream.average_rate is None:
+        return 0
+    expected = float(stream.duration * stream.time_base * stream.average_rate)
+    return stream.frames if abs(stream.frames - expected) <= 1 else 0
 
 
-def get_video_info(path: str) -> pd.Series:
-    vframes, _, vinfo = read_video(path, pts_unit="sec", output_format="TCHW")
-    num_frames, C, height, width = vframes.shape
-    fps = round(vinfo["video_fps"], 3)
+def get_video_info(path: str) -> dict:
+    with av.open(path, metadata_errors="ignore") as container:
+        stream = container.streams.video[0]
+        height, width = stream.codec_context.height, stream.codec_context.width
+        if height == 0 or width == 0:
+            frame = next(container.decode(stream))
+            height, width = frame.height, frame.width
+            container.seek(0)
+        if stream.average_rate is None:
+            raise ValueError("no frame rate in the stream header")
+        fps = round(float(stream.average_rate), 3)
+        num_frames = header_frames(stream) or count_frames(container, stream)
     aspect_ratio = height / width if width > 0 else np.nan
     resolution = height * width
+    return dict(zip(COLUMNS, [height, width, fps, num_frames, aspect_ratio, resolution]))
 
-    ret = pd.Series(
-        [height, width, fps, num_frames, aspect_ratio, resolution],
-        index=[
-            "height",
-            "width",
-            "fps",
-            "num_frames",
-            "aspect_ratio",
-            "resolution",
-        ],
-        dtype=object,
-    )
-    return ret
+
+def read_info(item: tuple[int, str]) -> dict:
+    index, path = item
+    try:
+        return dict(index=index, path=path, **get_video_info(path))
+    except Exception as e:
+        return dict(index=index, path=path, error=f"{type(e).__name__}: {e}")
+
+
+def load_progress(progress_path: str, paths: list[str], retry_errors: bool = True) -> dict[int, dict]:
+    """Records of the files read by previous runs, without the failed ones when they are retried."""
+    done = dict()
+    if not os.path.exists(progress_path):
+        return done
+    with open(progress_path) as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:  # last line of an interrupted run
+                continue
+            index = record["index"]
+            if retry_errors and "error" in record:
+                # read again by this run, its new record is appended after this one
+                continue
+            if index < len(paths) and paths[index] == record["path"]:
+                done[index] = record
+    return done
 
 
 def parse_args():
@@ -45,7 +89,13 @@ def parse_args():
     parser.add_argument("--input", type=str, required=True, help="Input file path")
     parser.add_argument("--output", type=str, required=True, help="Output file path")
     parser.add_argument(
-        "--num_workers", type=int, default=None, help="Number of workers"
+        "--num_workers", type=int, default=None, help="Number of workers, 0 to read in the main process"
+    )
+    parser.add_argument("--flush_every", type=int, default=1000, help="Files read between writes of the progress")
+    parser.add_argument(
+        "--no_retry_errors",
+        action="store_true",
+        help="Keep the files which failed in previous runs as failed instead of reading them again",
     )
     return parser.parse_args()
 
@@ -55,15 +105,42 @@ def main():
     input_path = args.input
     output_path = args.output
     num_workers = args.num_workers
+    progress_path = f"{output_path}.progress.jsonl"
+    errors_path = f"{output_path}.errors.csv"
 
     df = pd.read_csv(input_path)
-    tqdm.pandas()
-    apply = set_parallel(num_workers)
+    paths = df["path"].tolist()
+    done = load_progress(progress_path, paths, retry_errors=not args.no_retry_errors)
+    todo = [(index, path) for index, path in enumerate(paths) if index not in done]
+    print(f"{len(done)} of {len(paths)} videos already read, {len(todo)} left")
+
+    # == read the headers ==
+    pool = Pool(num_workers) if num_workers != 0 and len(todo) > 0 else None
+    results = pool.imap_unordered(read_info, todo, chunksize=16) if pool is not None else map(read_info, todo)
+    with open(progress_path, "a") as f:
+        for k, record in enumerate(tqdm(results, total=len(todo)), start=1):
+            done[record["index"]] = record
+            f.write(json.dumps(record) + "\n")
+            if k % args.flush_every == 0:
+                f.flush()
+    if pool is not None:
+        pool.close()
+        pool.join()
 
-    result = apply(df["path"], get_video_info)
-    for col in result.columns:
-        df[col] = result[col]
+    # == write the results ==
+    records = [done[index] for index in range(len(paths))]
+    errors = [record for record in records if "error" in record]
+    if len(errors) > 0:
+        pd.DataFrame(errors, columns=["path", "error"]).to_csv(errors_path, index=False)
+        print(f"{len(errors)} videos could not be read, listed in {errors_path}")
+    elif os.path.exists(errors_path):  # every failure of a previous run was read on retry
+        os.remove(errors_path)
+    valid = [index for index, record in enumerate(records) if "error" not in record]
+    df = df.iloc[valid].copy()
+    for col in COLUMNS:
+        df[col] = pd.Series([records[index][col] for index in valid], index=df.index, dtype=object)
     df.to_csv(output_path, index=False)
+    print(f"Saved {len(df)} videos to {output_path}")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,80 @@
+"""
+Latency of spatio-temporal sparse attention against full attention for growing frame counts.
+
+The sparse output is first checked against the dense masked reference on a small layout.
+Runs on GPU with flash attention, or on CPU (small sizes) through the SDPA fallback.
+
+Usage:
+    python scripts/diffusion/benchmark_sparse_attention.py --frames 33 65 129 --height 24 --width 42
+"""
+
+import argparse
+import time
+
+import torch
+
+from opensora.models.mmdit.math import TokenLayout, flash_attn_func
+from opensora.models.mmdit.sparse_attention import SpatioTemporalSparseAttention
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--frames", type=int, nargs="+", default=[9, 17, 33, 65], help="latent frames")
+    parser.add_argument("--height", type=int, default=16, help="image tokens along height")
+    parser.add_argument("--width", type=int, default=28, help="image tokens along width")
+    parser.add_argument("--txt-len", type=int, default=512)
+    parser.add_argument("--num-heads", type=int, default=24)
+    parser.add_argument("--head-dim", type=int, default=128)
+    parser.add_argument("--block-size", type=int, nargs=3, default=[4, 0, 0])
+    parser.add_argument("--window", type=int, nargs=3, default=[1, 0, 0])
+    parser.add_argument("--global-frames", type=int, nargs="*", default=[0])
+    parser.add_argument("--repeat", type=int, default=5)
+    return parser.parse_args()
+
+
+def timeit(fn, repeat: int, device: torch.device) -> float:
+    fn()  # warmup
+    if device.type == "cuda":
+        torch.cuda.synchronize()
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    if device.type == "cuda":
+        torch.cuda.synchronize()
+    return (time.perf_counter() - start) / repeat * 1000
+
+
+@torch.inference_mode()
+def main():
+    args = parse_args()
+    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+    dtype = torch.bfloat16 if device.type == "cuda" else torch.float32
+    layout = TokenLayout()
+    sparse = SpatioTemporalSparseAttention(layout, args.block_size, args.window, args.global_frames)
+
+    # correctness against the dense masked reference
+    layout.txt_len, layout.grid = 8, (9, 4, 6)
+    q, k, v = torch.randn(3, 1, 8 + 9 * 4 * 6, 2, 32, device=device, dtype=dtype).unbind(0)
+    error = (sparse(q, k, v).float() - sparse.reference(q, k, v).float()).abs().max().item()
+    print(f"max abs error against reference: {error:.3e}")
+
+    print(f"{'frames':>8} {'tokens':>8} {'density':>8} {'full ms':>10} {'sparse ms':>10} {'speedup':>8}")
+    for frames in args.frames:
+        layout.txt_len, layout.grid = args.txt_len, (frames, args.height, args.width)
+        L = args.txt_len + frames * args.height * args.width
+        q, k, v = torch.randn(3, 1, L, args.num_heads, args.head_dim, device=device, dtype=dtype).unbind(0)
+        plan = sparse.plan(layout.txt_len, layout.grid, device)
+        pairs = sum(
+            (qi.stop - qi.start if isinstance(qi, slice) else qi.numel())
+            * (ki.stop - ki.start if isinstance(ki, slice) else ki.numel())
+            for qi, ki in plan
+        )
+        full_ms = timeit(lambda: flash_attn_func(q, k, v), args.repeat, device)
+        sparse_ms = timeit(lambda: sparse(q, k, v), args.repeat, device)
+        print(
+            f"{frames:>8} {L:>8} {pairs / L**2:>8.3f} {full_ms:>10.2f} {sparse_ms:>10.2f} {full_ms / sparse_ms:>8.2f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+"""
+Speed/quality benchmark of inference-time token reduction.
+
+Every prompt is generated once with full attention and once per token reduction variant,
+with the same seed. We report the wall time of each generation and the PSNR of the
+variant against the full attention video. Prompts are read from the `text` column of
+`--dataset.data-path`, or, as in inference.py, a single `--prompt` is used.
+
+Usage:
+    torchrun --nproc_per_node 1 scripts/diffusion/benchmark_token_reduction.py \
+        configs/diffusion/inference/768px_token_reduction.py --dataset.data-path prompts.csv --num-samples 4
+    torchrun --nproc_per_node 1 scripts/diffusion/benchmark_token_reduction.py \
+        configs/diffusion/inference/768px_token_reduction.py --prompt "a cat playing the piano"
+"""
+
+import json
+import os
+import time
+from pprint import pformat
+
+import pandas as pd
+import torch
+import torch.distributed as dist
+from colossalai.utils import set_seed
+
+from opensora.utils.cai import init_inference_environment
+from opensora.utils.config import parse_alias, parse_configs
+from opensora.utils.inference import add_fps_info_to_text, add_motion_score_to_text, create_tmp_csv
+from opensora.utils.logger import create_logger, is_main_process
+from opensora.utils.misc import to_torch_dtype
+from opensora.utils.sampling import SamplingOption, prepare_api, prepare_models, sanitize_sampling_option
+
+
+def psnr(x: torch.Tensor, y: torch.Tensor) -> float:
+    # videos are in [-1, 1]
+    mse = ((x.float() - y.float()) ** 2).mean().clamp_min(1e-10)
+    return (10 * torch.log10(4 / mse)).item()
+
+
+@torch.inference_mode()
+def main():
+    torch.set_grad_enabled(False)
+    cfg = parse_configs()
+    cfg = parse_alias(cfg)
+
+    device = "cuda" if torch.cuda.is_available() else "cpu"
+    dtype = to_torch_dtype(cfg.get("dtype", "bf16"))
+    seed = cfg.get("seed", 1024)
+    set_seed(seed)
+
+    init_inference_environment()
+    logger = create_logger()
+
+    variants = cfg.get("token_reduction_variants", [cfg.model.get("token_reduction", None)])
+    variants = [v for v in variants if v]
+    assert len(variants) > 0, "No token reduction variant to benchmark"
+    logger.info("Token reduction variants:\n %s", pformat(variants))
+
+    os.makedirs(cfg.save_dir, exist_ok=True)
+    if cfg.get("prompt", None):
+        cfg.dataset.data_path = create_tmp_csv(cfg.save_dir, cfg.prompt, create=is_main_process())
+        if dist.is_initialized():
+            dist.barrier()
+    assert cfg.dataset.get("data_path", None) is not None, "Set --dataset.data-path <prompts.csv> or --prompt <text>"
+    prompts = pd.read_csv(cfg.dataset.data_path)["text"].tolist()
+    prompts = prompts[: cfg.get("num_samples", 4)]
+
+    sampling_option = sanitize_sampling_option(SamplingOption(**cfg.sampling_option))
+    model, model_ae, model_t5, model_clip, optional_models = prepare_models(cfg, device, dtype)
+    api_fn = prepare_api(model, model_ae, model_t5, model_clip, optional_models)
+
+    def generate(text: str) -> tuple[torch.Tensor, float]:
+        text = add_fps_info_to_text([text], fps=cfg.get("fps_save", 24))
+        if "motion_score" in cfg:
+            text = add_motion_score_to_text(text, cfg.get("motion_score", 5))
+        if device == "cuda":
+            torch.cuda.synchronize()
+        start = time.perf_counter()
+        x = api_fn(
+            sampling_option,
+            cfg.get("cond_type", "t2v"),
+            seed=sampling_option.seed if sampling_option.seed is not None else seed,
+            patch_size=cfg.get("patch_size", 2),
+            channel=cfg["model"]["in_channels"],
+            text=text,
+        )
+        if device == "cuda":
+            torch.cuda.synchronize()
+        return x.cpu(), time.perf_counter() - start
+
+    # warmup, compiles kernels and fills allocator caches
+    model.set_token_reduction(None)
+    generate(prompts[0])
+
+    results = []
+    for i, prompt in enumerate(prompts):
+        model.set_token_reduction(None)
+        reference, ref_time = generate(prompt)
+        results.append(dict(prompt=i, variant="full", time=ref_time, psnr=float("inf")))
+        for variant in variants:
+            model.set_token_reduction(variant)
+            x, elapsed = generate(prompt)
+            results.append(dict(prompt=i, variant=str(variant), time=elapsed, psnr=psnr(x, reference)))
+            logger.info(
+                "prompt %d %s: %.2fs (full %.2fs, x%.2f), psnr %.2f dB",
+                i,
+                variant,
+                elapsed,
+                ref_time,
+                ref_time / elapsed,
+                results[-1]["psnr"],
+            )
+
+    summary = pd.DataFrame(results).groupby("variant")[["time", "psnr"]].mean()
+    logger.info("Token reduction benchmark summary:\n%s", summary.to_string())
+
+    with open(os.path.join(cfg.save_dir, "token_reduction_benchmark.json"), "w") as f:
+        json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
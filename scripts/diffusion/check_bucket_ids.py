@@ -0,0 +1,93 @@
+"""
+Check that the vectorized `Bucket.get_bucket_ids` assigns the same bucket as `Bucket.get_bucket_id` row by row.
+
+Synthetic samples mix images, videos of every length, missing and high fps and resolutions around every bucket
+threshold. Their seeds are drawn as `build_bucket_ids` does for an epoch, `seed + index * num_bucket`. The
+bucket_config of every given training config is checked for every seed, as well as a built-in config with
+probabilities below 1 and (hw, t) probability pairs, which the training configs rarely use, so that the random
+draws of every sample are compared too.
+
+Usage:
+    python scripts/diffusion/check_bucket_ids.py --configs configs/diffusion/train/image.py \
+        configs/diffusion/train/stage1.py configs/diffusion/train/stage2.py --num-samples 20000 --seeds 0 1 1024
+"""
+
+import argparse
+import time
+
+import numpy as np
+from mmengine.config import Config
+
+from opensora.datasets.bucket import Bucket, batched_default_rng
+
+
+# probabilities below 1 and probability pairs, every sample draws from its random stream
+RANDOM_BUCKET_CONFIG = {
+    "256px": {1: (0.5, 64), 17: ((0.5, 0.3), 16), 33: (0.7, 8), 65: ((0.9, 0.5), 4), 129: (0.4, 2)},
+    "360p": {1: (0.8, 32), 17: (0.3, 8), 49: ((0.6, 0.2), 4)},
+    "768px": {1: (0.2, 16), 33: ((0.5, 0.5), 2), 97: (1.0, 1)},
+}
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--configs", type=str, nargs="+", default=["configs/diffusion/train/image.py"])
+    parser.add_argument("--num-samples", type=int, default=20000)
+    parser.add_argument("--seeds", type=int, nargs="+", default=[0, 1, 1024])
+    parser.add_argument("--fps-max", type=int, default=16)
+    return parser.parse_args()
+
+
+def synthetic_samples(num_samples: int, rng: np.random.Generator) -> dict[str, np.ndarray]:
+    num_frames = np.where(rng.random(num_samples) < 0.3, 1, rng.integers(2, 400, num_samples))
+    height = rng.integers(64, 2200, num_samples)
+    width = (height * rng.uniform(0.4, 2.5, num_samples)).astype(np.int64)
+    fps = rng.choice([np.nan, 8, 12, 15, 16, 24, 25, 29.97, 30, 60, 120], num_samples)
+    return dict(num_frames=num_frames, height=height, width=width, fps=fps)
+
+
+def main():
+    args = parse_args()
+    samples = synthetic_samples(args.num_samples, np.random.default_rng(0))
+    columns = [samples[k].astype(np.float64) for k in ("num_frames", "height", "width", "fps")]
+
+    failed = False
+    bucket_configs = {config: Config.fromfile(config).bucket_config for config in args.configs}
+    bucket_configs["random"] = RANDOM_BUCKET_CONFIG
+    for config, bucket_config in bucket_configs.items():
+        bucket = Bucket(bucket_config)
+        for seed in args.seeds:
+            seeds = seed + np.arange(args.num_samples, dtype=np.uint64) * np.uint64(bucket.num_bucket)
+
+            start = time.perf_counter()
+            bucket_ids = bucket.get_bucket_ids(*columns, seeds, fps_max=args.fps_max)
+            vectorized_time = time.perf_counter() - start
+
+            start = time.perf_counter()
+            expected = []
+            for i in range(args.num_samples):
+                key = bucket.get_bucket_id(
+                    int(samples["num_frames"][i]),
+                    int(samples["height"][i]),
+                    int(samples["width"][i]),
+                    float(samples["fps"][i]),
+                    seed=int(seeds[i]),
+                    fps_max=args.fps_max,
+                )
+                expected.append(-1 if key is None else bucket.bucket_keys.index(key))
+            rowwise_time = time.perf_counter() - start
+
+            mismatches = int((bucket_ids != np.array(expected)).sum())
+            failed |= mismatches > 0
+            print(
+                f"{config} seed {seed}: {mismatches} mismatches of {args.num_samples}, "
+                f"{(bucket_ids >= 0).sum()} assigned, {rowwise_time:.2f}s row by row, {vectorized_time:.3f}s vectorized"
+            )
+    print(f"rng: {type(batched_default_rng(np.arange(4))).__name__}")
+    print("FAILED" if failed else "OK")
+    if failed:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
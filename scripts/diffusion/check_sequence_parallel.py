@@ -0,0 +1,186 @@
+"""
+Check the sequence parallel MMDiT blocks against the same blocks run on one device.
+
+A tiny double stream block followed by a single stream block is built with the same weights on every rank. The
+reference runs both blocks with their default processors on the full sequence. The sequence parallel run installs
+`DistributedDoubleStreamBlockProcessor` and `DistributedSingleStreamBlockProcessor`, feeds each rank its text and
+image tokens and their rotary embedding the way `mmdit_model_forward` splits them, and compares the output, the input
+gradients and the parameter gradients (summed over the ranks) with the matching part of the reference. Modes are
+all_to_all (Ulysses), ring and 2D (Ulysses groups of `--ulysses-size` ranks joined by rings, from
+`create_2d_sp_groups`), each with even and uneven splits from `partition_sequence`.
+
+Runs on CPU with gloo, or on GPU with nccl. The fused QK norm is a Triton kernel, so on CPU the blocks use the
+equivalent `RMSNorm`.
+
+Usage:
+    torchrun --nproc_per_node 4 scripts/diffusion/check_sequence_parallel.py --backend gloo --ulysses-size 2
+"""
+
+import argparse
+import copy
+import os
+from typing import List
+
+import torch
+import torch.distributed as dist
+from colossalai.shardformer import ShardConfig
+
+from opensora.models.mmdit.distributed import (
+    DistributedDoubleStreamBlockProcessor,
+    DistributedSingleStreamBlockProcessor,
+    SequenceParallelContext,
+    partition_sequence,
+)
+from opensora.models.mmdit.layers import DoubleStreamBlock, FusedRMSNorm, RMSNorm, SingleStreamBlock
+from opensora.models.mmdit.math import cat_pe, rope, slice_pe
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--backend", type=str, default="gloo", choices=["gloo", "nccl"])
+    parser.add_argument("--ulysses-size", type=int, default=2, help="all-to-all group size of the 2D mode")
+    parser.add_argument("--batch-size", type=int, default=2)
+    parser.add_argument("--heads-per-rank", type=int, default=2)
+    parser.add_argument("--head-dim", type=int, default=16)
+    parser.add_argument("--even", type=int, nargs=2, default=[4, 12], help="txt and img tokens per rank")
+    parser.add_argument("--uneven", type=int, nargs=2, default=[7, 29], help="total txt and img tokens")
+    parser.add_argument("--atol", type=float, default=1e-4)
+    parser.add_argument("--seed", type=int, default=1024)
+    return parser.parse_args()
+
+
+def use_torch_rms_norm(module: torch.nn.Module) -> None:
+    """Replace the fused RMSNorm of the QK norms by `RMSNorm` with the same scale."""
+    for name, child in module.named_children():
+        if isinstance(child, FusedRMSNorm):
+            norm = RMSNorm(child.scale.numel()).to(child.scale)
+            norm.load_state_dict(child.state_dict())
+            setattr(module, name, norm)
+        else:
+            use_torch_rms_norm(child)
+
+
+def run_blocks(blocks, img, txt, vec, pe):
+    double_block, single_block = blocks
+    img, txt = double_block(img, txt, vec, pe)
+    return single_block(torch.cat((txt, img), 1), vec, pe)
+
+
+def check(args, blocks, shard_config, ctx, txt_splits: List[int], img_splits: List[int], device):
+    rank = dist.get_rank(ctx.sp_group)
+    B, C = args.batch_size, blocks[0].hidden_size
+    txt_len, img_len = sum(txt_splits), sum(img_splits)
+
+    generator = torch.Generator().manual_seed(args.seed)
+    img = torch.randn(B, img_len, C, generator=generator).to(device)
+    txt = torch.randn(B, txt_len, C, generator=generator).to(device)
+    vec = torch.randn(B, C, generator=generator).to(device)
+    grad = torch.randn(B, txt_len + img_len, C, generator=generator).to(device)
+    pos = torch.randn(1, txt_len + img_len, generator=generator).cumsum(1).to(device) * 4
+    pe = rope(pos, args.head_dim, 10000).unsqueeze(1)
+
+    # single device
+    ref_blocks = [copy.deepcopy(block) for block in blocks]
+    ref_img, ref_txt = img.clone().requires_grad_(), txt.clone().requires_grad_()
+    ref_out = run_blocks(ref_blocks, ref_img, ref_txt, vec, pe)
+    ref_out.backward(grad)
+
+    # sequence parallel, with the inputs split as in mmdit_model_forward
+    sp_blocks = [copy.deepcopy(block) for block in blocks]
+    sp_blocks[0].set_processor(DistributedDoubleStreamBlockProcessor(shard_config, ctx))
+    sp_blocks[1].set_processor(DistributedSingleStreamBlockProcessor(shard_config, ctx))
+    ctx.update_splits(txt_splits, img_splits)
+    txt_start, img_start = sum(txt_splits[:rank]), sum(img_splits[:rank])
+    txt_index = torch.arange(txt_start, txt_start + txt_splits[rank], device=device)
+    img_index = torch.arange(img_start, img_start + img_splits[rank], device=device)
+    sp_img = img[:, img_index].clone().requires_grad_()
+    sp_txt = txt[:, txt_index].clone().requires_grad_()
+    local_pe = cat_pe(
+        [
+            slice_pe(pe, txt_start, txt_start + txt_splits[rank]),
+            slice_pe(pe, txt_len + img_start, txt_len + img_start + img_splits[rank]),
+        ]
+    )
+    sp_out = run_blocks(sp_blocks, sp_img, sp_txt, vec, local_pe)
+    index = torch.cat((txt_index, txt_len + img_index))
+    sp_out.backward(grad[:, index])
+
+    # parameters are replicated, each rank holds the gradient of its own tokens
+    param_error = torch.zeros((), device=device)
+    for sp_param, ref_param in zip(
+        [p for block in sp_blocks for p in block.parameters()], [p for block in ref_blocks for p in block.parameters()]
+    ):
+        param_grad = sp_param.grad.clone()
+        dist.all_reduce(param_grad, group=ctx.sp_group)
+        param_error = torch.maximum(param_error, (param_grad - ref_param.grad).abs().max())
+
+    errors = torch.stack(
+        [
+            (sp_out - ref_out[:, index]).abs().max(),
+            (sp_txt.grad - ref_txt.grad[:, txt_index]).abs().max(),
+            (sp_img.grad - ref_img.grad[:, img_index]).abs().max(),
+            param_error,
+        ]
+    ).float()
+    dist.all_reduce(errors, op=dist.ReduceOp.MAX, group=ctx.sp_group)
+    return errors.tolist()
+
+
+def main():
+    args = parse_args()
+    dist.init_process_group(backend=args.backend)
+    world_size, rank = dist.get_world_size(), dist.get_rank()
+    device = torch.device("cpu")
+    if args.backend == "nccl":
+        device = torch.device("cuda", int(os.environ.get("LOCAL_RANK", 0)))
+        torch.cuda.set_device(device)
+    sp_group = dist.new_group(list(range(world_size)))
+
+    num_heads = args.heads_per_rank * world_size
+    torch.manual_seed(args.seed)
+    blocks = [
+        DoubleStreamBlock(num_heads * args.head_dim, num_heads, mlp_ratio=2.0, qkv_bias=True).to(device),
+        SingleStreamBlock(num_heads * args.head_dim, num_heads, mlp_ratio=2.0).to(device),
+    ]
+    if device.type == "cpu":
+        for block in blocks:
+            use_torch_rms_norm(block)
+
+    modes = {"all_to_all": ("all_to_all", 1), "ring": ("ring_attn", 1)}
+    if 1 < args.ulysses_size < world_size:
+        modes["2d"] = ("ring_attn", args.ulysses_size)
+    splits = {
+        "even": ([args.even[0]] * world_size, [args.even[1]] * world_size),
+        "uneven": partition_sequence(*args.uneven, world_size),
+    }
+
+    failed = False
+    if rank == 0:
+        print(f"{world_size} ranks, {args.backend}, max abs error against the blocks run on one device")
+        print(f"{'mode':>10} {'split':>6} {'out':>9} {'dtxt':>9} {'dimg':>9} {'dparam':>9}  splits")
+    for mode, (sp_mode, ulysses_size) in modes.items():
+        shard_config = ShardConfig(
+            sequence_parallel_process_group=sp_group,
+            enable_tensor_parallelism=False,
+            enable_sequence_parallelism=True,
+            sequence_parallelism_mode=sp_mode,
+        )
+        ctx = SequenceParallelContext.from_shard_config(shard_config, ulysses_size)
+        for split_name, (txt_splits, img_splits) in splits.items():
+            errors = check(args, blocks, shard_config, ctx, txt_splits, img_splits, device)
+            failed |= max(errors) > args.atol
+            if rank == 0:
+                print(
+                    f"{mode:>10} {split_name:>6} "
+                    + " ".join(f"{e:>9.2e}" for e in errors)
+                    + f"  txt {txt_splits} img {img_splits}"
+                )
+    if rank == 0:
+        print("FAILED" if failed else "OK")
+    dist.destroy_process_group()
+    if failed:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -15,8 +15,10 @@ from tqdm import tqdm
 
 from opensora.acceleration.parallel_states import get_data_parallel_group
 from opensora.datasets.dataloader import prepare_dataloader
+from opensora.models.mmdit.distributed import RING_ATTN_TIMER
 from opensora.registry import DATASETS, build_module
 from opensora.utils.cai import (
+    enable_ae_tile_parallel,
     get_booster,
     get_is_saving_process,
     init_inference_environment,
@@ -176,6 +178,7 @@ def main():
     if booster_ae:
         model_ae, _, _, _, _ = booster_ae.boost(model=model_ae)
         model_ae = model_ae.unwrap()
+    model_ae = enable_ae_tile_parallel(cfg, model_ae)
 
     api_fn = prepare_api(model, model_ae, model_t5, model_clip, optional_models)
 
@@ -188,6 +191,9 @@ def main():
     # ======================================================
     # 4. inference
     # ======================================================
+    profile_ring_attn = cfg.get("profile_ring_attn", False)
+    if profile_ring_attn:
+        RING_ATTN_TIMER.enable()
     for epoch in range(num_sample):  # generate multiple samples with different seeds
         dataloader_iter = iter(dataloader)
         with tqdm(
@@ -223,6 +229,7 @@ def main():
                         "t2v",
                         seed=sampling_option.seed + epoch if sampling_option.seed else None,
                         channel=cfg["img_flux"]["in_channels"],
+                        output_uint8=cfg.get("decode_uint8", True),
                         **batch,
                     ).cpu()
 
@@ -271,8 +278,12 @@ def main():
                     patch_size=cfg.get("patch_size", 2),
                     save_prefix=cfg.get("save_prefix", ""),
                     channel=cfg["model"]["in_channels"],
+                    output_uint8=cfg.get("decode_uint8", True),
                     **batch,
                 ).cpu()
+                if profile_ring_attn:
+                    logger.info("Ring attention per-step timing: %s", RING_ATTN_TIMER.summary())
+                    RING_ATTN_TIMER.reset()
 
                 if is_saving_process:
                     process_and_save(x, batch, cfg, sub_dir, sampling_option, epoch, start_index)
@@ -0,0 +1,123 @@
+"""
+Long video generation by chaining segments, each one conditioned on the end of the previous one.
+
+Replaces decoding every segment to mp4, extracting its last frame with ffmpeg and encoding it again as the
+reference of the next segment (see ref_run_batch.sh): the condition is passed on device, either as the last
+latent frames (--continuation latent) or by encoding the last decoded frames (--continuation frames).
+
+Usage:
+    torchrun --nproc_per_node 2 --standalone scripts/diffusion/inference_long.py configs/diffusion/inference/768px.py \
+        --prompt_dir prompts --ref assets/first_frame.png --cond_type i2v_head --save-dir outputs/long
+"""
+
+import os
+from glob import glob
+from pprint import pformat
+
+import torch
+import torch.distributed as dist
+from colossalai.utils import set_seed
+
+from opensora.datasets import save_sample
+from opensora.utils.cai import (
+    enable_ae_tile_parallel,
+    get_booster,
+    get_is_saving_process,
+    init_inference_environment,
+)
+from opensora.utils.config import parse_alias, parse_configs
+from opensora.utils.inference import add_fps_info_to_text, add_motion_score_to_text
+from opensora.utils.logger import create_logger
+from opensora.utils.misc import log_cuda_max_memory, to_torch_dtype
+from opensora.utils.sampling import (
+    SamplingOption,
+    generate_continuation,
+    prepare_api,
+    prepare_models,
+    sanitize_sampling_option,
+)
+
+
+def read_prompts(cfg) -> list[str]:
+    if cfg.get("prompts", None) is not None:
+        return list(cfg.prompts)
+    assert cfg.get("prompt_dir", None) is not None, "either prompts or prompt_dir is required"
+    prompts = []
+    for path in sorted(glob(os.path.join(cfg.prompt_dir, "*.txt"))):
+        with open(path, "r", encoding="utf-8") as f:
+            prompts.append(f.read().strip())
+    assert len(prompts) > 0, f"no prompt found in {cfg.prompt_dir}"
+    return prompts
+
+
+@torch.inference_mode()
+def main():
+    torch.set_grad_enabled(False)
+    cfg = parse_configs()
+    cfg = parse_alias(cfg)
+
+    device = "cuda" if torch.cuda.is_available() else "cpu"
+    dtype = to_torch_dtype(cfg.get("dtype", "bf16"))
+    seed = cfg.get("seed", 1024)
+    if seed is not None:
+        set_seed(seed)
+
+    init_inference_environment()
+    logger = create_logger()
+    logger.info("Inference configuration:\n %s", pformat(cfg.to_dict()))
+    is_saving_process = get_is_saving_process(cfg)
+    booster = get_booster(cfg)
+    booster_ae = get_booster(cfg, ae=True)
+
+    save_dir = cfg.save_dir
+    os.makedirs(save_dir, exist_ok=True)
+    fps_save = cfg.get("fps_save", 16)
+    prompts = add_fps_info_to_text(read_prompts(cfg), fps=fps_save)
+    if "motion_score" in cfg:
+        prompts = add_motion_score_to_text(prompts, cfg.get("motion_score", 5))
+
+    sampling_option = SamplingOption(**cfg.sampling_option)
+    sampling_option = sanitize_sampling_option(sampling_option)
+
+    logger.info("Building models...")
+    model, model_ae, model_t5, model_clip, optional_models = prepare_models(cfg, device, dtype)
+    log_cuda_max_memory("build model")
+    if booster:
+        model, _, _, _, _ = booster.boost(model=model)
+        model = model.unwrap()
+    if booster_ae:
+        model_ae, _, _, _, _ = booster_ae.boost(model=model_ae)
+        model_ae = model_ae.unwrap()
+    model_ae = enable_ae_tile_parallel(cfg, model_ae)
+    api_fn = prepare_api(model, model_ae, model_t5, model_clip, optional_models)
+
+    segments = generate_continuation(
+        api_fn,
+        sampling_option,
+        prompts,
+        model_ae,
+        cond_type=cfg.get("cond_type", "i2v_head"),
+        continuation=cfg.get("continuation", "latent"),
+        ref=cfg.get("ref", None),
+        seed=sampling_option.seed if sampling_option.seed is not None else seed,
+        patch_size=cfg.get("patch_size", 2),
+        channel=cfg["model"]["in_channels"],
+        output_uint8=True,
+    )
+    videos = []
+    for i, x in enumerate(segments):
+        x = x[0].cpu()  # [T, H, W, C]
+        logger.info("Generated segment %s with %s frames", i, x.size(0))
+        if is_saving_process:
+            save_sample(x, save_path=os.path.join(save_dir, f"segment_{i:03d}"), fps=fps_save)
+        videos.append(x)
+    if is_saving_process:
+        save_sample(torch.cat(videos), save_path=os.path.join(save_dir, "long_video"), fps=fps_save)
+    dist.barrier()
+
+    logger.info("Inference finished.")
+    log_cuda_max_memory("inference")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,217 @@
+"""
+Precompute the video latents and text features of a dataset for training with `cached_video`/`cached_text`.
+
+Samples are bucketed as `VariableVideoBatchSampler` does in the first epoch for the same seed and bucket_config,
+so every latent has the shape training crops its video to. The buckets are split into parts of about
+`part_size` samples, spread round robin over the ranks and written to a `LatentStore` in `save_dir`, one writer
+per part. Finished parts are skipped on restart and an interrupted part skips the samples in its finished shards.
+
+Rank 0 then waits for the `.done` marker of every part, polling instead of a collective that could time out, and
+writes `<save_dir>/data.parquet`, the encoded rows of the dataset with their original index and the store keys in
+the latents_path column, plus text_t5_path/text_clip_path for the text encoders that ran. To train on it:
+    dataset = dict(type="cached_video_text", data_path="<save_dir>/data.parquet", latent_store="<save_dir>",
+                   cached_video=True, cached_text=True, load_original_video=False)
+`cached_text=True` needs both t5 and clip features; with `--t5 none` or `--clip none`, train with
+`cached_text=False` and the text encoders in the training config.
+Buckets drawn with a probability below 1 may differ in later epochs, keep such bucket_configs to one epoch.
+
+Usage:
+    torchrun --nproc_per_node 8 scripts/diffusion/precompute.py configs/diffusion/precompute/stage1.py \
+        --dataset.data-path data.parquet --save-dir cache/latents
+    # CPU, randomly initialized models
+    torchrun --nproc_per_node 2 scripts/diffusion/precompute.py configs/diffusion/precompute/tiny.py \
+        --dataset.data-path data.parquet
+"""
+
+import os
+import time
+from pprint import pformat
+
+import torch
+import torch.distributed as dist
+from torch.utils.data import DataLoader, Dataset
+from tqdm import tqdm
+
+from opensora.datasets.bucket import Bucket
+from opensora.datasets.dataloader import collate_fn_default
+from opensora.datasets.datasets import EfficientParquet
+from opensora.datasets.latent_store import INDEX_SUFFIX, LatentStore, LatentStoreWriter
+from opensora.datasets.sampler import build_bucket_ids, group_by_bucket_ids
+from opensora.datasets.utils import cache_latents
+from opensora.datasets.video_transforms import resized_crop_on_device
+from opensora.registry import DATASETS, MODELS, build_module
+from opensora.utils.config import parse_configs
+from opensora.utils.logger import create_logger, is_distributed, is_main_process
+from opensora.utils.misc import to_torch_dtype
+
+KEY_COLUMNS = {"video": "latents_path", "t5": "text_t5_path", "clip": "text_clip_path"}
+
+
+class IndexedDataset(Dataset):
+    """Items of a bucketed dataset tagged with the index of their sample."""
+
+    def __init__(self, dataset: Dataset):
+        self.dataset = dataset
+
+    def __len__(self) -> int:
+        return len(self.dataset)
+
+    def __getitem__(self, index: str) -> dict | None:
+        item = self.dataset[index]
+        if item is not None:
+            item["sample_index"] = int(index.split("-")[0])
+        return item
+
+
+def collate_fn(batch: list) -> dict | None:
+    batch = [x for x in batch if x is not None]
+    return collate_fn_default(batch) if len(batch) > 0 else None
+
+
+def sample_key(index: int, name: str) -> str:
+    return f"{index}/{name}"
+
+
+def build_parts(bucket: Bucket, bucket_sample_dict: dict, part_size: int, batch_size: int = None) -> list:
+    """
+    Split every bucket into batches of "index-T-H-W" dataset indices, and the batches into parts.
+
+    Returns:
+        list[list[list[str]]]: the batches of every part.
+    """
+    parts = []
+    for bucket_id, indices in bucket_sample_dict.items():
+        real_t, real_h, real_w = bucket.get_thw(bucket_id)
+        bs = batch_size or bucket.get_batch_size(bucket_id)
+        batches = [
+            [f"{idx}-{real_t}-{real_h}-{real_w}" for idx in indices[start : start + bs]]
+            for start in range(0, len(indices), bs)
+        ]
+        batches_per_part = max(1, part_size // bs)
+        parts.extend(batches[start : start + batches_per_part] for start in range(0, len(batches), batches_per_part))
+    return parts
+
+
+def part_name(part_id: int) -> str:
+    return f"part{part_id:06d}"
+
+
+def done_path(save_dir: str, name: str) -> str:
+    return os.path.join(save_dir, f"{name}.done")
+
+
+@torch.inference_mode()
+def main():
+    cfg = parse_configs()
+    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+    dtype = to_torch_dtype(cfg.get("dtype", "bf16"))
+    rank, world_size = 0, 1
+    if is_distributed():
+        dist.init_process_group(backend="nccl" if device.type == "cuda" else "gloo")
+        rank, world_size = dist.get_rank(), dist.get_world_size()
+        if device.type == "cuda":
+            torch.cuda.set_device(int(os.environ.get("LOCAL_RANK", 0)))
+    logger = create_logger()
+    logger.info("Precompute configuration:\n %s", pformat(cfg.to_dict()))
+    save_dir = cfg.save_dir
+    os.makedirs(save_dir, exist_ok=True)
+
+    # == bucket the dataset as the training sampler does ==
+    dataset = build_module(cfg.dataset, DATASETS)
+    bucket = Bucket(cfg.bucket_config)
+    bucket_ids = build_bucket_ids(dataset, bucket, cfg.get("seed", 1024), cfg.get("bucket_cache_dir", None))
+    parts = build_parts(bucket, group_by_bucket_ids(bucket, bucket_ids), cfg.part_size, cfg.get("batch_size", None))
+
+    # == find the parts left to this rank ==
+    files = set(os.listdir(save_dir))
+    batches, batch_parts, writers = [], [], dict()
+    for part_id in range(rank, len(parts), world_size):
+        name = part_name(part_id)
+        if f"{name}.done" in files:
+            continue
+        if any(f.startswith(f"{name}-") and f.endswith(INDEX_SUFFIX) for f in files):
+            # interrupted part, skip the samples of its finished shards
+            writers[part_id] = LatentStoreWriter(save_dir, prefix=f"{name}-", shard_size=cfg.shard_size << 20)
+        done = writers[part_id].keys if part_id in writers else set()
+        for batch in parts[part_id]:
+            batch = [index for index in batch if sample_key(index.split("-")[0], "video") not in done]
+            if len(batch) > 0:
+                batches.append(batch)
+                batch_parts.append(part_id)
+        if len(batches) == 0 or batch_parts[-1] != part_id:
+            writers.pop(part_id, None)
+            open(done_path(save_dir, name), "w").close()
+    logger.info("%s parts in total, %s batches left on rank %s", len(parts), len(batches), rank)
+
+    # == build models ==
+    model_ae = build_module(cfg.ae, MODELS, device_map=device, torch_dtype=dtype).eval().requires_grad_(False)
+    del model_ae.decoder
+    model_t5 = model_clip = None
+    if cfg.get("t5", None) is not None:
+        model_t5 = build_module(cfg.t5, MODELS, device_map=device, torch_dtype=dtype).eval().requires_grad_(False)
+    if cfg.get("clip", None) is not None:
+        model_clip = build_module(cfg.clip, MODELS, device_map=device, torch_dtype=dtype).eval().requires_grad_(False)
+
+    # == encode ==
+    dataloader = DataLoader(
+        IndexedDataset(dataset),
+        batch_sampler=batches,
+        num_workers=cfg.get("num_workers", 8),
+        prefetch_factor=cfg.get("prefetch_factor", None),
+        pin_memory=device.type == "cuda",
+        collate_fn=collate_fn,
+    )
+    writer = None
+    for part_id, batch in tqdm(zip(batch_parts, dataloader), total=len(batches), disable=not is_main_process()):
+        if writer is None or writer.prefix != f"{part_name(part_id)}-":
+            if writer is not None:
+                writer.close()
+                open(done_path(save_dir, writer.prefix[:-1]), "w").close()
+            writer = writers.pop(part_id, None) or LatentStoreWriter(
+                save_dir, prefix=f"{part_name(part_id)}-", shard_size=cfg.shard_size << 20
+            )
+        if batch is None:  # every sample failed to load
+            continue
+        indices = batch["sample_index"].tolist()
+        if "video_transform" in batch:
+            video = resized_crop_on_device(batch["video"].to(device), batch["video_transform"]).to(dtype)
+        else:
+            video = batch["video"].to(device, dtype)
+        latents = model_ae.encode(video)
+        cache_latents(latents, [sample_key(i, "video") for i in indices], store=writer)
+        if model_t5 is not None:
+            cache_latents(model_t5(batch["text"]), [sample_key(i, "t5") for i in indices], store=writer)
+        if model_clip is not None:
+            cache_latents(model_clip(batch["text"]), [sample_key(i, "clip") for i in indices], store=writer)
+    if writer is not None:
+        writer.close()
+        open(done_path(save_dir, writer.prefix[:-1]), "w").close()
+
+    # == write the dataset of the encoded samples ==
+    if rank == 0:
+        # the other ranks may encode for longer than a collective timeout, so wait for their parts on disk
+        waiting = [name for name in map(part_name, range(len(parts))) if not os.path.exists(done_path(save_dir, name))]
+        if len(waiting) > 0:
+            logger.info("Waiting for %s parts encoded by other ranks", len(waiting))
+        while len(waiting) > 0:
+            time.sleep(cfg.get("poll_interval", 30))
+            waiting = [name for name in waiting if not os.path.exists(done_path(save_dir, name))]
+        store = LatentStore(save_dir)
+        # the metadata frame of memory efficient datasets, as in build_bucket_ids
+        data = dataset._data if isinstance(dataset.data, EfficientParquet) else dataset.data
+        encoded = [sample_key(i, "video") in store for i in range(len(data))]
+        data = data[encoded].copy()
+        positions = [i for i, ok in enumerate(encoded) if ok]
+        for name, column in KEY_COLUMNS.items():
+            # only the encoders that ran, cached_text then raises a KeyError instead of loading missing keys
+            if all(sample_key(i, name) in store for i in positions):
+                data[column] = [sample_key(i, name) for i in positions]
+        data.to_parquet(os.path.join(save_dir, "data.parquet"))
+        logger.info("Encoded %s of %s samples, dataset saved to %s/data.parquet", len(data), len(encoded), save_dir)
+        logger.info("Key columns: %s", [column for column in KEY_COLUMNS.values() if column in data])
+    if is_distributed():
+        dist.destroy_process_group()
+
+
+if __name__ == "__main__":
+    main()
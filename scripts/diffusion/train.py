@@ -27,7 +27,7 @@ from opensora.acceleration.checkpoint import (
 )
 from opensora.acceleration.parallel_states import get_data_parallel_group
 from opensora.datasets.aspect import bucket_to_shapes
-from opensora.datasets.dataloader import prepare_dataloader
+from opensora.datasets.dataloader import DevicePrefetcher, prepare_dataloader
 from opensora.datasets.pin_memory_cache import PinMemoryCache
 from opensora.models.mmdit.distributed import MMDiTPolicy
 from opensora.registry import DATASETS, MODELS, build_module
@@ -98,6 +98,8 @@ def main():
     PinMemoryCache.force_dtype = dtype
     pin_memory_cache_pre_alloc_numels = cfg.get("pin_memory_cache_pre_alloc_numels", None)
     PinMemoryCache.pre_alloc_numels = pin_memory_cache_pre_alloc_numels
+    pin_memory_cache_max_gb = cfg.get("pin_memory_cache_max_gb", None)
+    PinMemoryCache.max_pinned_bytes = int(pin_memory_cache_max_gb * 1024**3) if pin_memory_cache_max_gb else None
 
     # == init ColossalAI booster ==
     plugin_type = cfg.get("plugin", "zero2")
@@ -176,6 +178,7 @@ def main():
     dataloader, sampler = prepare_dataloader(
         bucket_config=cfg.get("bucket_config", None),
         num_bucket_build_workers=cfg.get("num_bucket_build_workers", 1),
+        bucket_cache_dir=cfg.get("bucket_cache_dir", None),
         **dataloader_args,
     )
     print_mem("after prepare_dataloader")
@@ -516,33 +519,24 @@ def main():
             initial=start_step,
             total=num_steps_per_epoch,
         ) as pbar:
-            pbar_iter = iter(pbar)
-
-            # prefetch one for non-blocking data loading
-            def fetch_data():
-                step, batch = next(pbar_iter)
-                # print(f"==debug== rank{dist.get_rank()} {dataloader_iter.get_cache_info()}")
-                pinned_video = batch["video"]
-                batch["video"] = pinned_video.to(device, dtype, non_blocking=True)
-                return batch, step, pinned_video
-
-            batch_, step_, pinned_video_ = fetch_data()
+            # move the next batch to device while the current step runs
+            prefetcher = DevicePrefetcher(
+                iter(pbar),
+                device,
+                dtype,
+                num_batches=num_steps_per_epoch - start_step,
+                release=dataloader_iter.remove_cache if cache_pin_memory else None,
+            )
 
             for _ in range(start_step, num_steps_per_epoch):
                 nsys.step()
                 # == load data ===
                 with nsys.range("load_data"), timers["load_data"]:
-                    batch, step, pinned_video = batch_, step_, pinned_video_
-
-                    if step + 1 < num_steps_per_epoch:
-                        # only fetch new data if not last step
-                        batch_, step_, pinned_video_ = fetch_data()
+                    step, batch = next(prefetcher)
 
                 # == run iter ==
                 with nsys.range("iter"), timers["iter"]:
                     inp, x_0, x_1 = prepare_inputs(batch)
-                    if cache_pin_memory:
-                        dataloader_iter.remove_cache(pinned_video)
                     loss = run_iter(inp, x_0, x_1)
 
                 # == update log info ==
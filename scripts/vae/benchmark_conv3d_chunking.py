@@ -0,0 +1,74 @@
+"""
+Time of the conv3d chunking strategies used for convolutions over CONV3D_NUMEL_LIMIT elements.
+
+"channel" accumulates partial sums over input channel shards, "time" and "height" split the output along
+that axis and read the input rows with the kernel halo. The cost table "auto" chooses from is printed too.
+A small --numel-limit forces chunking on shapes that fit on CPU.
+
+Usage:
+    python scripts/vae/benchmark_conv3d_chunking.py --shape 1 128 33 360 640 --numel-limit 268435456
+"""
+
+import argparse
+import time
+
+import torch
+import torch.nn.functional as F
+
+from opensora.models.vae.utils import CONV3D_CHUNK_DIMS, chunk_conv3d, measure_conv3d_chunk_costs
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--shape", type=int, nargs=5, default=[1, 64, 9, 128, 128], help="input B C T H W")
+    parser.add_argument("--out-channels", type=int, default=None, help="defaults to the input channels")
+    parser.add_argument("--kernel-size", type=int, default=3)
+    parser.add_argument("--numel-limit", type=int, default=2**22)
+    parser.add_argument("--repeat", type=int, default=3)
+    return parser.parse_args()
+
+
+def timeit(fn, repeat: int, device: torch.device) -> float:
+    fn()  # warmup
+    if device.type == "cuda":
+        torch.cuda.synchronize()
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    if device.type == "cuda":
+        torch.cuda.synchronize()
+    return (time.perf_counter() - start) / repeat * 1000
+
+
+@torch.inference_mode()
+def main():
+    args = parse_args()
+    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+    dtype = torch.bfloat16 if device.type == "cuda" else torch.float32
+    in_channels = args.shape[1]
+    out_channels = args.out_channels or in_channels
+    k = args.kernel_size
+    x = torch.randn(args.shape, device=device, dtype=dtype)
+    weight = torch.randn(out_channels, in_channels, k, k, k, device=device, dtype=dtype) / (in_channels * k**3) ** 0.5
+    bias = torch.randn(out_channels, device=device, dtype=dtype)
+    conv_args = ((1, 1, 1), (0, k // 2, k // 2), (1, 1, 1), 1)
+
+    reference = F.conv3d(x, weight, bias, *conv_args).float()
+    costs = measure_conv3d_chunk_costs(x, weight, *conv_args, args.numel_limit)
+    print(f"{'strategy':>10} {'ms':>10} {'estimated ms':>14} {'max diff':>10}")
+    for strategy in ("channel", *CONV3D_CHUNK_DIMS):
+        if strategy not in costs:
+            print(f"{strategy:>10} {'n/a':>10}")
+            continue
+
+        def run():
+            return chunk_conv3d(x, weight, bias, *conv_args, args.numel_limit, strategy=strategy)
+
+        ms = timeit(run, args.repeat, device)
+        diff = (run().float() - reference).abs().max().item()
+        print(f"{strategy:>10} {ms:>10.1f} {costs[strategy] * 1000:>14.1f} {diff:>10.2e}")
+    print(f"auto selects: {min(costs, key=costs.get)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+"""
+Time of the Hunyuan VAE mid block with the dense causal mask against the implicit frame causal path.
+
+"legacy mask" is the row by row mask construction the mid block used to run on every call,
+"dense" runs the diffusers attention with the (now vectorized and cached) dense mask, and
+"implicit" the mask-free frame causal attention used by default.
+
+Usage:
+    python scripts/vae/benchmark_mid_block.py --frames 9 17 33 --height 48 --width 85
+"""
+
+import argparse
+import time
+
+import torch
+
+from opensora.models.hunyuan_vae.unet_causal_3d_blocks import UNetMidBlockCausal3D, prepare_causal_attention_mask
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--frames", type=int, nargs="+", default=[5, 9, 17, 33], help="latent frames")
+    parser.add_argument("--height", type=int, default=24, help="latent height")
+    parser.add_argument("--width", type=int, default=42, help="latent width")
+    parser.add_argument("--channels", type=int, default=512)
+    parser.add_argument("--repeat", type=int, default=3)
+    return parser.parse_args()
+
+
+def legacy_causal_attention_mask(n_frame: int, n_hw: int, dtype, device) -> torch.Tensor:
+    seq_len = n_frame * n_hw
+    mask = torch.full((seq_len, seq_len), float("-inf"), dtype=dtype, device=device)
+    for i in range(seq_len):
+        i_frame = i // n_hw
+        mask[i, : (i_frame + 1) * n_hw] = 0
+    return mask
+
+
+def timeit(fn, repeat: int, device: torch.device) -> float:
+    if device.type == "cuda":
+        torch.cuda.synchronize()
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    if device.type == "cuda":
+        torch.cuda.synchronize()
+    return (time.perf_counter() - start) / repeat * 1000
+
+
+@torch.inference_mode()
+def main():
+    args = parse_args()
+    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+    dtype = torch.bfloat16 if device.type == "cuda" else torch.float32
+    block = UNetMidBlockCausal3D(args.channels, attention_head_dim=args.channels).to(device, dtype).eval()
+    n_hw = args.height * args.width
+
+    print(f"{'frames':>8} {'legacy mask ms':>15} {'dense ms':>10} {'implicit ms':>12} {'max diff':>10}")
+    for frames in args.frames:
+        x = torch.randn(1, args.channels, frames, args.height, args.width, device=device, dtype=dtype)
+
+        legacy_ms = timeit(lambda: legacy_causal_attention_mask(frames, n_hw, dtype, device), 1, device)
+
+        def dense():
+            mask = prepare_causal_attention_mask(frames, n_hw, dtype, device, batch_size=1)
+            return block(x, mask)
+
+        dense_ms = timeit(dense, args.repeat, device)
+        implicit_ms = timeit(lambda: block(x, None), args.repeat, device)
+        diff = (dense().float() - block(x, None).float()).abs().max().item()
+        print(f"{frames:>8} {legacy_ms:>15.1f} {dense_ms:>10.1f} {implicit_ms:>12.1f} {diff:>10.2e}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+"""
+Memory of the Hunyuan VAE streaming decode against the number of chunks decoded.
+
+After every chunk, prints the bytes held by the causal convolution states and by the mid-block attention
+key/value cache, the time of the chunk and, on GPU, the peak memory allocated while decoding it. The key/value
+cache grows by the latent frames of every chunk unless `--kv-cache-frames` bounds it; the difference of the
+bounded runs to the unbounded one is printed too. The model has random weights and a reduced width by default.
+
+Usage:
+    python scripts/vae/benchmark_streaming_decode.py --frames 32 --chunk-size 4 --kv-cache-frames -1 4 8
+"""
+
+import argparse
+import time
+
+import torch
+
+from opensora.models.hunyuan_vae.autoencoder_kl_causal_3d import AutoEncoder3DConfig, AutoencoderKLCausal3D
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--frames", type=int, default=32, help="latent frames")
+    parser.add_argument("--height", type=int, default=16, help="latent height")
+    parser.add_argument("--width", type=int, default=16, help="latent width")
+    parser.add_argument("--chunk-size", type=int, default=4, help="latent frames per chunk")
+    parser.add_argument("--block-out-channels", type=int, nargs="+", default=[32, 64, 64, 64])
+    parser.add_argument("--kv-cache-frames", type=int, nargs="+", default=[-1, 4], help="-1 keeps every frame")
+    parser.add_argument("--seed", type=int, default=0)
+    return parser.parse_args()
+
+
+def state_bytes(stream_state: dict) -> tuple[int, int]:
+    """Bytes of the convolution states and of the attention key/value cache."""
+    conv = attn = 0
+    for value in stream_state.values():
+        if isinstance(value, torch.Tensor):
+            conv += value.numel() * value.element_size()
+        elif isinstance(value, tuple):
+            attn += sum(x.numel() * x.element_size() for x in value)
+    return conv, attn
+
+
+@torch.inference_mode()
+def main():
+    args = parse_args()
+    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+    dtype = torch.bfloat16 if device.type == "cuda" else torch.float32
+    torch.manual_seed(args.seed)
+    config = AutoEncoder3DConfig(from_pretrained=None, block_out_channels=tuple(args.block_out_channels))
+    model = AutoencoderKLCausal3D(config).to(device, dtype).eval()
+    z = torch.randn(1, config.latent_channels, args.frames, args.height, args.width, device=device, dtype=dtype)
+
+    reference = None
+    for kv_cache_frames in args.kv_cache_frames:
+        model.decoder.mid_block.stream_kv_cache_frames = None if kv_cache_frames < 0 else kv_cache_frames
+        print(f"kv cache frames: {'all' if kv_cache_frames < 0 else kv_cache_frames}")
+        print(f"{'chunk':>6} {'conv MB':>8} {'kv MB':>8} {'peak MB':>8} {'ms':>8}")
+        chunks = []
+        stream = model.streaming_decode(z, chunk_size=args.chunk_size)
+        for i in range(0, args.frames, args.chunk_size):
+            if device.type == "cuda":
+                torch.cuda.synchronize()
+                torch.cuda.reset_peak_memory_stats()
+            start = time.perf_counter()
+            chunks.append(next(stream))
+            if device.type == "cuda":
+                torch.cuda.synchronize()
+            ms = (time.perf_counter() - start) * 1000
+            peak = f"{torch.cuda.max_memory_allocated() / 1024**2:.1f}" if device.type == "cuda" else "n/a"
+            conv, attn = state_bytes(model.decoder.mid_block.stream_state)
+            print(f"{i // args.chunk_size:>6} {conv / 1024**2:>8.2f} {attn / 1024**2:>8.2f} {peak:>8} {ms:>8.1f}")
+        stream.close()
+        video = torch.cat(chunks, dim=2).float()
+        if reference is None:
+            reference = video
+        else:
+            print(f"max diff to the first run: {(video - reference).abs().max().item():.2e}")
+
+
+if __name__ == "__main__":
+    main()
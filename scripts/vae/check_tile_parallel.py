@@ -0,0 +1,80 @@
+"""
+Check the tile parallel decode of the Hunyuan VAE when the ranks hold different samples.
+
+Every rank draws its own latents, as data parallel inference does, and decodes them once alone (the reference) and
+once with the tiles sharded over all ranks, as `enable_ae_tile_parallel` sets it up. With `--uneven`, rank r holds
+r more samples so that the number of tiles differs across ranks. Otherwise the decode without `batch_process_group`
+is reported too, it stitches tiles of different samples into one video. The model has random weights and a reduced
+width by default.
+
+Usage:
+    torchrun --nproc_per_node 2 scripts/vae/check_tile_parallel.py
+    torchrun --nproc_per_node 2 scripts/vae/check_tile_parallel.py --uneven
+"""
+
+import argparse
+
+import torch
+import torch.distributed as dist
+
+from opensora.models.hunyuan_vae.autoencoder_kl_causal_3d import AutoEncoder3DConfig, AutoencoderKLCausal3D
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--batch-size", type=int, default=1, help="samples per rank")
+    parser.add_argument("--uneven", action="store_true", help="rank r holds batch-size + r samples")
+    parser.add_argument("--frames", type=int, default=2, help="latent frames")
+    parser.add_argument("--height", type=int, default=10, help="latent height")
+    parser.add_argument("--width", type=int, default=10, help="latent width")
+    parser.add_argument("--tile-size", type=int, default=32, help="spatial tile size in pixels")
+    parser.add_argument("--block-out-channels", type=int, nargs="+", default=[32, 32, 32, 32])
+    parser.add_argument("--atol", type=float, default=1e-5)
+    parser.add_argument("--seed", type=int, default=1024)
+    return parser.parse_args()
+
+
+def max_error(x: torch.Tensor, y: torch.Tensor) -> float:
+    error = (x - y).abs().max().reshape(1)
+    dist.all_reduce(error, op=dist.ReduceOp.MAX)
+    return error.item()
+
+
+@torch.inference_mode()
+def main():
+    args = parse_args()
+    dist.init_process_group(backend="gloo")
+    rank, world_size = dist.get_rank(), dist.get_world_size()
+
+    torch.manual_seed(args.seed)
+    config = AutoEncoder3DConfig(
+        from_pretrained=None,
+        block_out_channels=tuple(args.block_out_channels),
+        sample_size=args.tile_size,
+        use_spatial_tiling=True,
+    )
+    model = AutoencoderKLCausal3D(config).eval()
+    generator = torch.Generator().manual_seed(args.seed + rank)
+    batch_size = args.batch_size + (rank if args.uneven else 0)
+    z = torch.randn(batch_size, config.latent_channels, args.frames, args.height, args.width, generator=generator)
+
+    reference = model.decode(z)
+    model.enable_tile_parallel(dist.group.WORLD, batch_process_group=dist.group.WORLD)
+    error = max_error(model.decode(z), reference)
+    if rank == 0:
+        print(f"{world_size} ranks, max abs error against the unsharded decode: {error:.2e}")
+    if not args.uneven:
+        # the ranks must hold the same samples without gathering, here they do not
+        model.enable_tile_parallel(dist.group.WORLD)
+        mixed_error = max_error(model.decode(z), reference)
+        if rank == 0:
+            print(f"without batch_process_group: {mixed_error:.2e}")
+    if rank == 0:
+        print("FAILED" if error > args.atol else "OK")
+    dist.destroy_process_group()
+    if error > args.atol:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
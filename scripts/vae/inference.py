@@ -80,6 +80,7 @@ def main():
     dataloader, sampler = prepare_dataloader(
         bucket_config=bucket_config,
         num_bucket_build_workers=cfg.get("num_bucket_build_workers", 1),
+        bucket_cache_dir=cfg.get("bucket_cache_dir", None),
         **dataloader_args,
     )
     dataiter = iter(dataloader)
@@ -78,6 +78,7 @@ def main():
     dataloader, _ = prepare_dataloader(
         bucket_config=bucket_config,
         num_bucket_build_workers=cfg.get("num_bucket_build_workers", 1),
+        bucket_cache_dir=cfg.get("bucket_cache_dir", None),
         **dataloader_args,
     )
     dataiter = iter(dataloader)
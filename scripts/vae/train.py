@@ -22,7 +22,7 @@ from tqdm import tqdm
 import wandb
 from opensora.acceleration.checkpoint import set_grad_checkpoint
 from opensora.acceleration.parallel_states import get_data_parallel_group
-from opensora.datasets.dataloader import prepare_dataloader
+from opensora.datasets.dataloader import DevicePrefetcher, prepare_dataloader
 from opensora.datasets.pin_memory_cache import PinMemoryCache
 from opensora.models.vae.losses import DiscriminatorLoss, GeneratorLoss, VAELoss
 from opensora.registry import DATASETS, MODELS, build_module
@@ -68,6 +68,8 @@ def main():
     PinMemoryCache.force_dtype = dtype
     pin_memory_cache_pre_alloc_numels = cfg.get("pin_memory_cache_pre_alloc_numels", None)
     PinMemoryCache.pre_alloc_numels = pin_memory_cache_pre_alloc_numels
+    pin_memory_cache_max_gb = cfg.get("pin_memory_cache_max_gb", None)
+    PinMemoryCache.max_pinned_bytes = int(pin_memory_cache_max_gb * 1024**3) if pin_memory_cache_max_gb else None
 
     # == init ColossalAI booster ==
     plugin_type = cfg.get("plugin", "zero2")
@@ -133,6 +135,7 @@ def main():
     dataloader, sampler = prepare_dataloader(
         bucket_config=cfg.get("bucket_config", None),
         num_bucket_build_workers=cfg.get("num_bucket_build_workers", 1),
+        bucket_cache_dir=cfg.get("bucket_cache_dir", None),
         **dataloader_args,
     )
     num_steps_per_epoch = len(dataloader)
@@ -335,15 +338,14 @@ def main():
             total=num_steps_per_epoch,
             initial=start_step,
         ) as pbar:
-            pbar_iter = iter(pbar)
-
-            def fetch_data():
-                step, batch = next(pbar_iter)
-                pinned_video = batch["video"]
-                batch["video"] = pinned_video.to(device, dtype, non_blocking=True)
-                return batch, step, pinned_video
-
-            batch_, step_, pinned_video_ = fetch_data()
+            # move the next batch to device while the current step runs
+            prefetcher = DevicePrefetcher(
+                iter(pbar),
+                device,
+                dtype,
+                num_batches=num_steps_per_epoch - start_step,
+                release=dataiter.remove_cache if cache_pin_memory else None,
+            )
 
             profiler_ctxt = (
                 profile(
@@ -364,9 +366,7 @@ def main():
                         break
 
                     # == load data ===
-                    batch, step, pinned_video = batch_, step_, pinned_video_
-                    if step + 1 < num_steps_per_epoch:
-                        batch_, step_, pinned_video_ = fetch_data()
+                    step, batch = next(prefetcher)
 
                     # == log config ==
                     global_step = epoch * num_steps_per_epoch + step
@@ -394,9 +394,6 @@ def main():
                         if cfg.get("profile", False):
                             profiler_ctxt.step()
 
-                        if cache_pin_memory:
-                            dataiter.remove_cache(pinned_video)
-
                         # == loss initialization ==
                         vae_loss = torch.tensor(0.0, device=device, dtype=dtype)
                         loss_dict = {}  # loss at every step